@@ -0,0 +1,209 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import sys
+import argparse
+import cv2
+import numpy as np
+import torch
+import yaml
+from ultralytics import YOLO
+from ultralytics.engine.results import Boxes
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+from gate_counter import GateCounter, parse_dets, COL_ID
+from roi_crop import roi_imgsz, to_full_frame
+
+# ファイル処理用: YOLO検出は N フレームまとめてバッチ推論し、
+# ByteTrack の更新はフレーム順に1枚ずつ行う（model.track の per-frame 経路と同じIDになる）
+#   python batch_track.py                       # 合成動画（bench_pipeline）で per-frame の model.track とIDとカウントを比べる
+#   python batch_track.py ./videos/test.mp4     # 録画で比べる（通過0件なら失敗）
+#   重みが無ければ yolo11n.yaml から固定の乱数で作ったモデルで比べる（ダウンロード不要）
+
+BATCH = 8                   # 1回の推論でまとめるフレーム数
+
+
+def make_tracker(tracker="bytetrack.yaml"):
+    """model.track(tracker=...) と同じ設定の BYTETracker を作る"""
+    with open(check_yaml(tracker), encoding="utf-8") as f:
+        cfg = IterableSimpleNamespace(**yaml.safe_load(f))
+    return BYTETracker(args=cfg)
+
+
+def apply_tracks(r, tracks):
+    """tracker.update の出力で Results を追跡済みの boxes に置き換える（model.track と同じ処理）"""
+    if len(tracks) == 0:
+        return r[:0]
+    idx = tracks[:, -1].astype(int)
+    r = r[idx]
+    r.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return r
+
+
+def skip_frame(tracker, frame):
+    """推論を省略したフレームでも追跡器の時間を1フレーム進める（見失い中のトラックが正しく失効する）"""
+    if tracker is not None:
+        tracker.update(Boxes(np.zeros((0, 6), np.float32), frame.shape[:2]), frame)
+
+
+def model_tracker(model):
+    """model.track が内部で持っている追跡器（まだ1回も track していなければ None）"""
+    trackers = getattr(getattr(model, "predictor", None), "trackers", None)
+    return trackers[0] if trackers else None
+
+
+class BatchTracker:
+    """検出はバッチ、追跡は逐次で行う model.track の置き換え"""
+
+    def __init__(self, model, tracker="bytetrack.yaml", models=None, prep=None):
+        self.model = model
+        self.models = models        # model_backend.ModelSet（imgsz 毎の書き出し済みモデル）
+        self.prep = prep            # preproc.TensorPrep（事前確保したバッファで前処理して推論）
+        self.tracker = make_tracker(tracker)
+
+    def reset(self):
+        self.tracker.reset()
+
+    def track(self, frames, imgsz, device, conf, iou, classes, run=None, roi=None):
+        """frames（同一サイズのBGR画像のリスト）を推論・追跡し、フレーム毎の results リストを返す
+
+        run: フレーム毎に推論するかのリスト（False のフレームは検出なしで追跡器だけ進め、None を返す）
+        roi: (x1,y1,x2,y2) を指定するとその範囲だけを同じ縮尺で推論し、枠はフル画面座標に戻す
+        """
+        run = run or [True]*len(frames)
+        targets = [f for f, ok in zip(frames, run) if ok]
+        if roi is not None and targets:
+            h, w = targets[0].shape[:2]
+            imgsz = roi_imgsz(roi, w, h, imgsz)
+            targets = [f[roi[1]:roi[3], roi[0]:roi[2]] for f in targets]
+        model = self.models.get(imgsz) if self.models is not None else self.model
+        if not targets:
+            preds = iter([])
+        elif self.prep is not None:
+            preds = iter(self.prep.detect(model, targets, imgsz, device, conf, iou, classes))
+        else:
+            preds = iter(model.predict(
+                source=targets,
+                imgsz=imgsz,
+                device=device,
+                conf=conf,
+                iou=iou,
+                classes=classes,
+                verbose=False,
+                stream=False
+            ))
+        out = []
+        for f, ok in zip(frames, run):
+            if not ok:
+                skip_frame(self.tracker, f)
+                out.append(None)
+                continue
+            r = next(preds)
+            if roi is not None:
+                r = to_full_frame(r, roi, f)
+            tracks = self.tracker.update(r.boxes.cpu().numpy(), r.orig_img)
+            out.append([apply_tracks(r, tracks)])
+        return out
+
+
+def _count_clip(path, gate_fn, step_fn, fps):
+    """動画を読み、step_fn(frames) の結果をゲートカウンタに通して (counter, フレーム毎のID列) を返す"""
+    cap = cv2.VideoCapture(path)
+    ok, frame = cap.read()
+    if not ok:
+        print(f"[ERROR] ソースを開けませんでした: {path}", file=sys.stderr); sys.exit(1)
+    h, w = frame.shape[:2]
+    counter = GateCounter(gate_fn(w, h))
+    ids = []
+    idx = 0
+    frames = [frame]
+    while True:
+        ok, frame = cap.read()
+        if ok:
+            frames.append(frame)
+        if frames and (not ok or len(frames) >= step_fn.batch):
+            for results in step_fn(frames):
+                dets = parse_dets(results)
+                counter.update(dets, idx / fps)   # 壁時計でなく動画時刻で比較する
+                ids.append(sorted(dets[:, COL_ID].astype(int).tolist()))
+                idx += 1
+            frames = []
+        if not ok:
+            break
+    cap.release()
+    return counter, ids
+
+
+def make_model(model_path, seed=0):
+    """model_path の YOLO。.yaml なら固定の乱数で重みを作る（何度作っても同じ重み）"""
+    if not model_path.endswith((".yaml", ".yml")):
+        return YOLO(model_path)
+    torch.manual_seed(seed)
+    model = YOLO(model_path)
+    # クラスのバイアスの初期値では何も検出しないので 0 にする（どの枠もスコア 0.5 前後になり、
+    # 車両の動きで枠が揺れるのでゲートの通過も起きる）
+    for head in model.model.model[-1].cv3:
+        head[-1].bias.data.zero_()
+    return model
+
+
+def parity_check(path, model_path, batch=BATCH, imgsz=640, conf=0.25, iou=0.45, classes=None):
+    """per-frame の model.track と、バッチ推論（TensorPrep の前処理）+逐次追跡でIDとカウントが一致するか確認する
+
+    main.py / test.py の既定（PREALLOC）と同じ BatchTracker(prep=TensorPrep()) の経路を、同じ重みの
+    別インスタンスで比べる。通過が0件の動画では何も確かめられないので不一致と同じく False を返す。
+    """
+    from preproc import TensorPrep
+    kw = dict(imgsz=imgsz, device="cpu", conf=conf, iou=iou, classes=classes)
+    gate_fn = lambda w, h: [int(w*0.5), int(h*0.6), int(w*0.8), int(h*0.8)]
+    fps = 30.0
+
+    ref_model = make_model(model_path)
+    def per_frame(frames):
+        return [ref_model.track(source=f, tracker="bytetrack.yaml", persist=True, verbose=False, stream=False, **kw)
+                for f in frames]
+    per_frame.batch = 1
+
+    bt = BatchTracker(make_model(model_path), prep=TensorPrep())
+    def batched(frames):
+        return bt.track(frames, **kw)
+    batched.batch = batch
+
+    c_ref, ids_ref = _count_clip(path, gate_fn, per_frame, fps)
+    c_bat, ids_bat = _count_clip(path, gate_fn, batched, fps)
+
+    same_ids = ids_ref == ids_bat
+    same_counts = c_ref.total == c_bat.total and c_ref.class_counts == c_bat.class_counts
+    print(f"per-frame : frames={len(ids_ref)} total={c_ref.total} ids={len({t for f in ids_ref for t in f})}")
+    print(f"batch({batch}): frames={len(ids_bat)} total={c_bat.total} ids={len({t for f in ids_bat for t in f})}")
+    print(f"IDs {'一致' if same_ids else '不一致'} / counts {'一致' if same_counts else '不一致'}")
+    if c_ref.total == 0:
+        print("[ERROR] 通過が0件なので比較になりません（通過する車両が検出される動画/モデルで確認してください）",
+              file=sys.stderr)
+        return False
+    return same_ids and same_counts
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="バッチ推論+逐次追跡と per-frame model.track のパリティ確認")
+    ap.add_argument("source", nargs="?", default=None, help="確認に使う動画ファイル（省略時は合成動画）")
+    ap.add_argument("--model", default=None, help="重み（省略時は ./models/yolo11n.pt、無ければ yolo11n.yaml の乱数の重み）")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--classes", default="", help="カンマ区切りのCOCOクラスID（省略時は全クラス）")
+    ap.add_argument("--frames", type=int, default=300, help="合成動画のフレーム数")
+    args = ap.parse_args()
+    classes = [int(c) for c in args.classes.split(",")] if args.classes else None
+    model_path = args.model or ("./models/yolo11n.pt" if os.path.exists("./models/yolo11n.pt") else "yolo11n.yaml")
+    source = args.source
+    if source is None:
+        # bench_pipeline の合成動画（シード固定。ゲートは main.py の初期ゲートと同じ比率）
+        from bench_pipeline import make_clip, clip_path, CLIP_DIR
+        os.makedirs(CLIP_DIR, exist_ok=True)
+        source = clip_path(1280, 720, args.frames, 6.0, 0)
+        if not os.path.exists(source):
+            print(f"合成動画を作成中: {source}  (正解 {make_clip(source, 1280, 720, args.frames)} 台)")
+    print(f"model: {model_path}")
+    ok = parity_check(source, model_path, args.batch, args.imgsz, args.conf, classes=classes)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,103 @@
+import time
+import argparse
+from collections import defaultdict
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+from gate_counter import GateCounter, parse_dets
+
+# 検出結果処理 + ゲート通過判定のマイクロベンチマーク
+# 従来の `for b in r.boxes` ループ（box毎に .item()/.tolist()）と、配列演算版 GateCounter を比較する。
+#   python bench_gate.py                 # 10 / 100 / 1000 boxes
+#   python bench_gate.py --boxes 50 500 --frames 500
+
+W, H = 1920, 1080
+GATE = [int(W*0.1), int(H*0.45), int(W*0.9), int(H*0.55)]
+
+
+def make_frames(n_boxes, n_frames, seed=0):
+    """n_boxes 台が下向きに流れる (N,7) 検出配列の列。画面下に出たIDは新しいIDで上から入る"""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, W-80, n_boxes)
+    y = rng.uniform(-H, H, n_boxes)
+    v = rng.uniform(4, 20, n_boxes)
+    ids = np.arange(1, n_boxes+1)
+    cls = rng.choice([2, 5, 7], n_boxes)
+    next_id = n_boxes + 1
+    frames = []
+    for _ in range(n_frames):
+        y += v
+        out = y > H
+        k = int(out.sum())
+        if k:
+            y[out] = -60.0
+            ids[out] = np.arange(next_id, next_id+k); next_id += k
+        data = np.stack([x, y, x+80, y+60, ids, rng.uniform(0.3, 0.9, n_boxes), cls], 1).astype(np.float32)
+        frames.append(data)
+    return frames
+
+
+def to_results(data, orig_img):
+    return [Results(orig_img, path="", names={i: str(i) for i in range(80)}, boxes=torch.from_numpy(data))]
+
+
+def loop_reference(results, state, gate, now):
+    """従来の main.py のループ（比較用にそのまま移植）"""
+    counted, last_seen, inside_prev = state
+    x1,y1,x2,y2 = gate
+    dets = []
+    r = results[0]
+    if r.boxes is not None and r.boxes.id is not None:
+        for b in r.boxes:
+            xyxy = b.xyxy[0].tolist()
+            tid  = int(b.id.item())
+            cls  = int(b.cls.item())
+            confb= float(b.conf.item())
+            dets.append((tid, cls, confb, xyxy))
+    total = 0
+    for (tid, cls, confb, (bx1,by1,bx2,by2)) in dets:
+        cx = int((bx1+bx2)/2); cy = int((by1+by2)/2)
+        last_seen[tid] = now
+        inside = (y1 <= cy <= y2) and (x1 <= cx <= x2)
+        if inside_prev[tid] and not inside and tid not in counted:
+            counted.add(tid)
+            total += 1
+        inside_prev[tid] = inside
+    to_del = [tid for tid,t in last_seen.items() if now - t > 2.0]
+    for tid in to_del:
+        last_seen.pop(tid, None)
+        inside_prev.pop(tid, None)
+    return total
+
+
+def bench(n_boxes, n_frames):
+    frames = make_frames(n_boxes, n_frames)
+    img = np.zeros((H, W, 3), np.uint8)
+    results = [to_results(d, img) for d in frames]
+
+    state = (set(), defaultdict(lambda: 0.0), defaultdict(lambda: False))
+    t0 = time.perf_counter(); total_ref = 0
+    for i, res in enumerate(results):
+        total_ref += loop_reference(res, state, GATE, i/30)
+    t_ref = time.perf_counter() - t0
+
+    counter = GateCounter(list(GATE))
+    t0 = time.perf_counter()
+    for i, res in enumerate(results):
+        counter.update(parse_dets(res), i/30)
+    t_vec = time.perf_counter() - t0
+
+    ms_ref = t_ref / n_frames * 1e3; ms_vec = t_vec / n_frames * 1e3
+    ok = "一致" if total_ref == counter.total else f"不一致 ({total_ref} != {counter.total})"
+    print(f"{n_boxes:5d} boxes: loop {ms_ref:8.3f} ms/frame   vectorized {ms_vec:7.3f} ms/frame"
+          f"   x{ms_ref/max(ms_vec,1e-9):5.1f}   count {ok}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="ゲート判定のループ版と配列演算版の比較")
+    ap.add_argument("--boxes", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--frames", type=int, default=300)
+    args = ap.parse_args()
+    torch.set_num_threads(1)
+    for n in args.boxes:
+        bench(n, args.frames)
@@ -0,0 +1,305 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import numpy as np
+import cv2
+import torch
+from ultralytics.engine.results import Results
+from batch_track import make_tracker, apply_tracks
+from gate_counter import GateCounter, parse_dets
+from event_log import EventLog
+from count_store import CountStore
+
+# カウント処理の段階別レイテンシのベンチマーク（オフライン・CPUのみで再現できる）
+#   1. 合成の交通動画を作る（道路の背景 + 車線を流れる矩形の車両。シードが同じなら同じ動画）
+#   2. main.py / test.py と同じ部品（検出 → ByteTrack → GateCounter → 描画 → 保存/イベントログ）を
+#      1フレームずつ順に通し、段階毎の処理時間を測る
+#   3. p50/p90/p99 などを JSON に保存する。--compare で以前の結果と比べる
+#
+# 検出器:
+#   yolo    … --model の重みで推論（preprocess / inference / postprocess は ultralytics の計測値）
+#   contour … 合成動画の車両（彩度の高い矩形）を輪郭抽出で検出。重みが無い環境でも追跡以降を測れる
+#   auto    … --model のファイルがあれば yolo、無ければ contour（自動ダウンロードはしない）
+#
+#   python bench_pipeline.py                          # 1280x720, 300フレーム, auto
+#   python bench_pipeline.py --size 1920x1080 --density 12 --detector yolo --imgsz 640
+#   python bench_pipeline.py --out after.json --compare before.json
+
+MODEL = "./models/yolo11n.pt"
+CLIP_DIR = "bench_clips"
+RESULT_DIR = "bench_results"
+GATE = [0.5, 0.6, 0.8, 0.8]     # main.py の初期ゲートと同じ比率
+N_LANES = 8
+STAGES = ("decode", "preprocess", "inference", "postprocess", "track", "gate", "draw", "output")
+PERCENTILES = (50, 90, 99)
+
+
+def gate_px(w, h):
+    return [int(GATE[0]*w), int(GATE[1]*h), int(GATE[2]*w), int(GATE[3]*h)]
+
+
+def make_clip(path, w, h, n_frames, fps=30.0, density=6.0, seed=0):
+    """合成の交通動画を書き出し、ゲート通過台数の正解を返す
+
+    density: 画面内にいる車両の平均台数。車線の半分は下向き、半分は上向き
+    """
+    rng = np.random.default_rng(seed)
+    # 背景: 灰色の路面 + 固定のノイズ模様 + 車線の区切り線
+    bg = np.clip(rng.normal(100, 6, (h, w, 1)), 0, 255).astype(np.uint8).repeat(3, 2)
+    lane_w = w // N_LANES
+    for i in range(1, N_LANES):
+        cv2.line(bg, (i*lane_w, 0), (i*lane_w, h), (235, 235, 235), 2)
+
+    # 車線毎に一定速度で、前の車と重ならない間隔で車両を流す
+    vehicles = []
+    for lane in range(N_LANES):
+        down = lane < N_LANES // 2
+        speed = rng.uniform(0.006, 0.012) * h               # px/frame（ゲートの厚みより十分小さい）
+        length = int(rng.uniform(0.08, 0.14) * h)
+        travel = (h + length) / speed
+        rate = density / N_LANES / travel                   # 1フレームあたりの到着数
+        t = rng.exponential(1/rate) - travel                # 開始時点で画面内にいる車両も作る
+        while t < n_frames:
+            width = int(lane_w * rng.uniform(0.45, 0.7))
+            x = lane*lane_w + (lane_w - width)//2
+            color = tuple(int(c) for c in rng.choice([(40, 40, 220), (220, 60, 40), (40, 200, 60), (30, 200, 230), (200, 40, 200)]))
+            vehicles.append((t, x, width, length, speed, down, color))
+            t += max(rng.exponential(1/rate), (length + 0.05*h) / speed)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    if not writer.isOpened():
+        raise RuntimeError(f"書き込めません: {path}")
+    gx1, gy1, gx2, gy2 = gate_px(w, h)
+    truth = 0
+    for f in range(n_frames):
+        frame = bg.copy()
+        for (t0, x, width, length, speed, down, color) in vehicles:
+            d = (f - t0) * speed
+            if d < 0 or d > h + length:
+                continue
+            y = int(d - length) if down else int(h - d)
+            cv2.rectangle(frame, (x, y), (x+width, y+length), color, -1)
+            cv2.rectangle(frame, (x+width//6, y+length//5), (x+width*5//6, y+length*2//5), (60, 60, 60), -1)
+            # 中心がゲート帯から出たフレームで正解を数える（GateCounter と同じ「内→外」）
+            cx = x + width//2
+            cy = int(y + length/2); py = int((d - speed - length if down else h - d + speed) + length/2)
+            if gx1 <= cx <= gx2 and gy1 <= py <= gy2 and not (gy1 <= cy <= gy2):
+                truth += 1
+        writer.write(frame)
+    writer.release()
+    return truth
+
+
+def clip_path(w, h, n_frames, density, seed):
+    return os.path.join(CLIP_DIR, f"synth_{w}x{h}_{n_frames}f_d{density:g}_s{seed}.mp4")
+
+
+class ContourDetector:
+    """合成動画用の検出器: 彩度の高い領域の外接矩形を「車」(cls=2) として返す"""
+
+    def __init__(self, min_area=400):
+        self.min_area = min_area
+        self.names = {i: str(i) for i in range(80)}
+
+    def __call__(self, frame):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        mask = cv2.threshold(hsv[:, :, 1], 120, 255, cv2.THRESH_BINARY)[1]
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        boxes = [(x, y, x+bw, y+bh, 0.9, 2) for x, y, bw, bh in map(cv2.boundingRect, contours) if bw*bh >= self.min_area]
+        data = torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6)
+        return Results(frame, path="", names=self.names, boxes=data)
+
+
+def draw(frame, events, gate, counter, fps):
+    """main.py の draw と同じ描画（ゲート/検出枠/ラベル/HUD）"""
+    from main import put
+    x1,y1,x2,y2 = gate
+    cv2.rectangle(frame, (x1,y1), (x2,y2), (0,0,255), 2)
+    put(frame, f"GATE y:{y1}-{y2}", (10, max(20,y1-8)), 0.7, (70,200,255))
+    for (tid, cls, confb, (bx1,by1,bx2,by2), cx, cy, crossed, direction) in events:
+        color = (0,255,0) if not counter.is_counted(tid) else (128,128,128)
+        cv2.rectangle(frame, (int(bx1),int(by1)), (int(bx2),int(by2)), color, 2)
+        put(frame, f"ID:{tid} C{cls} {confb:.2f}", (int(bx1), max(15,int(by1)-6)), 0.55, (200,255,200))
+        cv2.circle(frame, (cx,cy), 3, (255,255,255), -1)
+    put(frame, f"TOTAL: {counter.total}", (10, 24), 0.9, (50,255,50), 2)
+    put(frame, f"FPS: {fps:5.1f}", (10, 50), 0.7, (200,200,255))
+
+
+def summarize(samples):
+    """段階毎のミリ秒の列 → 統計値"""
+    out = {}
+    for name, v in samples.items():
+        if not v:
+            continue
+        a = np.asarray(v) * 1e3
+        out[name] = {"mean": round(float(a.mean()), 4), "max": round(float(a.max()), 4), "n": len(a)}
+        out[name].update({f"p{p}": round(float(np.percentile(a, p)), 4) for p in PERCENTILES})
+    return out
+
+
+def run(path, detector="auto", model_path=MODEL, imgsz=640, conf=0.25, iou=0.45, direction_mode="motion",
+        write_output=True, warmup=5):
+    """1本の動画を段階毎に計測しながら処理して (統計, 情報) を返す"""
+    if detector == "auto":
+        detector = "yolo" if os.path.exists(model_path) else "contour"
+    if detector == "yolo":
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+        detect = lambda frame: model.predict(frame, imgsz=imgsz, conf=conf, iou=iou, classes=[2,5,7], device="cpu", verbose=False)[0]
+    else:
+        detect = ContourDetector()
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"ソースを開けませんでした: {path}")
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps_in = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    gate = gate_px(w, h)
+    tracker = make_tracker("bytetrack.yaml")
+    counter = GateCounter(gate, direction_mode=direction_mode)
+
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    writer = cv2.VideoWriter(os.path.join(tmp, "out.mp4"), cv2.VideoWriter_fourcc(*"mp4v"), fps_in, (w, h)) if write_output else None
+    elog = EventLog(os.path.join(tmp, "events")) if write_output else None
+    store = CountStore(os.path.join(tmp, "counts")) if write_output else None
+
+    samples = {s: [] for s in STAGES + ("frame",)}
+    clock = time.perf_counter
+    idx = 0; fps = 0.0
+    try:
+        while True:
+            t_frame = t = clock()
+            ok, frame = cap.read()
+            if not ok:
+                break
+            lap = {"decode": clock() - t}
+
+            t = clock()
+            r = detect(frame)
+            if detector == "yolo":
+                # ultralytics の計測値（ms）をそのまま使う
+                for k in ("preprocess", "inference", "postprocess"):
+                    lap[k] = (r.speed.get(k) or 0.0) / 1e3
+            else:
+                lap["inference"] = clock() - t
+
+            t = clock()
+            r = apply_tracks(r, tracker.update(r.boxes.cpu().numpy(), r.orig_img))
+            lap["track"] = clock() - t
+
+            t = clock()
+            now = idx / fps_in                      # 動画時刻（実行速度に依存しない）
+            events = counter.update(parse_dets([r]), now)
+            lap["gate"] = clock() - t
+
+            t = clock()
+            draw(frame, events, gate, counter, fps)
+            lap["draw"] = clock() - t
+
+            if write_output:
+                t = clock()
+                writer.write(frame)
+                elog.append(events, now)
+                store.add(events, now)
+                lap["output"] = clock() - t
+
+            lap["frame"] = clock() - t_frame
+            fps = 0.9*fps + 0.1/max(lap["frame"], 1e-6)
+            if idx >= warmup:                       # 先頭はモデル/メモリの初期化が乗るので除く
+                for k, v in lap.items():
+                    samples[k].append(v)
+            idx += 1
+    finally:
+        cap.release()
+        if writer is not None: writer.release()
+        if elog is not None: elog.close()
+        if store is not None: store.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    info = {"detector": detector, "frames": idx, "width": w, "height": h, "total": counter.total,
+            "class_counts": counter.class_counts}
+    return summarize(samples), info
+
+
+def compare(cur, old):
+    """以前の結果と p50 / p99 を比べて表示する"""
+    print(f"{'stage':12s} {'p50 old':>9s} {'p50 new':>9s} {'Δ%':>7s}   {'p99 old':>9s} {'p99 new':>9s} {'Δ%':>7s}")
+    for name, s in cur["stages"].items():
+        o = old.get("stages", {}).get(name)
+        if not o:
+            continue
+        d50 = (s["p50"] - o["p50"]) / max(o["p50"], 1e-9) * 100
+        d99 = (s["p99"] - o["p99"]) / max(o["p99"], 1e-9) * 100
+        print(f"{name:12s} {o['p50']:9.3f} {s['p50']:9.3f} {d50:+7.1f}   {o['p99']:9.3f} {s['p99']:9.3f} {d99:+7.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="合成の交通動画でカウント処理の段階別レイテンシを測る")
+    ap.add_argument("--size", default="1280x720", help="合成動画の解像度 WxH")
+    ap.add_argument("--frames", type=int, default=300)
+    ap.add_argument("--density", type=float, default=6.0, help="画面内の平均車両数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--clip", default=None, help="合成せずにこの動画を使う")
+    ap.add_argument("--detector", choices=["auto", "yolo", "contour"], default="auto")
+    ap.add_argument("--model", default=MODEL)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--mode", choices=["main", "test"], default="main", help="main: motion 方向判定 / test: gate_center")
+    ap.add_argument("--threads", type=int, default=None, help="torch のスレッド数")
+    ap.add_argument("--no-output", action="store_true", help="保存/イベントログの段階を測らない")
+    ap.add_argument("--out", default=None, help="結果JSON（省略時は bench_results/<時刻>.json）")
+    ap.add_argument("--compare", default=None, help="比較する以前の結果JSON")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    truth = None
+    if args.clip:
+        path = args.clip
+    else:
+        w, h = (int(v) for v in args.size.lower().split("x"))
+        os.makedirs(CLIP_DIR, exist_ok=True)
+        path = clip_path(w, h, args.frames, args.density, args.seed)
+        meta_path = path + ".json"
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            print(f"合成動画を作成中: {path}")
+            truth = make_clip(path, w, h, args.frames, density=args.density, seed=args.seed)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"truth": truth}, f)
+        else:
+            with open(meta_path, encoding="utf-8") as f:
+                truth = json.load(f)["truth"]
+
+    stages, info = run(path, args.detector, args.model, args.imgsz,
+                       direction_mode="motion" if args.mode == "main" else "gate_center",
+                       write_output=not args.no_output)
+    result = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "clip": path, "truth": truth, "mode": args.mode, "imgsz": args.imgsz,
+        "info": info,
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count(),
+                "torch": torch.__version__, "torch_threads": torch.get_num_threads(),
+                "opencv": cv2.__version__, "numpy": np.__version__},
+        "stages": stages,
+    }
+
+    print(f"{path}  {info['width']}x{info['height']}  frames:{info['frames']}  detector:{info['detector']}"
+          f"  total:{info['total']}" + (f" (正解 {truth})" if truth is not None else ""))
+    print(f"{'stage':12s} {'mean':>8s} " + " ".join(f"{'p'+str(p):>8s}" for p in PERCENTILES) + f" {'max':>8s}  (ms)")
+    for name, s in stages.items():
+        print(f"{name:12s} {s['mean']:8.3f} " + " ".join(f"{s['p'+str(p)]:8.3f}" for p in PERCENTILES) + f" {s['max']:8.3f}")
+
+    out = args.out or os.path.join(RESULT_DIR, time.strftime("%Y%m%d_%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"保存しました: {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
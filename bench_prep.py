@@ -0,0 +1,110 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import cv2
+import torch
+from ultralytics import YOLO
+from preproc import FramePool, TensorPrep
+
+# 前処理（読み込み → letterbox → 入力テンソル）の確保量と時間の比較
+#   before  : cap.read() + ultralytics の前処理（LetterBox / stack / flip / float）… model.predict(frame) の内部と同じ
+#   prealloc: FramePool に cap.read(image=buf) + 固定バッファへの letterbox と入力テンソルへの変換
+#   確保量は numpy/OpenCV 分を tracemalloc（1フレームの間の増分のピーク）、torch 分を torch.profiler で測る
+#   推論を含めた時間（model.predict / TensorPrep.detect）も出す
+#   python bench_prep.py ./videos/test.mp4 --imgsz 960 --frames 100
+
+def read_frames(cap, n, pool=None):
+    """n フレーム読んで返す（pool があればバッファを返しながら読む）"""
+    for _ in range(n):
+        ok, frame = pool.read(cap) if pool is not None else cap.read()
+        if not ok:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = pool.read(cap) if pool is not None else cap.read()
+        yield frame
+        if pool is not None:
+            pool.release(frame)
+
+
+def measure(step, frames):
+    """step(frame) の1フレームあたりの (ms, numpy の確保ピーク KB, torch の確保 KB)"""
+    peaks = []; t_total = 0.0
+    tracemalloc.start()
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        for frame in frames:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            t = time.perf_counter()
+            step(frame)
+            t_total += time.perf_counter() - t
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    # 各演算が自分で確保した分（解放は数えない）の合計
+    torch_bytes = sum(max(0, e.self_cpu_memory_usage) for e in prof.events())
+    n = len(peaks)
+    return t_total / n * 1e3, float(np.mean(peaks)) / 1024, torch_bytes / n / 1024
+
+
+def main(source, model_path, imgsz, n):
+    model = YOLO(model_path)
+    cap = cv2.VideoCapture(source)
+    ok, first = cap.read()
+    if not ok:
+        raise SystemExit(f"ソースを開けませんでした: {source}")
+    model.predict(first, imgsz=imgsz, device="cpu", verbose=False)     # 推論器の準備
+    p = model.predictor
+    prep = TensorPrep()
+    pool = FramePool(first.shape)
+    h, w = first.shape[:2]
+
+    def before(frame):
+        p.preprocess([frame])
+    def prealloc(frame):
+        prep.buffer(p, h, w, imgsz, 1).fill([frame])
+
+    rows = []
+    # 読み込みは frames のジェネレータ側（時間と確保量は step の分だけ。読み込みの確保は read KB に別に出す）
+    rows.append(("before", measure(before, read_frames(cap, n))))
+    prealloc(first)     # バッファの確保は初回だけ（測定に含めない）
+    rows.append(("prealloc", measure(prealloc, read_frames(cap, n, pool))))
+    # 読み込み（cap.read）の確保は tracemalloc で別に測る
+    def read_only(pool_):
+        tracemalloc.start(); peaks = []
+        for _ in range(n):
+            base = tracemalloc.get_traced_memory()[0]; tracemalloc.reset_peak()
+            ok, f = pool_.read(cap) if pool_ is not None else cap.read()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            if not ok:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            elif pool_ is not None:
+                pool_.release(f)
+        tracemalloc.stop()
+        return float(np.mean(peaks)) / 1024
+
+    print(f"frame {w}x{h}  imgsz {imgsz}  {n} frames")
+    print(f"{'':10s} {'prep ms':>8s} {'numpy KB':>9s} {'torch KB':>9s} {'read KB':>8s}")
+    for (name, (ms, np_kb, t_kb)), pool_ in zip(rows, (None, pool)):
+        print(f"{name:10s} {ms:8.2f} {np_kb:9.0f} {t_kb:9.0f} {read_only(pool_):8.0f}")
+
+    # 推論まで含めた時間
+    frames = list(read_frames(cap, min(n, 50)))
+    for name, fn in (("predict", lambda f: model.predict(f, imgsz=imgsz, device="cpu", verbose=False)),
+                     ("detect", lambda f: prep.detect(model, [f], imgsz, "cpu", 0.25, 0.45, None))):
+        fn(frames[0])
+        t = time.perf_counter()
+        for f in frames:
+            fn(f)
+        print(f"{name:10s} {(time.perf_counter() - t) / len(frames) * 1e3:8.2f} ms/frame (推論込み)")
+    print(f"buffers: frames {pool.allocated}, letterbox+tensor {prep.allocated} sets ({prep.nbytes/2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="前処理バッファの使い回しの確保量と時間")
+    ap.add_argument("source")
+    ap.add_argument("--model", default="./models/yolo11n.pt")
+    ap.add_argument("--imgsz", type=int, default=960)
+    ap.add_argument("--frames", type=int, default=100)
+    args = ap.parse_args()
+    main(args.source, args.model, args.imgsz, args.frames)
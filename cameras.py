@@ -0,0 +1,264 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+import cv2
+
+# カメラの列挙（webCam_recorder.py 用）
+#   - 候補は OS から取る（Linux: /dev/video* と /sys/class/video4linux。メタデータ用ノードは除く）。
+#     開いてみるのはその候補だけで、存在しない番号のタイムアウトを待たない
+#   - 開いて確かめる（解像度/FPS）のは候補毎に別スレッドで並列に、PROBE_TIMEOUT で打ち切る。
+#     打ち切ったものは失敗として残さず（前の結果のまま / 未確認）、調べているスレッドが抜けたら次の回で確かめ直す
+#   - 確かめた結果はデバイス毎に CACHE_PATH に保存し、次回の起動ではまずキャッシュから一覧を出す
+#   - HOTPLUG_SEC 毎に候補の増減を見て、変わったら新しいものだけ確かめて知らせる
+#   python cameras.py            # 一覧と所要時間
+#   python cameras.py --watch    # 抜き差しを表示
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "vehicle-counter", "cameras.json")
+PROBE_TIMEOUT = 3.0         # 1台を開いて確かめるのを待つ秒数
+HOTPLUG_SEC = 2.0           # 抜き差しを確かめる間隔
+MAX_INDEX = 10              # OS から候補が取れないときに試す番号の数
+PROBE_MODES = ((640, 480), (1280, 720), (1920, 1080))   # 対応を確かめる解像度
+DEV_GLOB = "/dev/video*"
+SYSFS_ROOT = "/sys/class/video4linux"
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def list_devices():
+    """開かずに分かるカメラの候補 [{"index", "path", "name", "key"}]"""
+    if not sys.platform.startswith("linux"):
+        # 候補が分からない OS では番号を総当たり（確かめるまでは一覧に出さない）
+        return [{"index": i, "path": None, "name": f"カメラ {i}", "key": f"index:{i}", "guess": True}
+                for i in range(MAX_INDEX)]
+    paths = glob.glob(DEV_GLOB)
+    devs = []
+    for path in sorted(paths, key=lambda p: int(re.sub(r"\D", "", p) or 0)):
+        m = re.search(r"(\d+)$", path)
+        if not m:
+            continue
+        n = int(m.group(1))
+        sysfs = os.path.join(SYSFS_ROOT, f"video{n}")
+        # UVC カメラは1台で2ノード作る。index が 0 以外はメタデータ用で映像は出ない
+        if _read(os.path.join(sysfs, "index")) not in (None, "0"):
+            continue
+        name = _read(os.path.join(sysfs, "name")) or path
+        # 同じカメラを挿し直して番号が変わってもキャッシュが当たるよう、USB の接続先と名前で識別する
+        dev = os.path.realpath(os.path.join(sysfs, "device")) if os.path.exists(os.path.join(sysfs, "device")) else path
+        devs.append({"index": n, "path": path, "name": name, "key": f"{dev}|{name}"})
+    return devs
+
+
+def probe(index, modes=PROBE_MODES):
+    """開いて既定の解像度/FPSと、modes のうち設定できた解像度を調べる"""
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return {"ok": False}
+        caps = {"ok": True, "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), "fps": cap.get(cv2.CAP_PROP_FPS) or None}
+        found = []
+        for w, h in modes:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, h)
+            got = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            if got == (w, h):
+                found.append([w, h, cap.get(cv2.CAP_PROP_FPS) or None])
+        caps["modes"] = found
+        return caps
+    finally:
+        cap.release()
+
+
+def probe_all(devs, timeout=PROBE_TIMEOUT, modes=PROBE_MODES, pending=None):
+    """devs を並列に調べる {key: caps}。timeout までに返らないものは結果に入れない。
+    そのスレッドは止められない（デバイスを開いたまま）ので、pending を渡すと {key: スレッド} を入れて返す"""
+    results = {}
+    def run(d):
+        results[d["key"]] = probe(d["index"], modes)
+    threads = [threading.Thread(target=run, args=(d,), name=f"probe-{d['index']}", daemon=True) for d in devs]
+    for t in threads:
+        t.start()
+    deadline = time.time() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.time()))
+    done = {}
+    for d, t in zip(devs, threads):
+        if t.is_alive():
+            if pending is not None:
+                pending[d["key"]] = t
+        else:
+            done[d["key"]] = results.get(d["key"], {"ok": False})
+    return done
+
+
+class CameraCache:
+    """デバイス毎の調べた結果（JSON）"""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path            # None: 保存しない
+        self.data = {}
+        if path is None:
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def update(self, caps):
+        self.data.update(caps)
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[WARN] カメラ情報を保存できません: {e}", file=sys.stderr)
+
+
+def label(cam):
+    """コンボボックス用の表示名"""
+    caps = cam.get("caps") or {}
+    mark = " [確認中]" if cam.get("probing") else ""
+    if caps.get("ok"):
+        fps = f" {caps['fps']:.0f}fps" if caps.get("fps") else ""
+        return f"{cam['index']}: {cam['name']} ({caps['width']}x{caps['height']}{fps}){mark}"
+    return f"{cam['index']}: {cam['name']}{mark}"
+
+
+class CameraWatcher:
+    """カメラ一覧をキャッシュからすぐ返し、裏で確かめ直して抜き差しを見張る
+
+    on_change(cameras) は見張りスレッドから呼ばれる（Qt ならシグナルで GUI スレッドへ渡す）。
+    busy() が返す番号は使用中なので開かない（キャッシュの値のまま）。
+    確かめるのが時間切れになったカメラは probing(key) が真の間（調べるスレッドがまだ開いている）は開かないこと。
+    """
+
+    def __init__(self, on_change=None, cache_path=CACHE_PATH, interval=HOTPLUG_SEC, busy=lambda: ()):
+        self.on_change = on_change
+        self.cache = CameraCache(cache_path)
+        self.interval = interval
+        self.busy = busy
+        self.devices = list_devices()
+        self.pending = {}           # 時間切れで調べ終わっていない key → スレッド
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def cameras(self):
+        """今の一覧（確かめて開けなかったものと、総当たりの未確認の番号は除く）"""
+        out = []
+        with self.lock:
+            devs = list(self.devices)
+        for d in devs:
+            caps = self.cache.get(d["key"])
+            if caps is not None and not caps.get("ok") and not caps.get("timeout"):   # timeout: 以前の版のキャッシュ
+                continue
+            if d.get("guess") and (caps is None or not caps.get("ok")):
+                continue
+            out.append(dict(d, caps=caps, probing=self.probing(d["key"])))
+        return out
+
+    def probing(self, key):
+        """時間切れになった確認のスレッドがまだデバイスを開いているか"""
+        t = self.pending.get(key)
+        return t is not None and t.is_alive()
+
+    def refresh(self, devs=None):
+        """devs（省略時は全部）を確かめ直してキャッシュを更新する。確かめられた数を返す"""
+        busy = set(self.busy())
+        targets = [d for d in (devs if devs is not None else self.devices)
+                   if d["index"] not in busy and not self.probing(d["key"])]
+        for d in targets:
+            self.pending.pop(d["key"], None)
+        if not targets:
+            return 0
+        caps = probe_all(targets, pending=self.pending)
+        self.cache.update(caps)
+        return len(caps)
+
+    def _retry(self):
+        """時間切れになったもののうち、調べていたスレッドが抜けたものを確かめ直す"""
+        with self.lock:
+            devs = [d for d in self.devices if d["key"] in self.pending and not self.probing(d["key"])]
+        return self.refresh(devs) if devs else 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="camera-watch", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, wait=True):
+        self.stop_event.set()
+        if wait and self.thread is not None:
+            self.thread.join(timeout=PROBE_TIMEOUT + 1.0)
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self.cameras())
+
+    def _run(self):
+        # 起動直後: キャッシュで出した一覧を確かめ直す
+        self.refresh()
+        self._notify()
+        keys = {d["key"] for d in self.devices}
+        while not self.stop_event.wait(self.interval):
+            devs = list_devices()
+            new_keys = {d["key"] for d in devs}
+            if new_keys == keys:
+                if self._retry():
+                    self._notify()
+                continue
+            added = [d for d in devs if d["key"] not in keys]
+            with self.lock:
+                self.devices = devs
+                for k in set(self.pending) - new_keys:
+                    del self.pending[k]
+            keys = new_keys
+            self.refresh(added)
+            self._notify()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="カメラの列挙")
+    ap.add_argument("--watch", action="store_true", help="抜き差しを見張って表示し続ける")
+    ap.add_argument("--no-cache", action="store_true", help="キャッシュを使わずに調べる")
+    args = ap.parse_args()
+
+    t0 = time.time()
+    w = CameraWatcher(cache_path=None if args.no_cache else CACHE_PATH)
+    cams = w.cameras()
+    print(f"キャッシュから {len(cams)} 台 ({(time.time()-t0)*1e3:.1f} ms)")
+    for c in cams:
+        print("  " + label(c))
+    t0 = time.time()
+    w.refresh()
+    cams = w.cameras()
+    print(f"確認後 {len(cams)} 台 ({(time.time()-t0)*1e3:.0f} ms)")
+    for c in cams:
+        print("  " + label(c), (c["caps"] or {}).get("modes", ""))
+    if args.watch:
+        w.on_change = lambda cs: print("変更: " + ", ".join(label(c) for c in cs))
+        w.start()
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            w.stop()
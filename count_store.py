@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from gate_counter import DIRECTIONS, N_CLASSES
+
+# 通過台数の時系列（クラス別 x 方向別 x 時間枠）。生イベントを読まずに期間集計を返すための事前集計。
+#   - メモリ上で 1分 / 15分 / 1時間 の枠ごとに加算し、枠が閉じたら <dir>/counts_<秒>.cnt に1行追記する
+#   - 1行 = (枠の開始UNIX時刻, ストリーム番号, counts[方向, クラス])。同じ枠の行が複数あれば合計する
+#     （途中終了→再起動で同じ枠が2回書かれても足せば正しい）
+#   - 強制終了で 15分/1時間 の集計中の枠は失われるが、1分枠のファイルには残っている。開くときに
+#     粗い枠の最後の行より後の 1分枠の行を集計中の枠に足し直すので、粗い枠も欠けずに書かれる
+#   - 問い合わせは範囲を粗い枠から順に覆う（中央は1時間枠、端は15分/1分枠）。1か月でも数千行しか読まない
+#   - 1ディレクトリに書くのは1プロセスだけにする（行は枠の開始時刻順に並んでいる前提で二分探索する）
+#   python count_store.py query --since "2025-01-01 00:00" --until "2025-02-01 00:00" --cls 2 --dir up
+#   python count_store.py build --events events     # 既存のイベントログから作り直す
+
+COUNT_DIR = "counts"
+RESOLUTIONS = (60, 900, 3600)       # 集計枠（秒）。細かい順
+N_DIRS = len(DIRECTIONS)
+
+COUNT_DTYPE = np.dtype([
+    ("t", "<f8"),                               # 枠の開始 UNIX 時刻（枠の長さの倍数）
+    ("stream", "<u2"),                          # ストリーム番号（単体は 0）
+    ("counts", "<u4", (N_DIRS, N_CLASSES)),     # [方向コード, クラスID]
+])
+MAGIC = b"VCCNT\x00\x01\x00"
+HEADER_SIZE = 16                    # MAGIC(8) + レコード長(8)
+
+
+def store_path(count_dir, res):
+    return os.path.join(count_dir, f"counts_{res}.cnt")
+
+
+class CountStore:
+    """通過イベントを枠毎に加算し、閉じた枠をファイルに追記する"""
+
+    def __init__(self, count_dir=COUNT_DIR, resolutions=RESOLUTIONS):
+        os.makedirs(count_dir, exist_ok=True)
+        self.count_dir = count_dir
+        self.resolutions = tuple(resolutions)
+        self.open = {r: {} for r in self.resolutions}       # (枠開始, stream) → counts
+        self._recover()
+        self.files = {r: self._open_file(r) for r in self.resolutions}
+        self.next_check = 0.0
+
+    def add(self, events, now, stream=0):
+        """1フレーム分の FrameEvents のうち通過したものを加算する（フレームループから呼ぶ）"""
+        m = events.crossed
+        if m.any():
+            cls = events.cls[m]; d = events.direction[m].astype(np.int64)
+            ok = (cls >= 0) & (cls < N_CLASSES)
+            self.add_counts(now, d[ok], cls[ok], stream)
+        if now >= self.next_check:
+            self.flush(now)
+
+    def add_counts(self, now, directions, classes, stream=0):
+        """時刻 now の通過 (方向コード, クラスID) の組を加算する"""
+        for r in self.resolutions:
+            key = (float(now // r * r), stream)
+            counts = self.open[r].get(key)
+            if counts is None:
+                counts = self.open[r][key] = np.zeros((N_DIRS, N_CLASSES), np.uint32)
+            np.add.at(counts, (directions, classes), 1)
+
+    def flush(self, now=None):
+        """now で閉じた枠（None なら全部）を書き出す"""
+        for r in self.resolutions:
+            opened = self.open[r]
+            done = [k for k in opened if now is None or k[0] + r <= now]
+            if not done:
+                continue
+            done.sort()
+            rows = np.zeros(len(done), COUNT_DTYPE)
+            for i, k in enumerate(done):
+                rows[i] = (k[0], k[1], opened.pop(k))
+            self.files[r].write(rows.tobytes())
+            self.files[r].flush()
+        # 次に閉じる最小の枠の終わりまでは調べない
+        if now is not None:
+            r = self.resolutions[0]
+            self.next_check = now // r * r + r
+
+    def close(self):
+        self.flush(None)
+        for f in self.files.values():
+            f.close()
+
+    def _recover(self):
+        """粗い枠のファイルに書かれる前に止まった分を、1分枠の行から集計中の枠に戻す"""
+        fine = self.resolutions[0]
+        rows = open_counts(self.count_dir, fine)
+        if len(rows) == 0:
+            return
+        for r in self.resolutions[1:]:
+            coarse = open_counts(self.count_dir, r)
+            # 粗い枠の最後の行の枠までは書き出し済み（閉じた枠は細かい方から順に書くので）
+            start = float(coarse["t"][-1]) + r if len(coarse) else -np.inf
+            part = np.asarray(rows[int(np.searchsorted(rows["t"], start, "left")):])
+            for t, stream, counts in zip(part["t"], part["stream"], part["counts"]):
+                key = (float(t // r * r), int(stream))
+                acc = self.open[r].get(key)
+                if acc is None:
+                    acc = self.open[r][key] = np.zeros((N_DIRS, N_CLASSES), np.uint32)
+                acc += counts
+
+    def _open_file(self, res):
+        path = store_path(self.count_dir, res)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        f = open(path, "ab")
+        if new:
+            f.write(MAGIC + np.uint64(COUNT_DTYPE.itemsize).tobytes())
+        return f
+
+
+def open_counts(count_dir, res):
+    """1つの解像度のファイルを memmap で開く"""
+    path = store_path(count_dir, res)
+    if not os.path.exists(path):
+        return np.zeros(0, COUNT_DTYPE)
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:8] != MAGIC or int(np.frombuffer(head[8:], "<u8")[0]) != COUNT_DTYPE.itemsize:
+        raise ValueError(f"集計ファイルではありません: {path}")
+    n = (os.path.getsize(path) - HEADER_SIZE) // COUNT_DTYPE.itemsize
+    if n == 0:
+        return np.zeros(0, COUNT_DTYPE)
+    return np.memmap(path, COUNT_DTYPE, "r", HEADER_SIZE, (n,))
+
+
+def _sum_range(rows, t0, t1, stream):
+    """rows のうち枠開始が [t0, t1) のものの counts 合計"""
+    if len(rows) == 0:
+        return np.zeros((N_DIRS, N_CLASSES), np.int64)
+    t = rows["t"]
+    i0 = int(np.searchsorted(t, t0, "left")); i1 = int(np.searchsorted(t, t1, "left"))
+    part = rows[i0:i1]
+    if stream is not None:
+        part = part[part["stream"] == stream]
+    return part["counts"].sum(0, dtype=np.int64)
+
+
+def query_counts(count_dir, t0, t1, stream=None, resolutions=RESOLUTIONS):
+    """[t0, t1) の counts [方向, クラス] 合計（境界は最小枠=1分に切り捨て）"""
+    res = sorted(resolutions)
+    fine = res[0]
+    t0 = t0 // fine * fine; t1 = t1 // fine * fine
+    stores = {r: open_counts(count_dir, r) for r in res}
+    total = np.zeros((N_DIRS, N_CLASSES), np.int64)
+
+    def cover(a, b, i):
+        # 粗い枠 res[i] で覆える中央部分を足し、残った両端は1つ細かい枠で覆う
+        if a >= b:
+            return
+        r = res[i]
+        if i == 0:
+            total[...] += _sum_range(stores[r], a, b, stream)
+            return
+        A = -(-a // r) * r; B = b // r * r
+        if A >= B:
+            cover(a, b, i-1)
+            return
+        total[...] += _sum_range(stores[r], A, B, stream)
+        cover(a, A, i-1); cover(B, b, i-1)
+
+    cover(t0, t1, len(res)-1)
+    return total
+
+
+def query(count_dir, t0, t1, cls=None, direction=None, stream=None):
+    """クラス・方向を指定した [t0, t1) の通過台数（None はすべて）"""
+    total = query_counts(count_dir, t0, t1, stream)
+    if direction is not None:
+        total = total[DIRECTIONS.index(direction) if isinstance(direction, str) else direction]
+    else:
+        total = total.sum(0)
+    return int(total[cls] if cls is not None else total.sum())
+
+
+def query_series(count_dir, t0, t1, res=3600, stream=None):
+    """[t0, t1) を res 秒枠に分けた (枠開始の配列, counts[枠, 方向, クラス])"""
+    rows = open_counts(count_dir, res)
+    t0 = t0 // res * res
+    starts = np.arange(t0, t1, res, dtype=np.float64)
+    out = np.zeros((len(starts), N_DIRS, N_CLASSES), np.int64)
+    if len(rows):
+        i0 = int(np.searchsorted(rows["t"], t0)); i1 = int(np.searchsorted(rows["t"], t1))
+        part = np.asarray(rows[i0:i1])
+        if stream is not None:
+            part = part[part["stream"] == stream]
+        np.add.at(out, ((part["t"] - t0) // res).astype(np.int64), part["counts"])
+    return starts, out
+
+
+def build_from_events(count_dir, event_dir, resolutions=RESOLUTIONS):
+    """イベントログの通過イベントから集計ファイルを作る（count_dir は空であること）"""
+    from event_log import read_events
+    ev = read_events(event_dir, crossed_only=True)
+    ev = ev[(ev["cls"] >= 0) & (ev["cls"] < N_CLASSES)]
+    for r in resolutions:
+        path = store_path(count_dir, r)
+        if os.path.exists(path) and os.path.getsize(path) > HEADER_SIZE:
+            raise RuntimeError(f"既に集計ファイルがあります: {path}")
+    os.makedirs(count_dir, exist_ok=True)
+    for r in resolutions:
+        # (枠開始, ストリーム) でまとめて1行ずつ
+        bucket = ev["ts"] // r * r
+        keys, inv = np.unique(np.stack([bucket, ev["stream"].astype(np.float64)], 1), axis=0, return_inverse=True)
+        rows = np.zeros(len(keys), COUNT_DTYPE)
+        rows["t"] = keys[:, 0]; rows["stream"] = keys[:, 1]
+        np.add.at(rows["counts"], (inv.ravel(), ev["direction"].astype(np.int64), ev["cls"].astype(np.int64)), 1)
+        with open(store_path(count_dir, r), "wb") as f:
+            f.write(MAGIC + np.uint64(COUNT_DTYPE.itemsize).tobytes())
+            f.write(rows.tobytes())
+    return len(ev)
+
+
+if __name__ == "__main__":
+    from event_log import parse_time
+    ap = argparse.ArgumentParser(description="通過台数の時系列（事前集計）の問い合わせ")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    q = sub.add_parser("query", help="期間の通過台数")
+    q.add_argument("dir", nargs="?", default=COUNT_DIR)
+    q.add_argument("--since", required=True); q.add_argument("--until", default=None, help="省略時は現在")
+    q.add_argument("--cls", type=int, default=None, help="COCO クラスID（省略時は全クラス）")
+    q.add_argument("--dir", dest="direction", choices=[d for d in DIRECTIONS if d], default=None)
+    q.add_argument("--stream", type=int, default=None)
+    q.add_argument("--series", type=int, choices=RESOLUTIONS, default=None, help="枠(秒)毎の内訳も表示")
+    b = sub.add_parser("build", help="イベントログから作り直す")
+    b.add_argument("dir", nargs="?", default=COUNT_DIR)
+    b.add_argument("--events", default="events", help="イベントログのディレクトリ")
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        n = build_from_events(args.dir, args.events)
+        print(f"{n} 件の通過イベントから集計しました: {args.dir}")
+        sys.exit(0)
+
+    t0 = parse_time(args.since)
+    t1 = parse_time(args.until) if args.until else time.time()
+    tq = time.perf_counter()
+    n = query(args.dir, t0, t1, args.cls, args.direction, args.stream)
+    ms = (time.perf_counter() - tq) * 1e3
+    print(f"{n}  ({time.strftime('%Y-%m-%d %H:%M', time.localtime(t0))} 〜 "
+          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(t1))}, {ms:.1f} ms)")
+    if args.series:
+        starts, counts = query_series(args.dir, t0, t1, args.series, args.stream)
+        counts = counts[:, DIRECTIONS.index(args.direction)] if args.direction else counts.sum(1)
+        counts = counts[:, args.cls] if args.cls is not None else counts.sum(1)
+        for t, c in zip(starts, counts):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(t))}  {int(c)}")
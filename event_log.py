@@ -0,0 +1,240 @@
+import os
+import csv
+import glob
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+
+# 検出/通過イベントのバイナリログ。
+#   - 1行 = 固定長レコード（EVENT_DTYPE）。フレームループでは事前確保したブロックに詰めるだけで、
+#     書き込みはバックグラウンドスレッドが行う（ディスクが詰まってもフレームループは止まらない）
+#   - ローカル時刻の1時間ごとにファイルを切り替える: <dir>/events_YYYYmmdd_HH.evt
+#     （区切りはファイル名の時刻と同じローカルの正時。UTC との差が正時でない地域でもずれない）
+#   - 読み出しは np.memmap（全件を読み込まずに範囲・条件で絞れる）
+#   - CSV が必要なときは `python event_log.py export <dir> --out events.csv`
+
+EVENT_DIR = "events"
+BLOCK_ROWS = 4096           # 1ブロックの行数（これが埋まるか FLUSH_SEC 経過で書き出す）
+FLUSH_SEC = 5.0
+QUEUE_BLOCKS = 64           # 書き込み待ちブロックの上限（超えたら捨てて dropped を数える）
+EXPORT_CHUNK = 100000       # CSV 書き出し時に一度に読む行数
+
+EVENT_DTYPE = np.dtype([
+    ("ts", "<f8"),          # UNIX 時刻
+    ("id", "<i8"),          # Track ID
+    ("cls", "<i2"),         # COCO クラス
+    ("x", "<i4"), ("y", "<i4"),   # 中心座標
+    ("crossed", "u1"),      # 1: このフレームでゲートを通過
+    ("direction", "u1"),    # gate_counter.DIRECTIONS のコード
+    ("stream", "<u2"),      # ストリーム番号（multi_stream 用、単体は 0）
+])
+MAGIC = b"VCEVT\x00\x01\x00"
+HEADER_SIZE = 16            # MAGIC(8) + レコード長(8)
+DIRECTIONS = ("", "up", "down", "left", "right")
+
+
+def hour_start(ts):
+    """ts を含むローカル時刻の1時間の始まり（UNIX 時刻）"""
+    t = time.localtime(ts)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, 0, 0, 0, 0, t.tm_isdst))
+
+
+def hour_path(event_dir, start):
+    """hour_start で求めた1時間の始まりに対応するファイルパス"""
+    return os.path.join(event_dir, time.strftime("events_%Y%m%d_%H.evt", time.localtime(start)))
+
+
+class EventLog:
+    """FrameEvents をブロック単位にまとめて別スレッドで書き出すイベントシンク"""
+
+    def __init__(self, event_dir=EVENT_DIR, block_rows=BLOCK_ROWS, flush_sec=FLUSH_SEC):
+        os.makedirs(event_dir, exist_ok=True)
+        self.event_dir = event_dir
+        self.block_rows = block_rows
+        self.flush_sec = flush_sec
+        self.q = queue.Queue(QUEUE_BLOCKS)
+        self.free = queue.Queue()               # 書き終わったブロックを再利用
+        self.block = np.empty(block_rows, EVENT_DTYPE)
+        self.n = 0
+        self.t_flush = time.time()
+        self.dropped = 0
+        self.written = 0
+        self.error = None                       # 書き込みスレッドが止まった例外（close で投げる）
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._writer, name="event-log", daemon=True)
+        self.thread.start()
+
+    def append(self, events, now, stream=0):
+        """1フレーム分の FrameEvents を追加する（フレームループから呼ぶ）"""
+        n = len(events)
+        with self.lock:
+            i = 0
+            while i < n:
+                k = min(n - i, self.block_rows - self.n)
+                b = self.block[self.n:self.n+k]
+                b["ts"] = now
+                b["id"] = events.ids[i:i+k]
+                b["cls"] = events.cls[i:i+k]
+                b["x"] = events.cx[i:i+k]; b["y"] = events.cy[i:i+k]
+                b["crossed"] = events.crossed[i:i+k]
+                b["direction"] = events.direction[i:i+k]
+                b["stream"] = stream
+                self.n += k; i += k
+                if self.n == self.block_rows:
+                    self._submit()
+            if self.n and now - self.t_flush >= self.flush_sec:
+                self._submit()
+
+    def close(self):
+        with self.lock:
+            if self.n:
+                self._submit()
+        # 書き込みスレッドが止まっているとキューが空かないので、待つのは生きている間だけ
+        while self.thread.is_alive():
+            try:
+                self.q.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _submit(self):
+        rows = self.block[:self.n]
+        try:
+            self.q.put_nowait(rows)
+        except queue.Full:
+            self.dropped += self.n
+        try:
+            self.block = self.free.get_nowait()
+        except queue.Empty:
+            self.block = np.empty(self.block_rows, EVENT_DTYPE)
+        self.n = 0
+        self.t_flush = time.time()
+
+    def _writer(self):
+        f = None; start = end = None           # 開いているファイルの [始まり, 次の正時)
+        try:
+            while True:
+                rows = self.q.get()
+                if rows is None:
+                    break
+                # ブロック内で時間が変わる場合はそこで分けて別ファイルへ（行は時刻順）
+                ts = rows["ts"]; i = 0
+                while i < len(rows):
+                    if f is None or not (start <= ts[i] < end):
+                        if f: f.close()
+                        start = hour_start(ts[i]); end = hour_start(start + 3600)
+                        f = self._open(start)
+                    j = i + max(1, int(np.searchsorted(ts[i:], end, "left")))
+                    f.write(rows[i:j].tobytes())
+                    i = j
+                f.flush()
+                self.written += len(rows)
+                if rows.base is not None and len(rows.base) == self.block_rows:
+                    self.free.put(rows.base)
+        except Exception as e:
+            self.error = e
+        finally:
+            if f: f.close()
+
+    def _open(self, start):
+        path = hour_path(self.event_dir, start)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        f = open(path, "ab")
+        if new:
+            f.write(MAGIC + np.uint64(EVENT_DTYPE.itemsize).tobytes())
+        return f
+
+
+def open_events(path):
+    """1ファイルを memmap で開く（書き込み途中の端数レコードは無視）"""
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:8] != MAGIC or int(np.frombuffer(head[8:], "<u8")[0]) != EVENT_DTYPE.itemsize:
+        raise ValueError(f"イベントログではありません: {path}")
+    n = (os.path.getsize(path) - HEADER_SIZE) // EVENT_DTYPE.itemsize
+    if n == 0:
+        return np.zeros(0, EVENT_DTYPE)
+    return np.memmap(path, EVENT_DTYPE, "r", HEADER_SIZE, (n,))
+
+
+def event_files(event_dir, t0=None, t1=None):
+    """[t0, t1) に掛かる時間ファイルを時刻順に返す"""
+    paths = sorted(glob.glob(os.path.join(event_dir, "events_*.evt")))
+    if t0 is None and t1 is None:
+        return paths
+    out = []
+    for p in paths:
+        start = time.mktime(time.strptime(os.path.basename(p), "events_%Y%m%d_%H.evt"))
+        if (t1 is None or start < t1) and (t0 is None or start + 3600 > t0):
+            out.append(p)
+    return out
+
+
+def read_events(event_dir, t0=None, t1=None, crossed_only=False):
+    """期間・通過のみで絞ったイベント配列（構造化配列）"""
+    parts = []
+    for p in event_files(event_dir, t0, t1):
+        ev = open_events(p)
+        m = np.ones(len(ev), bool)
+        if t0 is not None: m &= ev["ts"] >= t0
+        if t1 is not None: m &= ev["ts"] < t1
+        if crossed_only: m &= ev["crossed"] == 1
+        parts.append(np.asarray(ev[m]))
+    return np.concatenate(parts) if parts else np.zeros(0, EVENT_DTYPE)
+
+
+def export_csv(event_dir, out, t0=None, t1=None, crossed_only=False):
+    """イベントログを CSV に書き出す"""
+    n = 0
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        csvw = csv.writer(f)
+        csvw.writerow(["ts","id","cls","x","y","crossed","direction","stream"])
+        for p in event_files(event_dir, t0, t1):
+            ev = open_events(p)
+            for i in range(0, len(ev), EXPORT_CHUNK):
+                chunk = ev[i:i+EXPORT_CHUNK]
+                m = np.ones(len(chunk), bool)
+                if t0 is not None: m &= chunk["ts"] >= t0
+                if t1 is not None: m &= chunk["ts"] < t1
+                if crossed_only: m &= chunk["crossed"] == 1
+                for r in np.asarray(chunk[m]).tolist():
+                    csvw.writerow([f"{r[0]:.3f}", r[1], r[2], r[3], r[4], r[5], DIRECTIONS[r[6]], r[7]])
+                    n += 1
+    return n
+
+
+def parse_time(s):
+    """'2025-01-31 14:00' 形式または UNIX 秒"""
+    if s is None:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        fmt = "%Y-%m-%d %H:%M:%S" if s.count(":") == 2 else "%Y-%m-%d %H:%M"
+        return time.mktime(time.strptime(s, fmt))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="イベントログ(.evt)の確認と CSV 書き出し")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="CSV に書き出す")
+    ex.add_argument("dir", nargs="?", default=EVENT_DIR)
+    ex.add_argument("--out", default="gate_counts.csv")
+    ex.add_argument("--since"); ex.add_argument("--until")
+    ex.add_argument("--crossed-only", action="store_true", help="通過イベントだけ")
+    st = sub.add_parser("stat", help="ファイル毎の件数")
+    st.add_argument("dir", nargs="?", default=EVENT_DIR)
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        n = export_csv(args.dir, args.out, parse_time(args.since), parse_time(args.until), args.crossed_only)
+        print(f"{n} 行を書き出しました: {args.out}")
+    else:
+        for p in event_files(args.dir):
+            ev = open_events(p)
+            print(f"{os.path.basename(p)}: {len(ev)} 行  通過 {int((ev['crossed'] == 1).sum())}")
@@ -1,29 +1,60 @@
 import sys
-from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QMessageBox
-from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog,
+                             QMessageBox, QListWidget, QProgressBar, QCheckBox)
+from PyQt6.QtCore import Qt, pyqtSignal, pyqtSlot
 import os
-import subprocess
+from merge_jobs import MergeQueue
+
+# 結合は merge_jobs.MergeQueue のスレッドで1つずつ行う（GUI は積むだけで固まらない）。
+# 結合中も次のファイルをドロップして積める。進捗/状態はジョブ一覧に出す
 
 class DragDropWidget(QWidget):
+    # MergeQueue のコールバック（ワーカースレッド）→ GUI スレッド
+    job_progress = pyqtSignal(int, float)
+    job_status = pyqtSignal(int, str)
+    job_done = pyqtSignal(int, bool, str)
+
     def __init__(self):
         super().__init__()
         self.setAcceptDrops(True)
         self.setWindowTitle("MP4ファイル結合アプリ")
-        self.resize(400, 300)
+        self.resize(480, 420)
         self.files = []
+        self.jobs = {}          # job_id → {"row", "name", "state"}
+        self.running = None
 
         layout = QVBoxLayout()
         self.label = QLabel("ここにMP4ファイルをドラッグ＆ドロップしてください")
         self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.label)
 
+        self.reencode_check = QCheckBox("常に再エンコードする（通常は形式が揃っていればコピーで結合）")
+        layout.addWidget(self.reencode_check)
+
         self.merge_button = QPushButton("結合して保存")
         self.merge_button.clicked.connect(self.merge_files)
         self.merge_button.setEnabled(False)
         layout.addWidget(self.merge_button)
 
+        # ジョブ一覧と実行中のジョブの進捗
+        self.job_list = QListWidget()
+        layout.addWidget(self.job_list)
+        self.progress = QProgressBar()
+        self.progress.setRange(0, 1000)
+        layout.addWidget(self.progress)
+        buttons = QHBoxLayout()
+        self.cancel_button = QPushButton("選択したジョブを中止")
+        self.cancel_button.clicked.connect(self.cancel_job)
+        buttons.addWidget(self.cancel_button)
+        layout.addLayout(buttons)
+
         self.setLayout(layout)
 
+        self.job_progress.connect(self.on_progress)
+        self.job_status.connect(self.on_status)
+        self.job_done.connect(self.on_done)
+        self.queue = MergeQueue(self.job_progress.emit, self.job_status.emit, self.job_done.emit)
+
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
             event.acceptProposedAction()
@@ -39,6 +70,7 @@ class DragDropWidget(QWidget):
             self.merge_button.setEnabled(False)
 
     def merge_files(self):
+        """選んだファイルの結合をジョブとして積む（待たない）"""
         if not self.files:
             return
 
@@ -46,32 +78,55 @@ class DragDropWidget(QWidget):
         if not save_path:
             return
 
-        # 一時ファイルリスト作成
-        list_file = "filelist.txt"
-        with open(list_file, "w", encoding="utf-8") as f:
-            for file in self.files:
-                f.write(f"file '{file.replace('\'', '\\\'')}'\n")
-
-        # ffmpegで結合
-        cmd = [
-            "ffmpeg",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", list_file,
-            "-c", "copy",
-            save_path
-        ]
-        try:
-            subprocess.run(cmd, check=True)
-            QMessageBox.information(self, "完了", "ファイルの結合が完了しました。")
-        except Exception as e:
-            QMessageBox.critical(self, "エラー", f"結合に失敗しました: {e}")
-        finally:
-            if os.path.exists(list_file):
-                os.remove(list_file)
+        job_id = self.queue.submit(self.files, save_path, self.reencode_check.isChecked())
+        name = os.path.basename(save_path)
+        self.job_list.addItem(f"#{job_id} {name}: 待機中 ({len(self.files)} ファイル)")
+        self.jobs[job_id] = {"row": self.job_list.count() - 1, "name": name, "state": "待機中"}
+        # 次の結合のために選択を空にする
+        self.files = []
+        self.label.setText("ここにMP4ファイルをドラッグ＆ドロップしてください")
+        self.merge_button.setEnabled(False)
+
+    def _set_text(self, job_id, text):
+        job = self.jobs[job_id]
+        job["state"] = text
+        self.job_list.item(job["row"]).setText(f"#{job_id} {job['name']}: {text}")
+
+    @pyqtSlot(int, float)
+    def on_progress(self, job_id, p):
+        self.running = job_id
+        self.progress.setValue(int(p * 1000))
+        self.progress.setFormat(f"#{job_id} {p*100:.1f}%")
+
+    @pyqtSlot(int, str)
+    def on_status(self, job_id, text):
+        self.running = job_id
+        self.progress.setValue(0)
+        self.progress.setFormat(f"#{job_id} %p%")
+        self._set_text(job_id, text)
+
+    @pyqtSlot(int, bool, str)
+    def on_done(self, job_id, ok, text):
+        self._set_text(job_id, ("完了 " if ok else "失敗 ") + text.replace("\n", " / "))
+        if self.running == job_id:
+            self.running = None
+            self.progress.setValue(1000 if ok else 0)
+        if not ok and text != "中止しました":
+            QMessageBox.critical(self, "エラー", f"結合に失敗しました: {text}")
+
+    def cancel_job(self):
+        row = self.job_list.currentRow()
+        for job_id, job in self.jobs.items():
+            if job["row"] == row:
+                self.queue.cancel(job_id)
+
+    def closeEvent(self, event):
+        """実行中の ffmpeg を止めてから閉じる（途中の出力は消す）"""
+        self.queue.close()
+        event.accept()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = DragDropWidget()
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(app.exec())
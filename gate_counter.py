@@ -0,0 +1,159 @@
+import threading
+import numpy as np
+from track_table import TrackTable
+
+TTL_SEC = 2.0               # 見失ってからID破棄までの秒数
+
+# 検出配列の列（r.boxes.data と同じ並び）: x1,y1,x2,y2,id,conf,cls
+COL_ID, COL_CONF, COL_CLS = 4, 5, 6
+NO_DETS = np.zeros((0, 7), np.float32)
+
+# 方向コード
+DIRECTIONS = ("", "up", "down", "left", "right")
+DIR_NONE, DIR_UP, DIR_DOWN, DIR_LEFT, DIR_RIGHT = range(5)
+N_CLASSES = 10              # class_counts の長さ（COCO 0〜9）
+
+
+def parse_dets(results):
+    """model.track の結果から検出配列 (N,7) を取り出す（テンソル→numpy は1回だけ）"""
+    if not results:
+        # 推論を省略したフレーム
+        return NO_DETS
+    boxes = getattr(results[0], "boxes", None)
+    if boxes is None or boxes.id is None:
+        # まれに追跡が返らないフレームがある（Results が None / boxes が無い / ID が付いていない）
+        return NO_DETS
+    return boxes.data.cpu().numpy()
+
+
+class FrameEvents:
+    """1フレーム分の判定結果（列ごとの配列）。for で回すと従来どおりの行タプルになる"""
+    __slots__ = ("ids", "cls", "conf", "xyxy", "cx", "cy", "crossed", "direction", "zones")
+
+    def __init__(self, ids, cls, conf, xyxy, cx, cy, crossed, direction, zones=None):
+        self.ids = ids; self.cls = cls; self.conf = conf; self.xyxy = xyxy
+        self.cx = cx; self.cy = cy; self.crossed = crossed; self.direction = direction
+        self.zones = zones      # ゾーンを使うとき: 今回数えた (検出番号, ゾーン番号, 方向) の配列
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """(tid, cls, conf, xyxy, cx, cy, crossed, direction) を1行ずつ返す（描画/CSV用）"""
+        return zip(self.ids.tolist(), self.cls.tolist(), self.conf.tolist(), self.xyxy.tolist(),
+                   self.cx.tolist(), self.cy.tolist(), self.crossed.tolist(),
+                   [DIRECTIONS[d] for d in self.direction.tolist()])
+
+
+class GateCounter:
+    """ゲート矩形の通過判定とID毎の状態を管理する（main.py / test.py 共通）
+
+    direction_mode:
+      "motion"      … 前回中心座標からの移動方向で up/down/left/right を判定（main.py）
+      "gate_center" … 通過時の cy がゲート中心より上なら up、下なら down（test.py）
+    zones を渡すと（zones.ZoneMap）、同じID状態の上でゾーン別のカウントも行う（self.zones）
+    """
+
+    def __init__(self, gate, ttl_sec=TTL_SEC, direction_mode="motion", zones=None):
+        self.gate = gate                    # [x1,y1,x2,y2]（キー操作で書き換わる共有リスト）
+        self.ttl_sec = ttl_sec
+        self.direction_mode = direction_mode
+        self.zone_map = zones
+        self.lock = threading.Lock()        # カウントスレッドとUIスレッド(リセット)の排他
+        self.reset()
+
+    def reset(self):
+        """カウンタ/状態リセット"""
+        with self.lock:
+            # ID毎の状態（最終検出時刻 / 前フレームでゲート内だったか / 前回中心 / カウント済み）
+            self.tracks = TrackTable(self.ttl_sec)
+            self.total = 0
+            self.class_counts = {"up": [0]*N_CLASSES, "down": [0]*N_CLASSES}  # クラスID毎のカウント数
+            self.zones = self.zone_map.counter(self.tracks.capacity) if self.zone_map is not None else None
+
+    def set_gate(self, gate):
+        """ゲートを置き換える（ゲート内フラグは消す。移動で内→外になったIDを通過と数えないため）"""
+        with self.lock:
+            self.gate[:] = [int(v) for v in gate]
+            self.tracks.inside[:] = False
+
+    def has_pending(self):
+        """ゲート内にいて、まだ出ていないIDがあるか"""
+        with self.lock:
+            return self.tracks.any_inside()
+
+    def is_counted(self, tid):
+        """既にカウントしたIDか（描画の色分け用。描画スレッドから呼ぶので update と排他）"""
+        with self.lock:
+            s = self.tracks.index.get(tid)
+            return bool(self.tracks.counted[s]) if s is not None else bool(self.tracks.window.contains([tid])[0])
+
+    def active_ids(self):
+        return len(self.tracks)
+
+    def update(self, dets, now, expire=True):
+        """1フレーム分の検出配列 (N,7) を処理して FrameEvents を返す（expire=False なら TTL 破棄は呼び出し側で）"""
+        with self.lock:
+            events = self._update(dets, now)
+            if expire:
+                self.tracks.expire(now)
+        return events
+
+    def expire(self, now):
+        """TTLで古いIDを破棄（カウント済みはビットマップ側に残るので重複カウントしない）"""
+        with self.lock:
+            self.tracks.expire(now)
+
+    def _update(self, dets, now):
+        x1,y1,x2,y2 = self.gate
+        gcy = int((y1+y2)/2)
+
+        ids = dets[:, COL_ID].astype(np.int64)
+        cls = dets[:, COL_CLS].astype(np.int64)
+        xyxy = dets[:, :4]
+        # 中心座標（従来の int((a+b)/2) と同じく0方向への切り捨て）
+        cx = ((xyxy[:, 0] + xyxy[:, 2]) / 2).astype(np.int64)
+        cy = ((xyxy[:, 1] + xyxy[:, 3]) / 2).astype(np.int64)
+
+        inside = (y1 <= cy) & (cy <= y2) & (x1 <= cx) & (cx <= x2)
+        tracks = self.tracks
+        slots = tracks.slots_for(ids)
+        was_inside = tracks.inside[slots]
+        # ゾーン判定は前回中心を書き戻す（touch）前に
+        zone_events = self.zones.update(ids, slots, ~tracks.has_prev[slots], cls, tracks.pcx[slots], tracks.pcy[slots], cx, cy) \
+            if self.zones is not None else None
+
+        # ゲート内→外 になったIDのうち未カウントのものが通過
+        crossed = was_inside & ~inside & ~tracks.counted[slots]
+        n_crossed = int(crossed.sum())
+        if n_crossed:
+            tracks.mark_counted(slots[crossed])
+        self.total += n_crossed
+
+        direction = np.zeros(len(ids), np.int8)
+        if n_crossed:
+            if self.direction_mode == "gate_center":
+                direction[crossed & (cy < gcy)] = DIR_UP
+                direction[crossed & (cy > gcy)] = DIR_DOWN
+            else:
+                # 各IDの前回中心座標（フレームをまたいで表に保持）
+                pcx, pcy = tracks.pcx[slots], tracks.pcy[slots]
+                m = crossed & tracks.has_prev[slots]
+                # ゲートの上下方向で判定（条件の早いものが優先）。どれにも当たらなければ単純にy方向で判定
+                fallback = np.where(cy > pcy, DIR_DOWN, DIR_UP)
+                d = np.select([(pcy < y1) & (cy > y2), (pcy > y2) & (cy < y1),
+                               (pcx < x1) & (cx > x2), (pcx > x2) & (cx < x1)],
+                              [DIR_DOWN, DIR_UP, DIR_RIGHT, DIR_LEFT], fallback)
+                direction[m] = d[m]
+
+            # クラス別・方向別の加算（if/elif の連鎖の代わりに bincount）
+            for name, code in (("up", DIR_UP), ("down", DIR_DOWN)):
+                sel = cls[(direction == code) & (cls >= 0) & (cls < N_CLASSES)]
+                if len(sel):
+                    inc = np.bincount(sel, minlength=N_CLASSES)
+                    counts = self.class_counts[name]
+                    for c in np.flatnonzero(inc):
+                        counts[c] += int(inc[c])
+
+        tracks.touch(ids, slots, now, inside, cx, cy)
+        return FrameEvents(ids, cls, dets[:, COL_CONF], xyxy, cx, cy, crossed, direction, zone_events)
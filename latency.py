@@ -0,0 +1,214 @@
+import os
+import csv
+import sys
+import time
+import argparse
+import datetime
+import threading
+
+# 推論時間の目標（1フレームあたりの時間 / FPS）に合わせて IMG_SIZE と検出間隔（stride）を自動で変える
+#   - 段は「画質の良い順」に 大きい IMG_SIZE x stride 1 → … → 最小の IMG_SIZE x stride 2, 3 …（ladder）
+#   - 1フレームあたりのコスト = 推論時間（IMG_SIZE 毎の EWMA） / stride
+#   - CONTROL_SEC 毎に判定し、同じ向きの判定が HOLD 回続いたら1段だけ動かす（ヒステリシス）
+#       下げる: コスト > 目標 x HIGH
+#       上げる: 1段上の予測コスト < 目標 x LOW（今の推論時間を画素数の比で見積もる。前に測った値は
+#               その時の負荷なので使わない）
+#     変えた直後は COOLDOWN_SEC 動かさず、新しい大きさの最初の WARM_SAMPLES 回（書き出し/初期化を含む）は測らない
+#   - 変えるたびに CONTROL_LOG に1行（時刻, 前後の IMG_SIZE/stride, 推論時間, 理由）。イベントログと時刻で
+#     突き合わせれば解像度と検出精度の関係を後から見られる
+#   python latency.py control_log.csv     # 段毎の滞在時間
+
+IMG_SEQ = (640, 832, 960, 1280)     # main.py / test.py の 'z' キーと同じ並び
+MAX_STRIDE = 3              # 最小の IMG_SIZE で何フレームに1回まで検出を間引くか
+CONTROL_SEC = 1.0           # 判定の間隔
+HOLD = 3                    # 同じ向きの判定がこの回数続いたら変える
+HIGH = 1.0                  # コストが目標のこの倍を超えたら下げる
+LOW = 0.7                   # 1段上げても目標のこの倍に収まる見込みなら上げる
+COOLDOWN_SEC = 5.0          # 変えた後に動かさない秒数
+ALPHA = 0.2                 # 推論時間の EWMA の重み
+WARM_SAMPLES = 2            # 大きさを変えた直後に捨てる測定の数
+CONTROL_LOG = "control_log.csv"
+LOG_HEADER = ["ts", "time", "imgsz", "stride", "prev_imgsz", "prev_stride", "infer_ms", "cost_ms", "target_ms", "reason"]
+
+
+def ladder(sizes=IMG_SEQ, max_stride=MAX_STRIDE):
+    """画質の良い順の (IMG_SIZE, stride) の並び"""
+    sizes = sorted(sizes, reverse=True)
+    return [(s, 1) for s in sizes] + [(sizes[-1], k) for k in range(2, max_stride + 1)]
+
+
+class LatencyController:
+    """推論スレッドから observe / should_run を呼び、目標に合わせて段を動かす
+
+    on_change(imgsz, stride) は段を変えたときに呼ばれる（observe を呼んだスレッドから）。
+    """
+
+    def __init__(self, target_sec, imgsz, sizes=IMG_SEQ, max_stride=MAX_STRIDE, log_path=CONTROL_LOG, on_change=None):
+        self.target = target_sec
+        self.levels = ladder(sizes, max_stride)
+        self.level = self._nearest(imgsz, 1)
+        self.on_change = on_change
+        self.ewma = {}              # IMG_SIZE → 推論時間（秒。その大きさにいる間だけ更新）
+        self.warm = WARM_SAMPLES
+        self.n = 0                  # should_run の呼び出し回数（stride の位相）
+        self.votes = 0              # +: 上げたい回数 / -: 下げたい回数
+        self.changes = 0
+        self.lock = threading.Lock()
+        now = time.time()
+        self.t_eval = now + CONTROL_SEC
+        self.t_change = now
+        self.t_account = now
+        self.time_at = {}           # (IMG_SIZE, stride) → 滞在秒数
+        self.log = None
+        if log_path:
+            new = not os.path.exists(log_path) or os.path.getsize(log_path) == 0
+            self.log = open(log_path, "a", newline="", encoding="utf-8")
+            self.csv = csv.writer(self.log)
+            if new:
+                self.csv.writerow(LOG_HEADER)
+        self._write(now, None, "start")
+
+    @property
+    def imgsz(self):
+        return self.levels[self.level][0]
+
+    @property
+    def stride(self):
+        return self.levels[self.level][1]
+
+    @property
+    def infer_sec(self):
+        return self.ewma.get(self.imgsz)
+
+    @property
+    def cost(self):
+        """1フレームあたりの推論コスト（秒）"""
+        t = self.infer_sec
+        return t / self.stride if t is not None else None
+
+    def should_run(self):
+        """このフレームを推論するか（stride フレームに1回）"""
+        self.n += 1
+        return self.stride == 1 or self.n % self.stride == 0
+
+    def observe(self, sec, n=1, now=None):
+        """推論1回分の時間（n フレームまとめて推論したときは全体）を記録して、必要なら段を動かす"""
+        if n <= 0:
+            return
+        with self.lock:
+            if self.warm > 0:
+                self.warm -= 1
+            else:
+                per = sec / n
+                prev = self.ewma.get(self.imgsz)
+                self.ewma[self.imgsz] = per if prev is None else prev + ALPHA * (per - prev)
+            now = time.time() if now is None else now
+            if now >= self.t_eval:
+                self.t_eval = now + CONTROL_SEC
+                self._evaluate(now)
+
+    def set(self, imgsz, stride=1, reason="manual"):
+        """手動で段を決める（'z' キーなど）。自動の調整はそこから続ける"""
+        with self.lock:
+            level = self._nearest(imgsz, stride)
+            if level != self.level:
+                self._change(level, time.time(), reason)
+
+    def close(self):
+        with self.lock:
+            self._account(time.time())
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def summary(self):
+        """段毎の滞在時間の表示用文字列"""
+        with self.lock:
+            self._account(time.time())
+        total = sum(self.time_at.values()) or 1.0
+        return "  ".join(f"{s}x{k}: {t:.0f}s ({t/total*100:.0f}%)" for (s, k), t in
+                         sorted(self.time_at.items(), key=lambda kv: self.levels.index(kv[0])))
+
+    # ---- 内部 ----
+    def _nearest(self, imgsz, stride):
+        if (imgsz, stride) in self.levels:
+            return self.levels.index((imgsz, stride))
+        return min(range(len(self.levels)), key=lambda i: (abs(self.levels[i][0] - imgsz), abs(self.levels[i][1] - stride)))
+
+    def _predict(self, level):
+        """level での1フレームあたりのコストの見込み"""
+        s, k = self.levels[level]
+        return self.infer_sec * (s / self.imgsz) ** 2 / k     # 推論時間はおおよそ画素数に比例
+
+    def _evaluate(self, now):
+        cost = self.cost
+        if cost is None or now - self.t_change < COOLDOWN_SEC:
+            return
+        if cost > self.target * HIGH and self.level < len(self.levels) - 1:
+            self.votes = min(self.votes, 0) - 1
+        elif self.level > 0 and self._predict(self.level - 1) < self.target * LOW:
+            self.votes = max(self.votes, 0) + 1
+        else:
+            self.votes = 0
+        if self.votes <= -HOLD:
+            self._change(self.level + 1, now, f"cost {cost*1e3:.1f}ms > target {self.target*1e3:.1f}ms")
+        elif self.votes >= HOLD:
+            self._change(self.level - 1, now,
+                         f"predicted {self._predict(self.level - 1)*1e3:.1f}ms < {LOW:g} x target {self.target*1e3:.1f}ms")
+
+    def _account(self, now):
+        key = self.levels[self.level]
+        self.time_at[key] = self.time_at.get(key, 0.0) + now - self.t_account
+        self.t_account = now
+
+    def _change(self, level, now, reason):
+        prev = self.levels[self.level]
+        measured = (self.infer_sec, self.cost)      # 変える理由になった測定値（変える前の段）
+        self._account(now)
+        if self.levels[level][0] != prev[0]:
+            self.warm = WARM_SAMPLES
+        self.level = level
+        self.t_change = now
+        self.votes = 0
+        self.changes += 1
+        self._write(now, prev, reason, *measured)
+        if self.on_change is not None:
+            self.on_change(self.imgsz, self.stride)
+
+    def _write(self, now, prev, reason, t=None, c=None):
+        ms = lambda v: f"{v*1e3:.1f}" if v is not None else ""
+        stamp = datetime.datetime.fromtimestamp(now).isoformat(timespec="seconds")
+        if prev is not None:
+            print(f"[CTRL] {stamp} size {prev[0]}x{prev[1]} → {self.imgsz}x{self.stride}  ({reason})")
+        if self.log is not None:
+            self.csv.writerow([f"{now:.3f}", stamp, self.imgsz, self.stride, prev[0] if prev else "", prev[1] if prev else "",
+                               ms(t), ms(c), ms(self.target), reason])
+            self.log.flush()
+
+
+def read_log(path):
+    """CONTROL_LOG を読んで段毎の区間 [(開始, 終了, IMG_SIZE, stride), ...]（最後の区間の終了は None）"""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    spans = []
+    for r, nxt in zip(rows, rows[1:] + [None]):
+        end = float(nxt["ts"]) if nxt is not None and nxt["reason"] != "start" else None
+        spans.append((float(r["ts"]), end, int(r["imgsz"]), int(r["stride"])))
+    return spans
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="IMG_SIZE/stride の変更ログの集計")
+    ap.add_argument("log", nargs="?", default=CONTROL_LOG)
+    args = ap.parse_args()
+    if not os.path.exists(args.log):
+        print(f"ログがありません: {args.log}", file=sys.stderr); sys.exit(1)
+    total = {}
+    spans = read_log(args.log)
+    for t0, t1, s, k in spans:
+        if t1 is not None:
+            total[(s, k)] = total.get((s, k), 0.0) + t1 - t0
+    fmt = lambda t: datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+    for t0, t1, s, k in spans:
+        print(f"{fmt(t0)} - {fmt(t1) if t1 else '':19s}  {s}x{k}")
+    print("滞在時間: " + "  ".join(f"{s}x{k}: {t:.0f}s" for (s, k), t in sorted(total.items(), key=lambda kv: (-kv[0][0], kv[0][1]))))
@@ -2,31 +2,70 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 import sys
 import time
-import csv
+import argparse
 import cv2
-from ultralytics import YOLO
-from collections import defaultdict
+from model_backend import ModelSet
+from motion_gate import MotionGate
+from roi_crop import roi_rect, roi_imgsz, ROI_MARGIN
+from gate_counter import GateCounter, parse_dets
+from zones import ZoneMap, load_zones
+from overlay import TextCache, Preview
+from preproc import FramePool, TensorPrep
+from latency import LatencyController, IMG_SEQ
+from event_log import EventLog
+from count_store import CountStore
+from metrics import Metrics, LOOP_STAGES, METRICS_SEC
+from pipeline import CounterPipeline, is_live_source, open_reduced_writer
+from startup import Background, StartupTimer, warmup, STARTUP_BUDGET_SEC
 
 # ========= 設定（必要に応じて変更） =========
 SOURCE = "./videos/test video_2.mp4"   # カメラなら 0 / ファイルパス / RTSP など
 CLASSES = [2,5,7]   # COCO:人=0, 自転車=1, 車=2, バイク=3, バス=5, トラック=7
 MODEL = "./models/yolo11n.pt"        # 初回実行で自動DL
 USE_GPU = False             # RTXがあれば True（Torch+CUDA必須）
+BACKEND = "torch"           # CPU推論: torch / onnx / openvino（書き出しは models/cache に保存して再利用）
+PRECISION = "fp32"          # fp32 / fp16(openvino) / int8（CALIB_SOURCE のフレームで校正）
+CALIB_SOURCE = None         # int8 校正に使う録画（None: SOURCE がファイルならそれを使う）
 IMG_SIZE = 960              # CPU時は 960→832→640 で調整
 CONF = 0.25                 # 昼:0.25 / 夜:0.15 まで下げて拾い増し
 IOU = 0.45                  # NMS閾値
 TTL_SEC = 2.0               # 見失ってからID破棄までの秒数
-WRITE_CSV = True
-CSV_PATH = "gate_counts.csv"
+WRITE_EVENTS = True
+EVENT_DIR = "events"          # 検出/通過イベントのバイナリログ（CSVは `python event_log.py export`）
+COUNT_DIR = "counts"          # 1分/15分/1時間毎のクラス別・方向別台数（None: 書かない）
+METRICS_PATH = None           # 段毎の処理時間などの書き出し先（*.prom: Prometheus / *.json）。None: 終了時の表示のみ
+HEADLESS = False            # True: 画面表示/HUD描画なしでデコード速度のまま処理（夜間バッチ用）
+PREVIEW_SCALE = 1.0         # 表示用プレビューの縮小率（0.5: 縦横半分のバッファに描いて imshow。保存動画は等倍のまま）
+DISPLAY_FPS = 15            # 表示の更新レートの上限（カウントは全フレーム）。0: 毎フレーム表示
+OUT_PATH = None             # 注釈付き動画の保存先（None: 保存しない）
+OUT_FPS = 5.0               # 保存動画のFPS（元動画から間引く）
+BATCH = 1                   # ファイル入力時に1回の推論でまとめるフレーム数（追跡はフレーム順に逐次）
+MOTION_GATE = False         # True: ゲート周辺に動きが無いフレームは推論を省略（夜間の省電力）
+ROI_CROP = False            # True: ゲート周辺の切り出しだけを同じ縮尺で推論（小さいゲートで高速）
+ZONES = None                # ゾーン設定のJSON（多角形/向き付きの線。zones.py 参照）。None: ゲートだけ
+TARGET_FPS = 0              # 0以外: 推論がこの FPS に収まるよう IMG_SIZE と検出間隔を自動で変える（latency.py）
+TARGET_MS = 0               # 同じく1フレームあたりの推論時間(ms)で指定（TARGET_FPS より優先）
+CONTROL_LOG = "control_log.csv"   # 自動調整で IMG_SIZE/検出間隔を変えた記録（時刻でイベントログと突き合わせる）
+PREALLOC = True             # True: フレーム/letterbox/入力テンソルのバッファを使い回して推論（preproc.py）
+STARTUP_BUDGET = STARTUP_BUDGET_SEC  # 起動からカウント開始までの目標秒数（超えたら警告）
 # ==========================================
 
+# 縁取り付き文字列はキャッシュした画像を貼る（ヘルプ行などの固定文字は初回だけ描く）
+TEXT = TextCache()
+
 def put(img, s, org, scale=0.7, color=(220,220,220), th=1):
-    cv2.putText(img, s, org, cv2.FONT_HERSHEY_SIMPLEX, scale, (0,0,0), th+2, cv2.LINE_AA)
-    cv2.putText(img, s, org, cv2.FONT_HERSHEY_SIMPLEX, scale, color, th, cv2.LINE_AA)
+    TEXT.put(img, s, org, scale, color, th)
 
 def main():
     global IMG_SIZE
-    model = YOLO(MODEL)
+    timer = StartupTimer(STARTUP_BUDGET)
+    # ultralytics/torch の import とモデル読み込みは、キャプチャを開くのと並行して別スレッドで
+    def load():
+        import batch_track
+        calib = CALIB_SOURCE or (SOURCE if not is_live_source(SOURCE) else None)
+        models = ModelSet(MODEL, BACKEND, PRECISION, calib)
+        return batch_track, models, models.get(IMG_SIZE, wait=True)
+    loader = Background(load)
     device = 0 if USE_GPU else "cpu"
     # device = "cpu"
 
@@ -37,6 +76,9 @@ def main():
     ok, frame = cap.read()
     if not ok:
         print("[ERROR] 先頭フレームが読み取れませんでした。", file=sys.stderr); sys.exit(1)
+    timer.mark("first_frame")
+    bt, models, model = loader.result()
+    timer.mark("model")
 
     h, w = frame.shape[:2]
     # 左右 10% 内側に寄せた幅、縦方向は高さの45〜55%（中央バンド）
@@ -46,34 +88,80 @@ def main():
     # 任意の幅の水平ゲート
     gate = [int(w*0.5), int(h*0.6), int(w*0.8), int(h*0.8)]
 
-    # ID毎の状態
-    counted = set()                # 既にカウントしたID
-    last_seen = defaultdict(lambda: 0.0)  # 最終検出時刻
-    inside_prev = defaultdict(lambda: False)  # 前フレームでゲート内だったか
-    total = 0
+    # ID毎の状態（ゲート通過判定はカウントスレッドで行う）
+    # ゾーン（画素毎の表はここで1回だけ作る）。ゲートの判定と同じID状態の上で数える
+    zmap = ZoneMap(load_zones(ZONES), w, h) if ZONES else None
+    counter = GateCounter(gate, TTL_SEC, direction_mode="motion", zones=zmap)
 
-    # CSV
-    csvw = None
-    if WRITE_CSV:
-        f = open(CSV_PATH, "w", newline="", encoding="utf-8")
-        csvw = csv.writer(f)
-        csvw.writerow(["ts","id","cls","x","y","crossed"])
+    # イベントログ（書き込みは別スレッド。フレームループではブロックに詰めるだけ）
+    elog = EventLog(EVENT_DIR) if WRITE_EVENTS else None
+    # 時間枠毎の台数（`python count_store.py query` で期間集計）
+    store = CountStore(COUNT_DIR) if COUNT_DIR else None
 
     t_prev = time.time(); fps = 0.0
     conf = CONF
 
+    # 段毎の処理時間（各スレッドから observe）。ゲージは書き出し時に読む
+    metrics = Metrics(LOOP_STAGES); clock = time.perf_counter
+
     help_lines = [
         "[Q] Quit   [W/A/S/D] Move gate   [H/L] Thin/Thick   [R] Reset",
         "[N] Night mode (lower conf)   [G] GPU toggle   [Z] Size toggle",
         f"Classes: {CLASSES} (COCO)"
     ]
 
-
-    while True:
-        ok, frame = cap.read()
-        if not ok: break
-
-        # 推論（追跡）
+    # 'z' キー / 自動調整 / ROI 切り出しで使う大きさの書き出しを先に始めておく（できるまでは .pt で推論）
+    if models.exported:
+        sizes = list(IMG_SEQ)
+        if ROI_CROP:
+            sizes += [roi_imgsz(roi_rect(gate, w, h, ROI_MARGIN), w, h, s) for s in IMG_SEQ]
+        first = roi_imgsz(roi_rect(gate, w, h, ROI_MARGIN), w, h, IMG_SIZE) if ROI_CROP else IMG_SIZE
+        models.prepare(sorted(set(sizes), key=lambda s: (s != first, s)))
+
+    # 動き検出による推論スキップ（ゲート内に通過待ちのIDがいる間は止めない）
+    motion = MotionGate() if MOTION_GATE else None
+
+    # バッチ推論 + 逐次追跡（ファイル入力で BATCH>1 のとき / ROI切り出し推論のときに使う）
+    # 書き出し済みモデルは入力サイズ固定なので、imgsz 毎にモデルを選べるこちらの経路を使う
+    # PREALLOC: 前処理は使い回すバッファで行い、準備した入力テンソルを直接推論する（この経路も BatchTracker）
+    prep = TensorPrep() if PREALLOC else None
+    batch_tracker = (bt.BatchTracker(model, "bytetrack.yaml", models, prep)
+                     if (BATCH > 1 or ROI_CROP or models.exported or PREALLOC) else None)
+
+    # 初回推論の初期化コストをカウント開始前に払っておく（model.track 経路は追跡器の登録まで）
+    warmup(model, frame, IMG_SIZE, device, track=batch_tracker is None)
+    timer.mark("warmup")
+    # 推論時間の目標に合わせた IMG_SIZE / 検出間隔の自動調整（変えたら IMG_SIZE を書き換える。'z' は手動の指定）
+    target = TARGET_MS / 1000 if TARGET_MS else (1.0 / TARGET_FPS if TARGET_FPS else 0)
+    def on_control(size, stride):
+        global IMG_SIZE
+        IMG_SIZE = size
+    ctl = LatencyController(target, IMG_SIZE, IMG_SEQ, log_path=CONTROL_LOG, on_change=on_control) if target else None
+
+    def infer_batch(frames):
+        run = [motion.check(f, gate, counter.has_pending()) for f in frames] if motion is not None else None
+        if ctl is not None:
+            # 検出間隔で間引いたフレームも追跡器は進める（動き検出で省略したときと同じ）
+            run = [ctl.should_run() and (run is None or run[i]) for i in range(len(frames))]
+        # 切り出し範囲はゲートの現在位置から毎回求める（W/A/S/D/H/L に追従）
+        roi = roi_rect(gate, w, h, ROI_MARGIN) if ROI_CROP else None
+        t = clock()
+        out = batch_tracker.track(frames, IMG_SIZE, device, conf, IOU, CLASSES, run, roi)
+        if ctl is not None:
+            ctl.observe(clock() - t, sum(run))
+        return out
+
+    # 推論（追跡）: 推論スレッドで呼ばれる。conf/device/IMG_SIZE はキー操作の値を毎回読む
+    def infer(frame):
+        if batch_tracker is not None:
+            return infer_batch([frame])[0]
+        if motion is not None and not motion.check(frame, gate, counter.has_pending()):
+            bt.skip_frame(bt.model_tracker(model), frame)
+            return None
+        if ctl is not None and not ctl.should_run():
+            bt.skip_frame(bt.model_tracker(model), frame)
+            return None
+        t = clock()
         results = model.track(
             source=frame,
             imgsz=IMG_SIZE,
@@ -86,99 +174,122 @@ def main():
             verbose=False,
             stream=False
         )
-
-        now = time.time()
-        dt = now - t_prev
-        fps = 0.9*fps + 0.1*(1.0/max(dt,1e-6))
-        t_prev = now
-
+        if ctl is not None:
+            ctl.observe(clock() - t)
+        return results
+
+    # 検出結果処理 + ゲート通過判定: カウントスレッドで呼ばれる
+    def count(item):
+        t0 = clock(); dets = parse_dets(item.results)
+        t1 = clock(); item.events = counter.update(dets, item.now, expire=False)
+        t2 = clock(); counter.expire(item.now)
+        t3 = clock()
+        metrics.observe("parse", t1-t0); metrics.observe("gate", t2-t1); metrics.observe("ttl", t3-t2)
+
+    # キャプチャはプールのバッファに読む（先頭フレームのバッファもウォームアップ後に返して使う）
+    pool = FramePool(frame.shape) if PREALLOC else None
+    if pool is not None:
+        pool.release(frame)
+    pipe = CounterPipeline(cap, infer, count, live=is_live_source(SOURCE),
+                           batch_fn=infer_batch if batch_tracker else None, batch=BATCH, metrics=metrics,
+                           pool=pool).start()
+
+    metrics.gauge("dropped_frames", lambda: pipe.dropped)
+    metrics.gauge("active_ids", counter.active_ids)
+    metrics.gauge("queue_depth", lambda: dict(zip(("capture", "infer", "out"), pipe.queue_depths())))
+    metrics.gauge("total", lambda: counter.total)
+    metrics.gauge("startup_sec", lambda: timer.elapsed)
+    if zmap is not None:
+        metrics.gauge("zone_counts", lambda: {f"{zn}/{d}": n for zn, ds, tot in zip(zmap.names, zmap.directions, counter.zones.totals())
+                                              for d, n in zip(ds, tot)})
+    if elog is not None: metrics.gauge("event_log_dropped", lambda: elog.dropped)
+    if motion is not None: metrics.gauge("motion_skip_ratio", lambda: motion.skip_ratio)
+    if ctl is not None:
+        metrics.gauge("control", lambda: {"imgsz": ctl.imgsz, "stride": ctl.stride,
+                                          "cost_ms": round((ctl.cost or 0.0) * 1e3, 1), "changes": ctl.changes})
+    if pool is not None:
+        metrics.gauge("frame_buffers", lambda: pool.allocated)
+        metrics.gauge("tensor_buffers_mb", lambda: round(prep.nbytes / 2**20, 1))
+    if METRICS_PATH: metrics.start(METRICS_PATH, METRICS_SEC)
+
+    # 描画（ゲート/検出枠/HUD）。ヘッドレス時は保存するフレームだけ描く
+    # s: 描き先の縮尺（縮小プレビューに描くとき。座標だけ縮め、文字の大きさはそのまま）
+    def draw(frame, events, s=1.0):
+        t_draw = clock()
+        def p(x, y): return (int(x*s), int(y*s))
         # ゲート描画
         x1,y1,x2,y2 = gate
-        cv2.rectangle(frame, (x1,y1), (x2,y2), (0,0,255), 2)
-        put(frame, f"GATE y:{y1}-{y2}", (10, max(20,y1-8)), 0.7, (70,200,255))
-
-        # 検出結果処理
-        dets = []
-        try:
-            r = results[0]
-            if r.boxes is not None and r.boxes.id is not None:
-                for b in r.boxes:
-                    xyxy = b.xyxy[0].tolist()    # [x1,y1,x2,y2]
-                    tid  = int(b.id.item())      # Track ID
-                    cls  = int(b.cls.item())
-                    confb= float(b.conf.item())
-                    dets.append((tid, cls, confb, xyxy))
-        except Exception as e:
-            # まれに追跡が返らないフレームがある
-            dets = []
-
-        # 各IDの前回中心座標を保持
-        center_prev = defaultdict(lambda: None)
-
-        # IDごとにゲート通過判定
-        for (tid, cls, confb, (bx1,by1,bx2,by2)) in dets:
-            cx = int((bx1+bx2)/2); cy = int((by1+by2)/2)
-            last_seen[tid] = now
-
-            inside = (y1 <= cy <= y2) and (x1 <= cx <= x2)
-            was_inside = inside_prev[tid]
-
-            # 通過方向判定用
-            prev_center = center_prev[tid]
-            direction = ""
-            crossed = False
-            if was_inside and not inside and tid not in counted:
-                crossed = True
-                counted.add(tid)
-                total += 1
-                if prev_center is not None:
-                    prev_cx, prev_cy = prev_center
-                    # ゲートの上下方向で判定
-                    if prev_cy < y1 and cy > y2:
-                        direction = "down"
-                    elif prev_cy > y2 and cy < y1:
-                        direction = "up"
-                    elif prev_cx < x1 and cx > x2:
-                        direction = "right"
-                    elif prev_cx > x2 and cx < x1:
-                        direction = "left"
-                    else:
-                        # 単純にy方向で判定
-                        direction = "down" if cy > prev_cy else "up"
-
-            inside_prev[tid] = inside
-            center_prev[tid] = (cx, cy)
-
+        cv2.rectangle(frame, p(x1,y1), p(x2,y2), (0,0,255), 2)
+        put(frame, f"GATE y:{y1}-{y2}", (10, max(20,int(y1*s)-8)), 0.7, (70,200,255))
+        if zmap is not None:
+            zmap.draw(frame, counter.zones, s)
+        if ROI_CROP:
+            rx1,ry1,rx2,ry2 = roi_rect(gate, w, h, ROI_MARGIN)
+            cv2.rectangle(frame, p(rx1,ry1), p(rx2,ry2), (255,160,0), 1)
+
+        for (tid, cls, confb, (bx1,by1,bx2,by2), cx, cy, crossed, direction) in events:
             # 可視化
-            color = (0,255,0) if not tid in counted else (128,128,128)
-            cv2.rectangle(frame, (int(bx1),int(by1)), (int(bx2),int(by2)), color, 2)
+            color = (0,255,0) if not counter.is_counted(tid) else (128,128,128)
+            cv2.rectangle(frame, p(bx1,by1), p(bx2,by2), color, 2)
             label = f"ID:{tid} C{cls} {confb:.2f} D{direction}"
             if crossed and direction:
                 label += f" {direction}"
-            put(frame, label, (int(bx1), max(15,int(by1)-6)), 0.55, (200,255,200))
-            cv2.circle(frame, (cx,cy), 3, (255,255,255), -1)
-
-            if csvw:
-                csvw.writerow([f"{now:.3f}", tid, cls, cx, cy, int(crossed), direction])
-
-        # TTLで古いIDを破棄
-        to_del = [tid for tid,t in last_seen.items() if now - t > TTL_SEC]
-        for tid in to_del:
-            last_seen.pop(tid, None)
-            inside_prev.pop(tid, None)
-            center_prev.pop(tid, None)
-            # counted は保持（重複カウント防止）
+            put(frame, label, (int(bx1*s), max(15,int(by1*s)-6)), 0.55, (200,255,200))
+            cv2.circle(frame, p(cx,cy), 3, (255,255,255), -1)
 
         # HUD
-        put(frame, f"TOTAL: {total}", (10, 24), 0.9, (50,255,50), 2)
-        put(frame, f"FPS: {fps:5.1f}  size:{IMG_SIZE}  conf:{conf:.2f}  device:{'cuda' if device==0 else 'cpu'}",
+        put(frame, f"TOTAL: {counter.total}", (10, 24), 0.9, (50,255,50), 2)
+        put(frame, f"FPS: {fps:5.1f}  size:{IMG_SIZE}  conf:{conf:.2f}  device:{'cuda' if device==0 else 'cpu'}"
+            + (f"  skip:{motion.skip_ratio*100:.0f}%" if motion is not None else "")
+            + (f"  stride:{ctl.stride}  target:{ctl.target*1e3:.0f}ms" if ctl is not None else ""),
             (10, 50), 0.7, (200,200,255))
 
-        for i, line in enumerate(help_lines):
-            put(frame, line, (10, h-10 - 20*(len(help_lines)-1-i)), 0.55, (220,220,220))
-
-        cv2.imshow("YOLO11n Gate Counter", frame)
+        if not HEADLESS:
+            for i, line in enumerate(help_lines):
+                put(frame, line, (10, frame.shape[0]-10 - 20*(len(help_lines)-1-i)), 0.55, (220,220,220))
+        metrics.observe("draw", clock() - t_draw)
+
+    # 注釈付き動画の保存（元動画のFPSから OUT_FPS へ間引く）
+    writer, out_stride = open_reduced_writer(OUT_PATH, cap, OUT_FPS, (w, h)) if OUT_PATH else (None, 1)
+    # 表示は DISPLAY_FPS に間引き、PREVIEW_SCALE の縮小バッファに描く
+    preview = Preview(w, h, PREVIEW_SCALE, DISPLAY_FPS)
+    metrics.gauge("display_frames", lambda: preview.shown)
+    metrics.gauge("text_cache_hit_ratio", lambda: round(TEXT.hit_ratio, 3))
+
+    t_start = time.time(); n_frames = 0
+    t_loop = clock()
+    for item in pipe:
+        t = clock(); metrics.observe("frame", t - t_loop); t_loop = t
+        metrics.inc("frames")
+        if n_frames == 0:
+            timer.mark("first_counted")
+            timer.report()
+        frame = item.frame; now = item.now
+        dt = now - t_prev
+        fps = 0.9*fps + 0.1*(1.0/max(dt,1e-6))
+        t_prev = now
+        n_frames += 1
+
+        if elog is not None:
+            elog.append(item.events, now)
+        if store is not None:
+            store.add(item.events, now)
+        metrics.observe("events", clock() - t)
+
+        drawn = writer is not None and item.idx % out_stride == 0
+        if drawn:
+            draw(frame, item.events)
+            t = clock(); writer.write(frame); metrics.observe("write", clock() - t)
+        if HEADLESS or not preview.due(clock()):
+            continue
+        # 保存用に描いたフレームはそのまま縮小、それ以外は縮小してから描く
+        view = preview.view(frame)
+        if not drawn:
+            draw(view, item.events, preview.scale)
+        t = clock()
+        cv2.imshow("YOLO11n Gate Counter", view)
         k = cv2.waitKey(1) & 0xFF
+        metrics.observe("imshow", clock() - t)
 
         if k in (ord('q'), 27):
             break
@@ -187,14 +298,16 @@ def main():
         elif k == ord('g'):   # GPUトグル（次フレームから反映）
             device = 0 if device=="cpu" else "cpu"
         elif k == ord('z'):   # 画像サイズトグル
-            IMG_SEQ = [640, 832, 960, 1280]
             try:
                 idx = IMG_SEQ.index(IMG_SIZE)
                 IMG_SIZE = IMG_SEQ[(idx+1)%len(IMG_SEQ)]
             except ValueError:
                 IMG_SIZE = 960
+            if ctl is not None:
+                ctl.set(IMG_SIZE)
         elif k == ord('r'):   # カウンタ/状態リセット
-            total = 0; counted.clear(); inside_prev.clear(); last_seen.clear()
+            counter.reset()
+            if batch_tracker: batch_tracker.reset()
         elif k == ord('w'):  # ↑
             gate[1] = max(0, gate[1]-5); gate[3] = max(gate[1]+10, gate[3]-5)
         elif k == ord('s'):  # ↓
@@ -208,15 +321,73 @@ def main():
         elif k == ord('l'):  # 厚み厚く
             if gate[3] < h-1: gate[3] += 3
 
-    if csvw: csvw.__self__.close()  # file close
+    pipe.stop()
+    metrics.stop()
+    elapsed = time.time() - t_start
+    if writer is not None: writer.release()
+
+    # 集計結果とスループット
+    print(f"TOTAL: {counter.total}")
+    print(f"frames:{n_frames}  elapsed:{elapsed:.1f}s  avg FPS:{n_frames/max(elapsed,1e-6):.1f}  dropped:{pipe.dropped}")
+    if zmap is not None:
+        for zn, ds in counter.zones.summary().items():
+            print(f"zone {zn}: " + "  ".join(f"{d}:{v['total']} {v['by_class']}" for d, v in ds.items()))
+    if motion is not None:
+        print(f"motion skip: {motion.skipped}/{motion.frames} ({motion.skip_ratio*100:.1f}%)")
+    if ctl is not None:
+        print(f"control: {ctl.changes} changes  " + ctl.summary())
+        ctl.close()
+    if pool is not None:
+        print(f"buffers: frames {pool.allocated} allocated / {pool.reused} reused, "
+              f"letterbox+tensor {prep.allocated} sets ({prep.nbytes/2**20:.1f} MB)")
+    print("stage timings:\n" + metrics.summary())
+    models.close()
+    if store is not None:
+        store.close()
+    if elog is not None:
+        elog.close()
+        if elog.dropped:
+            print(f"event log dropped: {elog.dropped} rows", file=sys.stderr)
     cap.release()
-    cv2.destroyAllWindows()
+    if not HEADLESS:
+        cv2.destroyAllWindows()
 
 
 
     
 
 if __name__ == "__main__":
-    if len(os.sys.argv) >= 2:
-        SOURCE = os.sys.argv[1]
+    ap = argparse.ArgumentParser(description="YOLO11n ゲート通過カウンタ")
+    ap.add_argument("source", nargs="?", default=SOURCE, help="カメラ番号 / ファイルパス / RTSP など")
+    ap.add_argument("--headless", action="store_true", help="画面表示なしで最大速度で処理し、最後に集計とFPSを表示")
+    ap.add_argument("--preview-scale", type=float, default=PREVIEW_SCALE, help="表示用プレビューの縮小率（0.5 で縦横半分）")
+    ap.add_argument("--display-fps", type=float, default=DISPLAY_FPS, help="表示の更新レートの上限（0: 毎フレーム）")
+    ap.add_argument("--out", default=OUT_PATH, help="注釈付き動画の保存先 (.mp4)")
+    ap.add_argument("--out-fps", type=float, default=OUT_FPS, help="保存動画のFPS（元動画から間引く）")
+    ap.add_argument("--batch", type=int, default=BATCH, help="ファイル入力時のバッチ推論フレーム数（追跡結果は per-frame と同一）")
+    ap.add_argument("--roi", action="store_true", help="ゲート周辺の切り出しだけを推論（検出枠はフル画面座標に戻す）")
+    ap.add_argument("--backend", choices=["torch", "onnx", "openvino"], default=BACKEND, help="CPU推論のバックエンド")
+    ap.add_argument("--precision", choices=["fp32", "fp16", "int8"], default=PRECISION)
+    ap.add_argument("--calib", default=CALIB_SOURCE, help="int8 校正に使う録画")
+    ap.add_argument("--motion", action="store_true", help="ゲート周辺に動きが無いフレームは推論を省略し、スキップ率を表示")
+    ap.add_argument("--events", default=EVENT_DIR, help="イベントログの出力ディレクトリ")
+    ap.add_argument("--no-events", action="store_true", help="イベントログを書かない")
+    ap.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET, help="起動からカウント開始までの目標秒数")
+    ap.add_argument("--metrics", default=METRICS_PATH, help="段毎の処理時間/ゲージを定期的に書き出すファイル（.prom / .json）")
+    ap.add_argument("--target-fps", type=float, default=TARGET_FPS, help="推論の目標 FPS（IMG_SIZE と検出間隔を自動調整）")
+    ap.add_argument("--target-ms", type=float, default=TARGET_MS, help="1フレームあたりの推論時間の目標 (ms)。--target-fps より優先")
+    ap.add_argument("--control-log", default=CONTROL_LOG, help="自動調整の変更記録（CSV）")
+    ap.add_argument("--no-prealloc", action="store_true", help="バッファを使い回さず model.track / predict に任せる（比較用）")
+    ap.add_argument("--zones", default=ZONES, help="ゾーン設定のJSON（ゾーン別・方向別・クラス別に数える）")
+    ap.add_argument("--counts", default=COUNT_DIR, help="時間枠毎の台数の出力ディレクトリ（'' で書かない）")
+    args = ap.parse_args()
+    SOURCE = int(args.source) if str(args.source).isdigit() else args.source
+    PREVIEW_SCALE = args.preview_scale; DISPLAY_FPS = args.display_fps
+    HEADLESS = args.headless; OUT_PATH = args.out; OUT_FPS = args.out_fps; BATCH = args.batch
+    MOTION_GATE = args.motion; ROI_CROP = args.roi
+    EVENT_DIR = args.events; WRITE_EVENTS = not args.no_events; COUNT_DIR = args.counts or None
+    METRICS_PATH = args.metrics; STARTUP_BUDGET = args.startup_budget; ZONES = args.zones
+    PREALLOC = not args.no_prealloc
+    TARGET_FPS = args.target_fps; TARGET_MS = args.target_ms; CONTROL_LOG = args.control_log
+    BACKEND = args.backend; PRECISION = args.precision; CALIB_SOURCE = args.calib
     main()
\ No newline at end of file
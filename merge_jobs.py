@@ -0,0 +1,341 @@
+import os
+import sys
+import csv
+import json
+import queue
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from event_log import read_events, DIRECTIONS, EVENT_DIR
+
+# MP4 の結合ジョブ（file_marge_app.py 用。Qt には依存しない）
+#   - 入力は ffprobe で並列に調べ、コーデック/解像度/フレームレート/画素形式/音声がすべて同じときだけ
+#     concat demuxer のストリームコピー（速い・画質そのまま）。1つでも違えば concat フィルタで
+#     先頭の入力に揃えて再エンコードする（コピーで繋ぐと途中から再生できない/ずれるため）
+#   - 進捗は ffmpeg の -progress（out_time_us）を読んで 0..1 で知らせる
+#   - concat のファイルリストは一時ファイル（同時に複数の結合をしても衝突しない）
+#   - イベントログ（event_log.EventLog の EVENT_DIR）から入力毎の撮影時間帯の行を取り出し、結合後の
+#     動画の時刻（先頭からの秒）にずらして1本の <出力名>_events.csv にまとめる。まとめられなくても
+#     結合した動画はそのまま残し、警告として知らせる
+#   python merge_jobs.py out.mp4 a.mp4 b.mp4 [--reencode]
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+PROBE_WORKERS = 8           # ffprobe を同時に走らせる数
+PROBE_TIMEOUT = 30.0        # 1ファイルを調べるのを待つ秒数
+VIDEO_CODEC = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p"]
+AUDIO_CODEC = ["-c:a", "aac", "-b:a", "128k"]
+# ストリームコピーで繋いでよいか比べる項目
+VIDEO_KEYS = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+AUDIO_KEYS = ("codec_name", "sample_rate", "channels")
+EVENT_COLUMNS = ["video_sec", "file", "ts", "id", "cls", "x", "y", "crossed", "direction", "stream"]
+
+
+class MergeError(Exception):
+    pass
+
+
+def probe(path, timeout=PROBE_TIMEOUT):
+    """ffprobe で1ファイルを調べる {"path", "duration", "video": {...}, "audio": {...} / None}"""
+    cmd = [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    try:
+        r = subprocess.run(cmd, capture_output=True, timeout=timeout, check=True)
+    except FileNotFoundError:
+        raise MergeError(f"{FFPROBE} が見つかりません")
+    except subprocess.TimeoutExpired:
+        raise MergeError(f"調べるのに時間がかかりすぎました: {path}")
+    except subprocess.CalledProcessError as e:
+        raise MergeError(f"読めないファイルです: {path}: {e.stderr.decode(errors='replace').strip()}")
+    info = json.loads(r.stdout or b"{}")
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        raise MergeError(f"映像がありません: {path}")
+    duration = float(info.get("format", {}).get("duration") or video.get("duration") or 0.0)
+    return {"path": path, "duration": duration,
+            "video": {k: video.get(k) for k in VIDEO_KEYS},
+            "audio": {k: audio.get(k) for k in AUDIO_KEYS} if audio else None}
+
+
+def probe_all(paths, workers=PROBE_WORKERS, cancel=None):
+    """paths を並列に調べる（順番は paths のまま）。1つでも失敗したら MergeError"""
+    def run(path):
+        if cancel is not None and cancel.is_set():
+            raise MergeError("中止しました")
+        return probe(path)
+    with ThreadPoolExecutor(max_workers=min(workers, max(1, len(paths)))) as ex:
+        return list(ex.map(run, paths))
+
+
+def plan(infos):
+    """ストリームコピーで繋げるか (True, None) / 再エンコードが要るか (False, 理由)"""
+    v0, a0 = infos[0]["video"], infos[0]["audio"]
+    for info in infos[1:]:
+        name = os.path.basename(info["path"])
+        for k in VIDEO_KEYS:
+            if info["video"][k] != v0[k]:
+                return False, f"{name}: 映像の {k} が違います ({info['video'][k]} / {v0[k]})"
+        if (info["audio"] is None) != (a0 is None):
+            return False, f"{name}: 音声の有無が違います"
+        if a0 is not None:
+            for k in AUDIO_KEYS:
+                if info["audio"][k] != a0[k]:
+                    return False, f"{name}: 音声の {k} が違います ({info['audio'][k]} / {a0[k]})"
+    return True, None
+
+
+def _quote(path):
+    """concat リストの1行（' は '\\'' に）"""
+    escaped = os.path.abspath(path).replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def build_command(infos, out, copy, list_file=None):
+    """ffmpeg のコマンド。copy のときは list_file（concat リスト）を読む"""
+    head = [FFMPEG, "-y", "-hide_banner", "-nostats", "-loglevel", "error", "-progress", "pipe:1"]
+    if copy:
+        return head + ["-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy",
+                       "-movflags", "+faststart", out]
+    # 先頭の入力の解像度/フレームレートに揃えて concat フィルタで繋ぐ。音声は全部にあるときだけ
+    v0 = infos[0]["video"]
+    w, h, fps = v0["width"], v0["height"], v0["r_frame_rate"] or "30"
+    audio = all(i["audio"] is not None for i in infos)
+    cmd = head[:]
+    for i in infos:
+        cmd += ["-i", i["path"]]
+    chains, pads = [], ""
+    for k in range(len(infos)):
+        chains.append(f"[{k}:v:0]scale={w}:{h}:force_original_aspect_ratio=decrease,"
+                      f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps}[v{k}]")
+        pads += f"[v{k}]" + (f"[{k}:a:0]" if audio else "")
+    graph = ";".join(chains) + f";{pads}concat=n={len(infos)}:v=1:a={int(audio)}[v]" + ("[a]" if audio else "")
+    cmd += ["-filter_complex", graph, "-map", "[v]"] + (["-map", "[a]"] + AUDIO_CODEC if audio else [])
+    return cmd + VIDEO_CODEC + ["-movflags", "+faststart", out]
+
+
+def run_ffmpeg(cmd, total, on_progress=None, cancel=None):
+    """cmd を実行して -progress の出力から進捗 (0..1) を知らせる。cancel.is_set() で止める"""
+    with tempfile.TemporaryFile() as err:
+        # エラー出力は一時ファイルへ（パイプに溜めると詰まって ffmpeg が止まる）
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, stdin=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise MergeError(f"{FFMPEG} が見つかりません")
+        # 止めるときは読み出し中の stdout を待たずに済むよう、別スレッドで見張って終了させる
+        done = threading.Event()
+        def watch():
+            while not done.wait(0.2):
+                if cancel is not None and cancel.is_set():
+                    proc.terminate()
+                    return
+        threading.Thread(target=watch, name="ffmpeg-cancel", daemon=True).start()
+        try:
+            for line in proc.stdout:
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                # out_time_ms も中身はマイクロ秒（ffmpeg の歴史的な名前）
+                if key in ("out_time_us", "out_time_ms") and value.lstrip("-").isdigit() and on_progress and total > 0:
+                    on_progress(min(1.0, max(0.0, int(value) / 1e6 / total)))
+                elif key == "progress" and value == "end" and on_progress:
+                    on_progress(1.0)
+            proc.wait()
+        finally:
+            done.set()
+            if proc.poll() is None:
+                proc.kill(); proc.wait()
+        if cancel is not None and cancel.is_set():
+            raise MergeError("中止しました")
+        if proc.returncode != 0:
+            err.seek(0)
+            msg = err.read().decode(errors="replace").strip().splitlines()
+            raise MergeError(f"ffmpeg が失敗しました (code {proc.returncode}): " + " / ".join(msg[-3:]))
+
+
+# ---- イベントログ ----
+def _load_events(event_dir, t0, t1):
+    """イベントログの [t0, t1) の行を [dict] で"""
+    return [{"ts": r[0], "id": r[1], "cls": r[2], "x": r[3], "y": r[4], "crossed": r[5],
+             "direction": DIRECTIONS[r[6]], "stream": r[7]}
+            for r in read_events(event_dir, t0, t1).tolist()]
+
+
+def _origin(info):
+    """入力の先頭フレームの UNIX 時刻。segments.py の .ts があればその先頭、無ければ更新時刻 - 長さ"""
+    ts_path = os.path.splitext(info["path"])[0] + ".ts"
+    if os.path.exists(ts_path):
+        ts = np.fromfile(ts_path, np.float64, count=1)
+        if len(ts):
+            return float(ts[0])
+    return os.path.getmtime(info["path"]) - info["duration"]
+
+
+def merge_events(infos, out, event_dir=EVENT_DIR):
+    """入力毎の撮影時間帯 [先頭の時刻, +長さ) のイベントを結合後の時刻（video_sec = 入力の開始位置 +
+    入力内の秒）にずらしてまとめる。書いた (パス, 行数, 通過数) / 該当する行が無ければ None"""
+    if not os.path.isdir(event_dir):
+        return None
+    offset = 0.0
+    merged = []
+    for info in infos:
+        t0 = _origin(info)
+        name = os.path.basename(info["path"])
+        for r in _load_events(event_dir, t0, t0 + info["duration"]):
+            merged.append(dict(r, video_sec=f"{offset + r['ts'] - t0:.3f}", file=name, ts=f"{r['ts']:.3f}"))
+        offset += info["duration"]
+    if not merged:
+        return None
+    path = os.path.splitext(out)[0] + "_events.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, EVENT_COLUMNS, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(merged)
+    crossed = sum(1 for r in merged if str(r.get("crossed")) == "1")
+    return path, len(merged), crossed
+
+
+def merge(paths, out, reencode=False, on_progress=None, on_status=None, cancel=None, event_dir=EVENT_DIR):
+    """paths を out に結合する。結果の要約を返す（失敗は MergeError）"""
+    status = on_status or (lambda s: None)
+    if not paths:
+        raise MergeError("入力がありません")
+    if os.path.abspath(out) in {os.path.abspath(p) for p in paths}:
+        raise MergeError(f"出力が入力と同じファイルです: {out}")
+    status(f"{len(paths)} ファイルを確認中")
+    infos = probe_all(paths, cancel=cancel)
+    if cancel is not None and cancel.is_set():
+        raise MergeError("中止しました")
+    copy, reason = plan(infos)
+    if reencode:
+        copy, reason = False, "再エンコードを指定"
+    total = sum(i["duration"] for i in infos)
+    status("ストリームコピーで結合中" if copy else f"再エンコードで結合中（{reason}）")
+    list_file = None
+    try:
+        if copy:
+            fd, list_file = tempfile.mkstemp(prefix="concat_", suffix=".txt")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.writelines(_quote(p) for p in paths)
+        run_ffmpeg(build_command(infos, out, copy, list_file), total, on_progress, cancel)
+    except MergeError:
+        # 途中まで書いた出力は残さない
+        if os.path.exists(out):
+            os.remove(out)
+        raise
+    finally:
+        if list_file is not None and os.path.exists(list_file):
+            os.remove(list_file)
+    summary = f"{os.path.basename(out)}: {len(paths)} ファイル, {total:.1f}s, {'コピー' if copy else '再エンコード'}"
+    # 動画はもうできているので、イベントログをまとめられなくても失敗にはしない
+    try:
+        ev = merge_events(infos, out, event_dir)
+    except (OSError, ValueError) as e:
+        summary += f"\n[WARN] イベントログをまとめられませんでした: {e}"
+    else:
+        if ev is not None:
+            summary += f"\nイベントログ: {os.path.basename(ev[0])} ({ev[1]} 行, 通過 {ev[2]})"
+    return summary
+
+
+class MergeQueue:
+    """結合ジョブを1つずつ別スレッドで処理する（GUI から submit するだけで待たない）
+
+    コールバックはワーカースレッドから呼ばれる（Qt ならシグナルで GUI スレッドへ渡す）。
+      on_progress(job_id, 0..1) / on_status(job_id, 文字列) / on_done(job_id, ok, 文字列)
+    """
+
+    def __init__(self, on_progress=None, on_status=None, on_done=None, event_dir=EVENT_DIR):
+        self.event_dir = event_dir
+        self.on_progress = on_progress or (lambda j, p: None)
+        self.on_status = on_status or (lambda j, s: None)
+        self.on_done = on_done or (lambda j, ok, s: None)
+        self.q = queue.Queue()
+        self.next_id = 1
+        self.cancelled = set()
+        self.current = None         # (job_id, cancel Event)
+        self.closing = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="merge-queue", daemon=True)
+        self.thread.start()
+
+    def submit(self, paths, out, reencode=False):
+        """ジョブを積んで job_id を返す"""
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+        self.q.put((job_id, list(paths), out, reencode))
+        return job_id
+
+    def cancel(self, job_id):
+        """待ち中なら飛ばし、実行中なら ffmpeg を止める"""
+        with self.lock:
+            self.cancelled.add(job_id)
+            if self.current is not None and self.current[0] == job_id:
+                self.current[1].set()
+
+    def pending(self):
+        return self.q.qsize()
+
+    def close(self, cancel=True):
+        """cancel: 実行中を止めて待ち中も捨てる / False: 積んだジョブを全部終えてから"""
+        if cancel:
+            with self.lock:
+                self.closing = True
+                if self.current is not None:
+                    self.current[1].set()
+        self.q.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            job = self.q.get()
+            if job is None:
+                break
+            job_id, paths, out, reencode = job
+            cancel = threading.Event()
+            with self.lock:
+                if job_id in self.cancelled or self.closing:
+                    self.on_done(job_id, False, "中止しました")
+                    continue
+                self.current = (job_id, cancel)
+            try:
+                msg = merge(paths, out, reencode,
+                            on_progress=lambda p: self.on_progress(job_id, p),
+                            on_status=lambda s: self.on_status(job_id, s), cancel=cancel,
+                            event_dir=self.event_dir)
+                self.on_done(job_id, True, msg)
+            except MergeError as e:
+                self.on_done(job_id, False, str(e))
+            except Exception as e:
+                self.on_done(job_id, False, f"{type(e).__name__}: {e}")
+            finally:
+                with self.lock:
+                    self.current = None
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MP4 ファイルの結合（ffmpeg）")
+    ap.add_argument("out")
+    ap.add_argument("inputs", nargs="+")
+    ap.add_argument("--reencode", action="store_true", help="コピーで繋げる場合も再エンコードする")
+    ap.add_argument("--check", action="store_true", help="調べて結合方法を表示するだけ")
+    ap.add_argument("--events", default=EVENT_DIR, help="イベントログのディレクトリ")
+    args = ap.parse_args()
+
+    try:
+        if args.check:
+            infos = probe_all(args.inputs)
+            for i in infos:
+                v = i["video"]
+                print(f"{i['path']}: {i['duration']:.2f}s {v['codec_name']} {v['width']}x{v['height']} "
+                      f"{v['r_frame_rate']} {v['pix_fmt']} audio={'yes' if i['audio'] else 'no'}")
+            copy, reason = plan(infos)
+            print("ストリームコピーで結合できます" if copy else f"再エンコードが必要です: {reason}")
+        else:
+            print(merge(args.inputs, args.out, args.reencode,
+                        on_progress=lambda p: print(f"\r{p*100:5.1f}%", end="", file=sys.stderr, flush=True),
+                        on_status=lambda s: print(s, file=sys.stderr), event_dir=args.events))
+    except MergeError as e:
+        print(f"\n[ERROR] {e}", file=sys.stderr); sys.exit(1)
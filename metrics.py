@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_right
+
+# ループ各段の処理時間ヒストグラム + カウンタ/ゲージを持ち、定期的にファイルへ書き出す。
+#   - observe() はバケット探索(bisect)と加算だけ。ロックは取らない（各段は1つのスレッドからしか書かない）
+#   - ゲージ（落としたフレーム数 / 生きているID数 / キュー長 …）は書き出し時に関数を呼んで読む
+#   - 書き出し先の拡張子で形式を選ぶ: .prom → Prometheus テキスト（node_exporter の textfile collector 用）
+#                                     .json → 段毎の件数/平均/p50/p90/p99（ms）
+#   - 計測自体のコスト（起動時に1回測った observe 1回の時間 x 回数）をフレーム時間に対する比率で出す
+
+METRICS_SEC = 10.0          # 書き出し間隔（秒）
+PREFIX = "vehicle_counter"
+# バケット上限（秒）: 10us から2倍ずつ 20段（〜5.2s）
+BUCKETS = tuple(10e-6 * 2**i for i in range(20))
+# main.py / test.py のループの段
+#   read: cap.read / infer: 推論+追跡 / parse: 検出配列の取り出し / gate: 通過判定 / ttl: TTL破棄
+#   events: イベントログ+集計 / draw: 描画 / write: 動画保存 / imshow: imshow+waitKey / frame: フレーム間隔
+LOOP_STAGES = ("read", "infer", "parse", "gate", "ttl", "events", "draw", "write", "imshow", "frame")
+
+
+class Histogram:
+    """固定バケットの処理時間ヒストグラム（秒）"""
+    __slots__ = ("counts", "sum", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)      # 最後は +Inf
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, v):
+        self.counts[bisect_right(BUCKETS, v)] += 1
+        self.sum += v
+        self.n += 1
+
+    def percentile(self, q):
+        """q(0〜100) 番目の値をバケット内の線形補間で近似する"""
+        if self.n == 0:
+            return 0.0
+        k = q / 100 * self.n
+        c = 0
+        for i, n in enumerate(self.counts):
+            if n and c + n >= k:
+                if i >= len(BUCKETS):
+                    return BUCKETS[-1]
+                lo = BUCKETS[i-1] if i else 0.0
+                return lo + (BUCKETS[i] - lo) * (k - c) / n
+            c += n
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """段毎のヒストグラム・カウンタ・ゲージの置き場と定期書き出し"""
+
+    def __init__(self, stages=()):
+        self.hists = {s: Histogram() for s in stages}
+        self.counters = {}
+        self.gauges = {}                # 名前 → 値を返す関数（値は数値、または {ラベル: 数値}）
+        self.t_start = time.time()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.observe_cost = self._calibrate()
+
+    def observe(self, stage, sec):
+        h = self.hists.get(stage)
+        if h is None:
+            h = self.hists[stage] = Histogram()
+        h.observe(sec)
+
+    def inc(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def overhead_ratio(self, frame_stage="frame"):
+        """計測コストの推定値 / フレーム処理時間の合計"""
+        h = self.hists.get(frame_stage)
+        if h is None or h.sum <= 0:
+            return 0.0
+        n_obs = sum(x.n for x in list(self.hists.values()))
+        return n_obs * self.observe_cost / h.sum
+
+    def snapshot(self):
+        """JSON 形式の現在値"""
+        stages = {}
+        for name, h in list(self.hists.items()):
+            if h.n == 0:
+                continue
+            stages[name] = {"count": h.n, "mean_ms": round(h.sum / h.n * 1e3, 3),
+                            "p50_ms": round(h.percentile(50) * 1e3, 3),
+                            "p90_ms": round(h.percentile(90) * 1e3, 3),
+                            "p99_ms": round(h.percentile(99) * 1e3, 3)}
+        return {"ts": round(time.time(), 3), "uptime_sec": round(time.time() - self.t_start, 1),
+                "stages": stages, "counters": dict(self.counters), "gauges": self._read_gauges(),
+                "overhead_ratio": round(self.overhead_ratio(), 6)}
+
+    def prometheus(self):
+        """Prometheus テキスト形式の現在値"""
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for name, h in list(self.hists.items()):
+            c = 0
+            for le, n in zip(BUCKETS, h.counts):
+                c += n
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le:.6g}"}} {c}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.n}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {h.n}')
+        for name, v in list(self.counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {v}")
+        for name, v in self._read_gauges().items():
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            if isinstance(v, dict):
+                lines += [f'{PREFIX}_{name}{{key="{k}"}} {x}' for k, x in v.items()]
+            else:
+                lines.append(f"{PREFIX}_{name} {v}")
+        lines.append(f"# TYPE {PREFIX}_metrics_overhead_ratio gauge")
+        lines.append(f"{PREFIX}_metrics_overhead_ratio {self.overhead_ratio():.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """path に書き出す（途中の状態を読まれないよう一時ファイルから置き換える）"""
+        text = json.dumps(self.snapshot(), ensure_ascii=False) if path.endswith(".json") else self.prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def start(self, path, interval=METRICS_SEC):
+        """interval 秒ごとに path へ書き出すスレッドを開始"""
+        def loop():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.write(path)
+                except OSError as e:
+                    print(f"[WARN] メトリクスを書き出せません: {e}")
+        self.path = path
+        self.thread = threading.Thread(target=loop, name="metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.write(self.path)
+
+    def summary(self):
+        """終了時の表示用（段毎の平均と p50/p99）"""
+        lines = []
+        for name, s in self.snapshot()["stages"].items():
+            lines.append(f"  {name:8s} n={s['count']:<7d} mean {s['mean_ms']:8.3f} ms  p50 {s['p50_ms']:8.3f}  p99 {s['p99_ms']:8.3f}")
+        lines.append(f"  metrics overhead: {self.overhead_ratio()*100:.3f}% of frame time")
+        return "\n".join(lines)
+
+    def _read_gauges(self):
+        out = {}
+        for name, fn in self.gauges.items():
+            try:
+                v = fn()
+            except Exception:
+                continue
+            out[name] = dict(v) if isinstance(v, dict) else v
+        return out
+
+    def _calibrate(self, n=20000):
+        """perf_counter 2回 + observe 1回（プローブ1つ分）のコストを測る"""
+        clock = time.perf_counter
+        t0 = clock()
+        for _ in range(n):
+            t = clock()
+            self.observe("_calibrate", clock() - t)
+        cost = (clock() - t0) / n
+        del self.hists["_calibrate"]
+        return cost
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# CPU 推論バックエンドの切り替えと、書き出したモデルのディスクキャッシュ。
+#   torch    … .pt をそのまま（従来どおり）
+#   onnx     … ONNX Runtime。int8 は自前の映像から取ったフレームで静的量子化（校正）する
+#   openvino … OpenVINO IR。fp16 / int8（NNCF で同様に校正）
+# 書き出したモデルは MODEL_CACHE/<名前>-<.ptのハッシュ>-<imgsz>-<精度>[-<校正映像>] に置き、
+# 次回以降は書き出しを省略する。書き出し済みモデルは入力サイズ固定なので imgsz 毎に1つ作る。
+# 無い大きさ（'z' キー / latency.py の自動調整 / ROI の大きさの変化）は別スレッドで1つずつ書き出して
+# 読み込み、できるまでは .pt で推論する（推論スレッドは書き出しを待たない）。使いそうな大きさは
+# ModelSet.prepare で起動時に書き出しを始めておく。
+#   python model_backend.py export --backend openvino --precision int8 --imgsz 640 --calib ./videos/test.mp4
+
+BACKENDS = ("torch", "onnx", "openvino")
+PRECISIONS = ("fp32", "fp16", "int8")
+MODEL_CACHE = "./models/cache"
+CALIB_FRAMES = 300          # int8 校正に使うフレーム数（動画全体から等間隔に取る）
+QUANTIZE = {"fp32": None, "fp16": 16, "int8": 8}   # ultralytics の export(quantize=...) の値
+
+_hash_cache = {}
+
+
+def file_hash(path, n=12):
+    """モデルファイルの内容のハッシュ（同じパスでも中身が変われば別キャッシュ）"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if key not in _hash_cache:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _hash_cache[key] = h.hexdigest()
+    return _hash_cache[key][:n]
+
+
+def cache_path(model_path, backend, imgsz, precision, calib=None, cache_dir=MODEL_CACHE):
+    """書き出したモデルの置き場所（onnx はファイル、openvino はディレクトリ）"""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{stem}-{file_hash(model_path)}-{imgsz}-{precision}"
+    if precision == "int8" and calib:
+        key += "-" + hashlib.sha1(os.path.abspath(calib).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, key + (".onnx" if backend == "onnx" else "_openvino_model"))
+
+
+def make_calib_dataset(source, out_dir, n=CALIB_FRAMES, names=None):
+    """動画から n フレームを等間隔に取り出し、ultralytics の校正用データセット（data.yaml）を作る"""
+    img_dir = os.path.join(out_dir, "images")
+    yaml_path = os.path.join(out_dir, "data.yaml")
+    if os.path.exists(yaml_path):
+        return yaml_path
+    os.makedirs(img_dir, exist_ok=True)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"校正用のソースを開けませんでした: {source}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or n
+    step = max(1, total // n)
+    saved = 0
+    for i in range(0, total, step):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+        ok, frame = cap.read()
+        if not ok:
+            break
+        cv2.imwrite(os.path.join(img_dir, f"{i:08d}.jpg"), frame)
+        saved += 1
+        if saved >= n:
+            break
+    cap.release()
+    if saved == 0:
+        raise RuntimeError(f"校正用のフレームが読めませんでした: {source}")
+    names = names or {i: str(i) for i in range(80)}
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        # 校正は画像だけを使う（ラベルは不要）
+        f.write(f"path: {os.path.abspath(out_dir)}\ntrain: images\nval: images\n")
+        f.write("names:\n" + "".join(f"  {k}: '{v}'\n" for k, v in names.items()))
+    return yaml_path
+
+
+def export_model(model_path, backend, imgsz, precision="fp32", calib=None, cache_dir=MODEL_CACHE):
+    """backend 形式に書き出してキャッシュのパスを返す（キャッシュがあれば何もしない）"""
+    from ultralytics import YOLO
+    dst = cache_path(model_path, backend, imgsz, precision, calib, cache_dir)
+    if os.path.exists(dst):
+        return dst
+    if precision == "int8" and not calib:
+        raise ValueError("int8 には校正用の映像（calib）が必要です")
+    if backend == "onnx" and precision == "fp16":
+        raise ValueError("onnx の fp16 は CPU では速くならないので対応していません（fp32 / int8）")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # 書き出しは .pt の隣に作られるので、作業用ディレクトリにコピーしてから書き出して移す
+    work = dst + ".tmp"
+    shutil.rmtree(work, ignore_errors=True); os.makedirs(work)
+    src = os.path.join(work, os.path.basename(model_path))
+    shutil.copy2(model_path, src)
+    try:
+        model = YOLO(src)
+        kw = dict(format=backend, imgsz=imgsz, device="cpu", dynamic=False, quantize=QUANTIZE[precision])
+        if precision == "int8":
+            kw["data"] = make_calib_dataset(calib, os.path.join(work, "calib"), names=model.names)
+        t0 = time.time()
+        out = model.export(**kw)
+        os.replace(str(out).rstrip("/\\"), dst)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    print(f"[INFO] {backend}/{precision} imgsz={imgsz} を書き出しました ({time.time()-t0:.0f}s): {dst}")
+    return dst
+
+
+class ModelSet:
+    """設定のバックエンドで imgsz 毎のモデルを用意する（torch なら1つを共有）"""
+
+    def __init__(self, model_path, backend="torch", precision="fp32", calib=None, cache_dir=MODEL_CACHE, fallback=True):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知のバックエンド: {backend}（{'/'.join(BACKENDS)}）")
+        self.model_path = model_path
+        self.backend = backend
+        self.precision = precision
+        self.calib = calib
+        self.cache_dir = cache_dir
+        self.fallback = fallback
+        self.models = {}
+        self.pending = {}           # imgsz → 書き出し/読み込み中の Future
+        self.lock = threading.Lock()
+        self.executor = None
+        self.torch_model = None
+
+    @property
+    def exported(self):
+        """入力サイズ固定の書き出し済みモデルを使うか"""
+        return self.backend != "torch"
+
+    def get(self, imgsz, wait=False):
+        """imgsz で推論するモデル。
+
+        書き出し済みモデルがまだ無ければ別スレッドで用意を始めて、それまでは .pt を返す（wait=True なら待つ）。
+        書き出しに失敗したら警告して以後その大きさは .pt で推論する（fallback=False なら例外）。
+        """
+        if not self.exported:
+            return self._torch()
+        m = self.models.get(imgsz)
+        if m is not None:
+            return m
+        fut = self.prepare([imgsz])[0]
+        if not (wait or fut.done()):
+            return self._torch()
+        try:
+            m = fut.result()
+        except Exception as e:
+            if not self.fallback:
+                raise
+            print(f"[WARN] {self.backend}/{self.precision} imgsz={imgsz} が使えないので torch で推論します: {e}",
+                  file=sys.stderr)
+            m = self._torch()
+        with self.lock:
+            self.models[imgsz] = m
+            self.pending.pop(imgsz, None)
+        return m
+
+    def prepare(self, sizes):
+        """sizes の書き出し/読み込みを別スレッドで始める（済んでいるものは何もしない）。Future のリスト"""
+        futs = []
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-export")
+            for s in sizes:
+                if s in self.models:
+                    continue
+                if s not in self.pending:
+                    self.pending[s] = self.executor.submit(self._load, s)
+                futs.append(self.pending[s])
+        return futs
+
+    def close(self):
+        """待ち中の書き出しを取りやめる（実行中の1つは終わるまで続く）"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _torch(self):
+        from ultralytics import YOLO
+        if self.torch_model is None:
+            self.torch_model = YOLO(self.model_path)
+        return self.torch_model
+
+    def _load(self, imgsz):
+        """書き出し（キャッシュがあれば省略）→ 読み込み → 1回推論して初期化まで済ませる"""
+        from ultralytics import YOLO
+        path = export_model(self.model_path, self.backend, imgsz, self.precision, self.calib, self.cache_dir)
+        m = YOLO(path, task="detect")
+        m.predict(np.zeros((imgsz, imgsz, 3), np.uint8), imgsz=imgsz, device="cpu", verbose=False)
+        return m
+
+
+def bench(clip, model_path, configs, imgsz, frames=200, calib=None, conf=0.25, warmup=5):
+    """同じ動画で各バックエンドの推論時間と検出数を比べる"""
+    cap = cv2.VideoCapture(clip)
+    imgs = []
+    while len(imgs) < frames + warmup:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        imgs.append(frame)
+    cap.release()
+    if not imgs:
+        raise RuntimeError(f"ソースを開けませんでした: {clip}")
+
+    rows = []; ref = None
+    for backend, precision in configs:
+        ms = ModelSet(model_path, backend, precision, calib or clip, fallback=False)
+        t0 = time.time()
+        try:
+            model = ms.get(imgsz, wait=True)
+        except Exception as e:
+            print(f"[WARN] {backend}/{precision}: {e}", file=sys.stderr)
+            rows.append({"backend": backend, "precision": precision, "imgsz": imgsz, "error": str(e)})
+            continue
+        t_load = time.time() - t0
+        lat = []; n_boxes = []
+        for i, f in enumerate(imgs):
+            t = time.perf_counter()
+            r = model.predict(f, imgsz=imgsz, conf=conf, device="cpu", verbose=False)[0]
+            if i >= warmup:
+                lat.append(time.perf_counter() - t)
+                n_boxes.append(len(r.boxes))
+        lat = np.asarray(lat) * 1e3; n_boxes = np.asarray(n_boxes)
+        if ref is None:
+            ref = n_boxes
+        rows.append({"backend": backend, "precision": precision, "imgsz": imgsz, "frames": len(lat),
+                     "load_sec": round(t_load, 2), "mean_ms": round(float(lat.mean()), 3),
+                     "p50_ms": round(float(np.percentile(lat, 50)), 3), "p99_ms": round(float(np.percentile(lat, 99)), 3),
+                     "boxes_per_frame": round(float(n_boxes.mean()), 2),
+                     # 先頭の構成（通常 torch/fp32）とのフレーム毎の検出数の差
+                     "boxes_diff_vs_first": round(float(np.abs(n_boxes - ref).mean()), 2)})
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="CPU 推論バックエンドの書き出しと比較")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="書き出してキャッシュに置く")
+    ex.add_argument("--model", default="./models/yolo11n.pt")
+    ex.add_argument("--backend", choices=BACKENDS[1:], default="openvino")
+    ex.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    ex.add_argument("--imgsz", type=int, nargs="+", default=[960])
+    ex.add_argument("--calib", default=None, help="int8 校正に使う映像")
+    bn = sub.add_parser("bench", help="同じ動画でバックエンドを比較")
+    bn.add_argument("clip")
+    bn.add_argument("--model", default="./models/yolo11n.pt")
+    bn.add_argument("--configs", nargs="+", default=["torch:fp32", "onnx:fp32", "openvino:fp32", "openvino:int8"],
+                    help="backend:precision の並び（先頭が検出数比較の基準）")
+    bn.add_argument("--imgsz", type=int, default=640)
+    bn.add_argument("--frames", type=int, default=200)
+    bn.add_argument("--calib", default=None, help="int8 校正に使う映像（省略時は比較する動画）")
+    bn.add_argument("--out", default=None, help="結果を JSON で保存")
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        for s in args.imgsz:
+            export_model(args.model, args.backend, s, args.precision, args.calib)
+    else:
+        configs = [tuple(c.split(":", 1)) if ":" in c else (c, "fp32") for c in args.configs]
+        rows = bench(args.clip, args.model, configs, args.imgsz, args.frames, args.calib)
+        print(f"{'backend':10s} {'prec':5s} {'load s':>7s} {'mean ms':>8s} {'p50':>8s} {'p99':>8s} {'boxes':>6s} {'diff':>5s}")
+        for r in rows:
+            if "error" in r:
+                print(f"{r['backend']:10s} {r['precision']:5s} 失敗: {r['error']}")
+                continue
+            print(f"{r['backend']:10s} {r['precision']:5s} {r['load_sec']:7.2f} {r['mean_ms']:8.2f} {r['p50_ms']:8.2f}"
+                  f" {r['p99_ms']:8.2f} {r['boxes_per_frame']:6.1f} {r['boxes_diff_vs_first']:5.1f}")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"clip": args.clip, "imgsz": args.imgsz, "results": rows}, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,259 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import sys
+import time
+import json
+import queue
+import argparse
+import threading
+import numpy as np
+import cv2
+import torch
+from ultralytics import YOLO
+from batch_track import make_tracker, apply_tracks
+from gate_counter import GateCounter, parse_dets
+from zones import ZoneMap, load_zones
+from event_log import EventLog
+from count_store import CountStore
+from pipeline import LatestQueue, FrameItem, END, QUEUE_SIZE, is_live_source
+
+# 1プロセスで複数カメラ/動画をカウントする。モデルは1つだけ読み込み、
+# 各ストリームのフレームを1回のバッチ推論にまとめる。追跡器とID毎の状態はストリーム毎。
+#
+# 設定ファイル(JSON)の例:
+# {
+#   "model": "./models/yolo11n.pt", "imgsz": 960, "conf": 0.25, "iou": 0.45,
+#   "threads": 4,                         # 推論(torch)に使うスレッド数（プロセス全体。ストリーム毎ではない）
+#   "event_dir": "events",                # イベントログ（全ストリーム共有、stream 列 = streams の並び順）
+#   "count_dir": "counts",                # 1分/15分/1時間毎の台数（stream 番号はイベントログと同じ）
+#   "streams": [
+#     {"name": "cam1", "source": "rtsp://...", "gate": [0.5, 0.6, 0.8, 0.8],
+#      "classes": [2,5,7],
+#      "zones": "zones_cam1.json",        # 多角形/線のゾーン（zones.py の形式。ファイルかリスト）
+#      "max_fps": 10,                     # このストリームに割り当てる推論回数の上限
+#      "cpus": [0, 1]},                   # デコードスレッドだけを載せるコア（Linuxのみ。推論は共有）
+#     ...
+#   ]
+# }
+# gate は 0〜1 ならフレームサイズに対する比率、それ以外はピクセル座標。
+#
+# ストリーム毎の計算資源の割り当てについて（意図して絞っている）:
+#   推論は全ストリームで1つのモデル・1回のバッチにまとめるので、ストリーム毎に推論のコア/スレッド数は
+#   分けられない。"threads" はプロセス全体の torch のスレッド数（torch.set_num_threads）。
+#   ストリーム毎に決められるのは推論回数の上限（max_fps）と、デコードスレッドを載せるコア（cpus）だけ。
+#   ストリーム毎に推論コアを固定したい場合は、ストリーム毎に別プロセスで main.py を動かす（taskset 等）。
+
+MODEL = "./models/yolo11n.pt"
+IMG_SIZE = 960
+CONF = 0.25
+IOU = 0.45
+TTL_SEC = 2.0
+EVENT_DIR = None            # None: イベントログを書かない
+COUNT_DIR = None            # None: 時間枠毎の台数を書かない
+STATUS_SEC = 5.0            # 状況表示の間隔
+
+
+def resolve_gate(gate, w, h):
+    """比率指定(0〜1)ならピクセルに直す"""
+    if all(0.0 <= v <= 1.0 for v in gate):
+        return [int(gate[0]*w), int(gate[1]*h), int(gate[2]*w), int(gate[3]*h)]
+    return [int(v) for v in gate]
+
+
+class Stream:
+    """1ソース分のキャプチャスレッド・追跡器・カウンタ"""
+
+    def __init__(self, cfg, idx):
+        self.idx = idx
+        self.name = cfg.get("name", f"stream{idx}")
+        self.source = cfg["source"]
+        self.classes = cfg.get("classes")
+        self.gate_spec = cfg.get("gate", [0.5, 0.6, 0.8, 0.8])
+        self.zones = load_zones(cfg["zones"]) if cfg.get("zones") else None
+        self.max_fps = cfg.get("max_fps")
+        self.cpus = cfg.get("cpus")
+        self.live = is_live_source(self.source)
+        self.cap = cv2.VideoCapture(int(self.source) if str(self.source).isdigit() else self.source)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise RuntimeError(f"ソースを開けませんでした: {self.source}")
+        self.q = LatestQueue() if self.live else queue.Queue(QUEUE_SIZE)
+        try:
+            self.tracker = make_tracker(cfg.get("tracker", "bytetrack.yaml"))
+        except Exception:
+            self.cap.release()
+            raise
+        self.counter = None          # 先頭フレームのサイズが分かってから作る
+        self.size = None             # (w, h)
+        self.direction_mode = cfg.get("direction_mode", "motion")
+        self.next_due = 0.0
+        self.done = False
+        self.frames = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._capture, name=f"capture-{self.name}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.ident is not None:     # start 前（後続のストリームが開けなかった）なら待たない
+            self.thread.join(timeout=2.0)
+        self.cap.release()
+
+    def _capture(self):
+        # デコードスレッドを指定コアに固定（他ストリームのデコードと取り合わないように）
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(threading.get_native_id(), set(self.cpus))
+            except OSError as e:
+                print(f"[WARN] {self.name}: CPUアフィニティを設定できません: {e}", file=sys.stderr)
+        idx = 0
+        while not self.stop_event.is_set():
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            idx += 1
+            item = FrameItem(idx, frame, time.time())
+            while not self.stop_event.is_set():
+                try:
+                    self.q.put(item, timeout=0.1); break
+                except queue.Full:
+                    continue
+        self.q.put(END)
+
+    def poll(self, now):
+        """推論枠が空いていて、フレームが届いていれば返す"""
+        if self.done or (self.max_fps and now < self.next_due):
+            return None
+        try:
+            item = self.q.get(timeout=0)
+        except queue.Empty:
+            return None
+        if item is END:
+            self.done = True
+            return None
+        if self.max_fps:
+            self.next_due = now + 1.0/self.max_fps
+        return item
+
+    def set_gate(self, spec):
+        """実行中にゲートを変える（比率 0〜1 またはピクセル）"""
+        self.gate_spec = list(spec)
+        if self.counter is not None:
+            self.counter.set_gate(resolve_gate(self.gate_spec, *self.size))
+
+    def handle(self, item, r, now, elog=None, store=None):
+        """推論結果をこのストリームの追跡器とゲートに通す"""
+        if self.counter is None:
+            h, w = item.frame.shape[:2]
+            self.size = (w, h)
+            zmap = ZoneMap(self.zones, w, h) if self.zones else None
+            self.counter = GateCounter(resolve_gate(self.gate_spec, w, h), TTL_SEC, self.direction_mode, zmap)
+        if self.classes is not None:
+            # 推論は全ストリームのクラスの和集合で行うので、ここで自分のクラスだけ残す
+            keep = np.isin(r.boxes.cls.cpu().numpy().astype(int), self.classes)
+            r = r[torch.as_tensor(keep)]
+        r = apply_tracks(r, self.tracker.update(r.boxes.cpu().numpy(), r.orig_img))
+        events = self.counter.update(parse_dets([r]), now)
+        self.frames += 1
+        if elog is not None:
+            elog.append(events, now, stream=self.idx)
+        if store is not None:
+            store.add(events, now, stream=self.idx)
+        return events
+
+
+def run(config, on_frame=None, on_start=None, stop_event=None):
+    """設定のストリームを全部終わるまで（または stop_event まで）カウントする
+
+    on_start(streams)               … キャプチャ開始前に1回
+    on_frame(stream, item, events)  … 各フレームのカウント後（推論ループのスレッドで呼ばれる）
+    """
+    threads = config.get("threads")
+    if threads:
+        torch.set_num_threads(int(threads))
+    model = YOLO(config.get("model", MODEL))
+    imgsz = config.get("imgsz", IMG_SIZE)
+    conf = config.get("conf", CONF)
+    iou = config.get("iou", IOU)
+    device = config.get("device", "cpu")
+
+    # 途中のストリームが開けなくても、開けた分は finally で閉じる
+    streams = []; elog = store = None
+    try:
+        for i, c in enumerate(config["streams"]):
+            streams.append(Stream(c, i))
+        event_dir = config.get("event_dir", EVENT_DIR)
+        elog = EventLog(event_dir) if event_dir else None
+        count_dir = config.get("count_dir", COUNT_DIR)
+        store = CountStore(count_dir) if count_dir else None
+        # 推論は全ストリームのクラスの和集合（1つでも None なら全クラス）
+        if any(s.classes is None for s in streams):
+            classes = None
+        else:
+            classes = sorted({c for s in streams for c in s.classes})
+        if on_start is not None:
+            on_start(streams)
+        for s in streams:
+            s.start()
+
+        t_status = time.time(); last_frames = [0]*len(streams)
+        while not all(s.done for s in streams) and not (stop_event and stop_event.is_set()):
+            now = time.time()
+            # ラウンドロビンで各ストリームから最大1枚ずつ集める（1ストリームが枠を独占しない）
+            batch = [(s, item) for s in streams for item in [s.poll(now)] if item is not None]
+            if not batch:
+                time.sleep(0.002)
+                continue
+            preds = model.predict(
+                source=[item.frame for _, item in batch],
+                imgsz=imgsz,
+                device=device,
+                conf=conf,
+                iou=iou,
+                classes=classes,
+                verbose=False,
+                stream=False
+            )
+            now = time.time()
+            for (s, item), r in zip(batch, preds):
+                events = s.handle(item, r, now, elog, store)
+                if on_frame is not None:
+                    on_frame(s, item, events)
+
+            if now - t_status >= STATUS_SEC:
+                line = []
+                for i, s in enumerate(streams):
+                    fps = (s.frames - last_frames[i]) / (now - t_status)
+                    last_frames[i] = s.frames
+                    total = s.counter.total if s.counter else 0
+                    line.append(f"{s.name}: total={total} fps={fps:.1f} dropped={getattr(s.q, 'dropped', 0)}")
+                print(" | ".join(line))
+                t_status = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for s in streams:
+            s.close()
+        if store is not None:
+            store.close()
+        if elog is not None:
+            elog.close()
+
+    for s in streams:
+        total = s.counter.total if s.counter else 0
+        print(f"{s.name}: TOTAL {total}  frames:{s.frames}")
+        if s.counter is not None and s.counter.zones is not None:
+            for zn, ds in s.counter.zones.summary().items():
+                print(f"  zone {zn}: " + "  ".join(f"{d}:{v['total']}" for d, v in ds.items()))
+    if elog is not None and elog.dropped:
+        print(f"event log dropped: {elog.dropped} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="複数ストリームを1プロセス・共有モデルでカウント")
+    ap.add_argument("config", help="ストリーム設定のJSONファイル")
+    args = ap.parse_args()
+    with open(args.config, encoding="utf-8") as f:
+        run(json.load(f))
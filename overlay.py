@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+# HUD/ラベル描画の軽量化（main.py / test.py 共通）
+#   - 文字列は (文字列, 大きさ, 色, 太さ) 毎に「縁取り+本体」を1回だけ小さな画像に描いてキャッシュし、
+#     以降は貼り付けるだけ（cv2.putText 2回の代わりにマスク付きコピー1回）。
+#     （マスク付きコピーは cv2.copyTo。np.copyto(where=) はブロードキャストが遅い）
+#     ヘルプ行や凡例のような固定の文字は初回以外すべてキャッシュから、値の変わる文字は変わったときだけ描き直す
+#   - 表示用のプレビューは縮小したバッファ（使い回し）に描き、imshow に渡す画素数を減らす
+#   - 表示の更新はカウントより低いレート（DISPLAY_FPS）に間引く
+
+TEXT_CACHE = 512            # キャッシュする文字列画像の数（古いものから捨てる）
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+class TextCache:
+    """縁取り付きの文字列画像のキャッシュ"""
+
+    def __init__(self, max_items=TEXT_CACHE):
+        self.max_items = max_items
+        self.items = OrderedDict()      # key → (画像, マスク, 基準点x, 基準点y)
+        self.hits = 0
+        self.misses = 0
+
+    def _render(self, text, scale, color, th):
+        (tw, tht), base = cv2.getTextSize(text, FONT, scale, th+2)
+        pad = th + 2
+        w, h = tw + 2*pad, tht + base + 2*pad
+        org = (pad, pad + tht)
+        img = np.zeros((h, w, 3), np.uint8)
+        mask = np.zeros((h, w), np.uint8)
+        # 縁取り（黒）の範囲をマスクに、本体を黒地の上に描く → マスク内をそのまま貼れば縁取り付きになる
+        cv2.putText(mask, text, org, FONT, scale, 255, th+2, cv2.LINE_AA)
+        cv2.putText(img, text, org, FONT, scale, color, th, cv2.LINE_AA)
+        return img, mask, org[0], org[1]
+
+    def get(self, text, scale, color, th):
+        key = (text, scale, color, th)
+        v = self.items.get(key)
+        if v is None:
+            self.misses += 1
+            v = self.items[key] = self._render(text, scale, color, th)
+            if len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+        return v
+
+    def put(self, img, text, org, scale=0.7, color=(220,220,220), th=1):
+        """cv2.putText と同じ基準点(左下)で縁取り付きの文字列を貼る（画面外にはみ出た分は切る）"""
+        patch, mask, ox, oy = self.get(text, scale, tuple(color), th)
+        H, W = img.shape[:2]
+        ph, pw = patch.shape[:2]
+        x, y = int(org[0]) - ox, int(org[1]) - oy
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + pw, W), min(y + ph, H)
+        if x0 >= x1 or y0 >= y1:
+            return
+        # img のスライス（ビュー）にそのまま書き込まれる
+        cv2.copyTo(patch[y0-y:y1-y, x0-x:x1-x], mask[y0-y:y1-y, x0-x:x1-x], img[y0:y1, x0:x1])
+
+    @property
+    def hit_ratio(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+
+class Preview:
+    """表示用の縮小フレーム（バッファを使い回す）と表示の間引き"""
+
+    def __init__(self, w, h, scale=1.0, fps=0):
+        self.scale = scale
+        self.size = (max(1, int(w*scale)), max(1, int(h*scale)))
+        self.buf = np.empty((self.size[1], self.size[0], 3), np.uint8) if scale < 1.0 else None
+        self.interval = 1.0/fps if fps else 0.0
+        self.t_last = -1e9
+        self.shown = 0
+
+    def due(self, t):
+        """t（perf_counter）に表示を更新するか"""
+        if t - self.t_last < self.interval:
+            return False
+        self.t_last = t
+        self.shown += 1
+        return True
+
+    def view(self, frame):
+        """表示する画像（縮小しないときは frame そのもの）"""
+        if self.buf is None:
+            return frame
+        return cv2.resize(frame, self.size, dst=self.buf, interpolation=cv2.INTER_LINEAR)
@@ -0,0 +1,231 @@
+import queue
+import threading
+import time
+import cv2
+
+# キャプチャ → 推論(追跡) → カウント → 描画/CSV を別スレッドで回すパイプライン
+# 各ステージは上限付きキューで繋ぎ、全体のスループットは一番遅いステージで決まる。
+#   ライブソース(カメラ/RTSP) : キャプチャ→推論間は「最新フレーム優先」で古いフレームを捨てる
+#   ファイルソース            : 全キューがブロッキングで1フレームも落とさない
+
+QUEUE_SIZE = 4              # ステージ間キューの上限
+END = object()              # ストリーム終端の目印
+
+
+def is_live_source(source):
+    """カメラ番号やRTSP等のライブソースか（ファイルでないか）"""
+    if isinstance(source, int):
+        return True
+    s = str(source).strip()
+    return s.isdigit() or s.lower().startswith(("rtsp://", "rtmp://", "http://", "https://", "udp://", "tcp://"))
+
+
+class LatestQueue:
+    """最新の1件だけを保持するキュー（put で古い要素は捨てる。on_drop(捨てた要素) があれば呼ぶ）"""
+
+    def __init__(self, on_drop=None):
+        self._item = None
+        self.on_drop = on_drop
+        self._has = False
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item, timeout=None):
+        with self._cond:
+            if self._has and self._item is not END:
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(self._item)
+            if not (self._has and self._item is END):
+                self._item = item
+            self._has = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has, timeout):
+                raise queue.Empty
+            item = self._item
+            self._item = None; self._has = False
+            return item
+
+    def qsize(self):
+        return 1 if self._has else 0
+
+
+class FrameItem:
+    """パイプラインを流れる1フレーム分のデータ"""
+    __slots__ = ("idx", "frame", "t_cap", "now", "results", "events")
+
+    def __init__(self, idx, frame, t_cap):
+        self.idx = idx
+        self.frame = frame
+        self.t_cap = t_cap      # キャプチャ時刻
+        self.now = t_cap        # 推論完了時刻（カウント/CSVの時刻）
+        self.results = None
+        self.events = []
+
+
+class CounterPipeline:
+    """cap.read / 推論 / カウント を別スレッドで回し、描画側へ FrameItem を順に渡す
+
+    infer_fn(frame) -> results         … 推論スレッドで呼ばれる
+    batch_fn(frames) -> [results, ...] … batch>1 のとき infer_fn の代わりに呼ばれる（ファイルのみ）
+    count_fn(item)                     … カウントスレッドで呼ばれる（item.events を埋める）
+    metrics                            … 指定すると "read" / "infer" の処理時間を記録する
+    pool                               … preproc.FramePool。フレームをそのバッファに読み、ループの1周が
+                                         終わったら（捨てたフレームはその時に）返す
+    描画/CSV/imshow は呼び出し側スレッドで `for item in pipe:` として回す。
+    item.frame はその周回の間だけ有効（次の周回では別のフレームの読み込みに使われる）。
+    """
+
+    def __init__(self, cap, infer_fn, count_fn, live=False, qsize=QUEUE_SIZE, batch_fn=None, batch=1, metrics=None,
+                 pool=None):
+        self.cap = cap
+        self.pool = pool
+        self.metrics = metrics
+        self.infer_fn = infer_fn
+        self.count_fn = count_fn
+        self.live = live
+        # ライブソースは遅延が増えるのでバッチにしない
+        self.batch_fn = batch_fn
+        self.batch = batch if (batch_fn is not None and not live) else 1
+        self.stop_event = threading.Event()
+        self.q_cap = LatestQueue(self._release) if live else queue.Queue(max(qsize, 2*self.batch))
+        self.q_inf = queue.Queue(qsize)
+        self.q_out = queue.Queue(qsize)
+        self.error = None
+        self.frames_read = 0
+        self._threads = [
+            threading.Thread(target=self._run, args=(self._capture, None, self.q_cap), name="capture", daemon=True),
+            threading.Thread(target=self._run, args=(self._infer, self.q_cap, self.q_inf), name="infer", daemon=True),
+            threading.Thread(target=self._run, args=(self._count, self.q_inf, self.q_out), name="count", daemon=True),
+        ]
+
+    @property
+    def dropped(self):
+        return getattr(self.q_cap, "dropped", 0)
+
+    def queue_depths(self):
+        return self.q_cap.qsize(), self.q_inf.qsize(), self.q_out.qsize()
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for t in self._threads:
+            t.join(timeout=2.0)
+
+    def __iter__(self):
+        while True:
+            item = self._get(self.q_out)
+            if item is END or item is None:
+                break
+            yield item
+            self._release(item)
+        if self.error is not None:
+            raise self.error
+
+    # ---- 内部 ----
+    def _release(self, item):
+        if self.pool is not None:
+            self.pool.release(item.frame)
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _run(self, stage, q_in, q_out):
+        try:
+            stage(q_in, q_out)
+        except Exception as e:
+            self.error = e
+        finally:
+            # 終端は必ず下流へ流す（LatestQueue でも END は捨てられない）
+            self._put(q_out, END)
+
+    def _capture(self, q_in, q_out):
+        idx = 0
+        m = self.metrics; clock = time.perf_counter
+        while not self.stop_event.is_set():
+            t = clock()
+            ok, frame = self.pool.read(self.cap) if self.pool is not None else self.cap.read()
+            if m is not None: m.observe("read", clock() - t)
+            if not ok:
+                break
+            idx += 1
+            self.frames_read = idx
+            if not self._put(q_out, FrameItem(idx, frame, time.time())):
+                break
+
+    def _infer(self, q_in, q_out):
+        end = False
+        m = self.metrics; clock = time.perf_counter
+        while not end:
+            item = self._get(q_in)
+            if item is END or item is None:
+                break
+            if self.batch == 1:
+                t = clock()
+                item.results = self.infer_fn(item.frame)
+                if m is not None: m.observe("infer", clock() - t)
+                item.now = time.time()
+                if not self._put(q_out, item):
+                    break
+                continue
+
+            # batch 枚そろうまで（または終端まで）ためてまとめて推論
+            items = [item]
+            while len(items) < self.batch:
+                nxt = self._get(q_in)
+                if nxt is END or nxt is None:
+                    end = True
+                    break
+                items.append(nxt)
+            t = clock()
+            results = self.batch_fn([it.frame for it in items])
+            if m is not None:
+                dt = (clock() - t) / len(items)     # 1フレームあたり
+                for _ in items: m.observe("infer", dt)
+            now = time.time()
+            for it, r in zip(items, results):
+                it.results = r; it.now = now
+                if not self._put(q_out, it):
+                    return
+
+    def _count(self, q_in, q_out):
+        while True:
+            item = self._get(q_in)
+            if item is END or item is None:
+                break
+            self.count_fn(item)
+            if not self._put(q_out, item):
+                break
+
+
+def open_reduced_writer(path, cap, out_fps, size):
+    """元動画のFPSから out_fps 相当に間引いて保存する VideoWriter を開く
+
+    戻り値: (writer, stride)  … idx % stride == 0 のフレームだけ書き込む
+    """
+    src_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    stride = max(1, int(round(src_fps / max(out_fps, 1e-6))))
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    writer = cv2.VideoWriter(path, fourcc, src_fps / stride, size)
+    return writer, stride
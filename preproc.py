@@ -0,0 +1,125 @@
+from collections import deque
+import numpy as np
+import cv2
+
+# 推論の前処理を事前確保したバッファで行う（main.py / test.py の PREALLOC、batch_track.BatchTracker）
+#   - キャプチャは FramePool のバッファに cap.read(image=buf) で読み、描画ループが使い終わったら返す
+#     （足りなければその時だけ確保するので、パイプラインの深さ分で増えなくなる）
+#   - letterbox は固定の uint8 バッファの中央に cv2.resize(dst=) で直接書き込む（余白は作るときに1回だけ塗る）
+#   - 入力テンソル（BCHW / RGB / 0..1 の float32）も固定。BGR→RGB と HWC→CHW は copy_ で変換しながら写す
+#   - 準備したテンソルをそのまま推論・NMS に渡し、枠は元フレームの座標に戻す（ultralytics の postprocess）。
+#     model.predict(frames) の内部の letterbox / stack / flip / float 変換のたびの確保が無くなる
+#   バッファは (入力の大きさ, 推論サイズ, バッチ) 毎に1組。'z' キーや ROI の大きさの変化ではその組を使う
+#   torch は使うときに import する（main.py / test.py は torch の読み込みをキャプチャを開くのと並行して行うため）
+
+PAD_VALUE = 114             # letterbox の余白（ultralytics と同じ）
+PATHS = [f"frame{i}.jpg" for i in range(64)]
+
+
+class FramePool:
+    """キャプチャ用フレームバッファの使い回し（acquire はキャプチャスレッド、release は描画ループから）"""
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.free = deque()
+        self.allocated = 0          # 確保した数（使い回せず新しく作った数）
+        self.reused = 0
+
+    def acquire(self):
+        try:
+            buf = self.free.pop()
+            self.reused += 1
+            return buf
+        except IndexError:
+            self.allocated += 1
+            return np.empty(self.shape, np.uint8)
+
+    def release(self, buf):
+        if buf is not None and buf.shape == self.shape:
+            self.free.append(buf)
+
+    def read(self, cap):
+        """cap.read をプールのバッファに読む（大きさが違えば OpenCV が新しく確保したものを返す）"""
+        buf = self.acquire()
+        ok, frame = cap.read(image=buf)
+        if not ok:
+            self.release(buf)
+        return ok, frame
+
+
+class Letterbox:
+    """1つの (入力の大きさ, 推論サイズ, バッチ) 用の letterbox バッファと入力テンソル"""
+
+    def __init__(self, h, w, imgsz, batch, auto, stride=32):
+        import torch
+        # ultralytics の LetterBox と同じ計算（枠を戻す scale_boxes もこの前提）
+        r = min(imgsz / h, imgsz / w)
+        nw, nh = round(w * r), round(h * r)
+        dw, dh = imgsz - nw, imgsz - nh
+        if auto:                    # 最小の矩形（.pt / dynamic のモデル）
+            dw, dh = dw % stride, dh % stride
+        dw /= 2; dh /= 2
+        top, bottom = round(dh - 0.1), round(dh + 0.1)
+        left, right = round(dw - 0.1), round(dw + 0.1)
+        self.size = (nw, nh)
+        self.img = np.full((nh + top + bottom, nw + left + right, 3), PAD_VALUE, np.uint8)
+        self.inner = self.img[top:top+nh, left:left+nw]
+        self.src = torch.from_numpy(self.img)       # img と同じメモリ
+        self.tensor = torch.empty((batch, 3) + self.img.shape[:2], dtype=torch.float32)
+        self.nbytes = self.img.nbytes + self.tensor.numel() * 4
+
+    def fill(self, frames):
+        """frames を letterbox して入力テンソル [:len(frames)] に書く（新しい配列は作らない）"""
+        for i, f in enumerate(frames):
+            cv2.resize(f, self.size, dst=self.inner, interpolation=cv2.INTER_LINEAR)
+            for c in range(3):
+                self.tensor[i, c].copy_(self.src[:, :, 2 - c])     # BGR → RGB, HWC → CHW, uint8 → float
+        t = self.tensor[:len(frames)]
+        return t.mul_(1.0 / 255)
+
+
+class TensorPrep:
+    """letterbox バッファを使い回して前処理し、推論・NMS まで行う（model.predict の代わり）"""
+
+    def __init__(self):
+        self.buffers = {}
+        self.frames = 0
+
+    @property
+    def allocated(self):
+        return len(self.buffers)
+
+    @property
+    def nbytes(self):
+        return sum(b.nbytes for b in self.buffers.values())
+
+    def buffer(self, predictor, h, w, imgsz, n):
+        m = predictor.model
+        fmt = getattr(m, "format", None)
+        auto = (fmt == "pt" if fmt is not None else bool(getattr(m, "pt", False))) or bool(getattr(m, "dynamic", False))
+        key = (h, w, imgsz, auto)
+        lb = self.buffers.get(key)
+        # バッチは大きい方に合わせて作り直す（小さいバッチは先頭だけ使う）
+        if lb is None or lb.tensor.shape[0] < n:
+            lb = self.buffers[key] = Letterbox(h, w, imgsz, n, auto, int(getattr(m, "stride", 32)))
+        return lb
+
+    def detect(self, model, frames, imgsz, device, conf, iou, classes):
+        """frames（同じ大きさの BGR 画像）を推論して Results のリストを返す（枠は frames の座標）"""
+        import torch
+        p = model.predictor
+        if p is None:
+            # 推論器の準備（モデル読み込み/デバイス/ウォームアップ）は ultralytics に1回だけ任せる
+            model.predict(source=frames[0], imgsz=imgsz, device=device, verbose=False)
+            p = model.predictor
+        p.args.conf = conf; p.args.iou = iou; p.args.classes = classes
+        h, w = frames[0].shape[:2]
+        lb = self.buffer(p, h, w, imgsz, len(frames))
+        n = len(frames)
+        p.batch = (PATHS[:n] if n <= len(PATHS) else [f"frame{i}.jpg" for i in range(n)], frames, [""] * n)
+        with torch.inference_mode():
+            im = p.preprocess(lb.fill(frames))      # CPU / float32 ならそのまま（GPU なら転送だけ）
+            preds = p.inference(im)
+            results = p.postprocess(preds, im, list(frames))
+        self.frames += n
+        return results
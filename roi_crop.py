@@ -0,0 +1,35 @@
+import math
+
+# カウント判定はゲート付近の中心点だけで決まるので、ゲートを ROI_MARGIN 広げた範囲だけを推論する。
+# 推論サイズは「フル画面を IMG_SIZE で推論したときと同じ縮尺」になるよう切り出し幅に合わせて下げる。
+# 検出枠はフル画面座標に戻してから追跡器に渡すので、ゲートを動かして切り出し位置が変わってもIDは続く。
+# 推論サイズは ROI_STEP 刻みに切り上げる（書き出し済みモデルは大きさ毎に1つなので、ゲートを少し
+# 動かすたびに新しい大きさにならないように）。縮尺は同じか少し細かくなる。
+
+ROI_MARGIN = 200            # ゲートの外側に広げて推論する幅（px）。車両1台分以上にしておく
+ROI_STEP = 128              # 切り出しの推論サイズの刻み（IMG_SIZE を超えるときは IMG_SIZE）
+
+
+def roi_rect(gate, w, h, margin=ROI_MARGIN):
+    """ゲートを margin 広げてフレーム内に収めた切り出し範囲 (x1,y1,x2,y2)"""
+    x1,y1,x2,y2 = gate
+    return max(0, x1-margin), max(0, y1-margin), min(w, x2+margin), min(h, y2+margin)
+
+
+def roi_imgsz(rect, w, h, imgsz, step=ROI_STEP):
+    """フル画面を imgsz で推論したときと同じ縮尺以上になる切り出し用の推論サイズ（step の倍数か imgsz）"""
+    x1,y1,x2,y2 = rect
+    scale = imgsz / max(w, h)
+    return min(imgsz, max(1, int(math.ceil(max(x2-x1, y2-y1) * scale / step))) * step)
+
+
+def to_full_frame(r, rect, frame):
+    """切り出し画像の推論結果をフル画面座標に戻す（Results をその場で書き換える）"""
+    ox, oy = rect[0], rect[1]
+    data = r.boxes.data.clone()
+    data[:, [0, 2]] += ox
+    data[:, [1, 3]] += oy
+    r.orig_img = frame
+    r.orig_shape = frame.shape[:2]
+    r.update(boxes=data)
+    return r
@@ -0,0 +1,281 @@
+import os
+import sys
+import csv
+import glob
+import time
+import queue
+import argparse
+import datetime
+import threading
+import numpy as np
+import cv2
+
+# 録画のセグメント書き出しと、時刻 → ファイル/フレーム位置の索引。
+#   - エンコードは書き出しスレッドで行い、撮影側は上限付きキューに入れるだけ（あふれたら落として数える）
+#   - セグメントは開始時刻から section 秒毎の枠で区切る。次のセグメントの VideoWriter は境界の
+#     PREOPEN_SEC 前に別スレッドで開いておき、境界では差し替えるだけ。閉じる（mp4 の確定）のも別スレッドで
+#   - セグメント毎に各フレームの撮影時刻を <名前>.ts（float64 の並び）に書き、閉じたら segments.csv に
+#     1行（ファイル, 最初/最後のフレーム時刻, フレーム数）を追加する。時刻範囲からの頭出しは
+#     索引で対象ファイルを選び、.ts を二分探索してフレーム番号を出す（動画は読まない）
+#   - .ts は TS_FLUSH_SEC 毎に flush するので、書き込み中のセグメントもその遅れまでで頭出しできる
+#   python segments.py find time_lapse_videos 14:00 14:15
+#   python segments.py find time_lapse_videos "2026-10-18 14:00" "2026-10-18 14:15"
+
+WRITE_QUEUE = 64            # 書き出し待ちのフレーム数の上限
+PREOPEN_SEC = 5.0           # 境界の何秒前に次のセグメントを開いておくか
+TS_FLUSH_SEC = 1.0          # 書き込み中の .ts を読めるようにする間隔
+INDEX_FILE = "segments.csv"
+INDEX_HEADER = ["file", "start", "end", "frames", "fps", "start_iso"]
+END = object()
+
+
+class Segment:
+    """1ファイル分の VideoWriter と各フレームの時刻"""
+
+    def __init__(self, output_dir, prefix, no, start, end, fourcc, fps, size):
+        self.no = no
+        self.start = start; self.end = end      # 枠の範囲（スケジュール上の時刻）
+        stamp = datetime.datetime.fromtimestamp(start).strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(output_dir, f"{prefix}_{no}_{stamp}.mp4")
+        self.ts_path = os.path.splitext(self.path)[0] + ".ts"
+        self.fps = fps
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        self.ts_file = open(self.ts_path, "wb")
+        self.frames = 0
+        self.first = self.last = None
+        self.t_flush = time.time()
+
+    def write(self, frame, ts):
+        self.writer.write(frame)
+        self.ts_file.write(np.float64(ts).tobytes())
+        self.frames += 1
+        if self.first is None:
+            self.first = ts
+        self.last = ts
+        # 書き込み中のセグメントも read_index / find から見えるように
+        now = time.time()
+        if now - self.t_flush >= TS_FLUSH_SEC:
+            self.ts_file.flush()
+            self.t_flush = now
+
+    def close(self):
+        """閉じて索引の行を返す（フレームが無ければファイルごと消して None）"""
+        self.writer.release()
+        self.ts_file.close()
+        if self.frames == 0:
+            for p in (self.path, self.ts_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            return None
+        return [os.path.basename(self.path), f"{self.first:.3f}", f"{self.last:.3f}", self.frames, self.fps,
+                datetime.datetime.fromtimestamp(self.first).isoformat(timespec="seconds")]
+
+
+class SegmentWriter:
+    """撮影スレッドから write(frame, ts) で受け取り、別スレッドでセグメント毎に書き出す"""
+
+    def __init__(self, output_dir, fps, size, section_sec, t_start=None, prefix="video", fourcc="mp4v",
+                 qsize=WRITE_QUEUE):
+        self.output_dir = output_dir
+        self.fps = fps; self.size = size
+        self.section = section_sec
+        self.t_start = time.time() if t_start is None else t_start
+        self.prefix = prefix; self.fourcc = fourcc
+        self.q = queue.Queue(qsize)
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+        self.index_lock = threading.Lock()
+        self._closers = []
+        self._next = None           # (セグメント番号, 開いているスレッド, 結果の入れ物)
+        os.makedirs(output_dir, exist_ok=True)
+        self.current = self._open(1)
+        self.thread = threading.Thread(target=self._run, name="segment-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, frame, ts):
+        """キューに入れるだけ（満杯なら落として False。撮影側は待たない）。
+        書き出しスレッドがエラーで止まっていたらその例外を投げる"""
+        if self.error is not None:
+            raise self.error
+        try:
+            self.q.put_nowait((frame, ts))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        # 書き出しスレッドが止まっている（書き込みエラー）とキューが空かないので、待つのは生きている間だけ
+        while self.thread.is_alive():
+            try:
+                self.q.put(END, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    @property
+    def path(self):
+        return self.current.path
+
+    # ---- 書き出しスレッド ----
+    def _open(self, no):
+        start = self.t_start + (no-1)*self.section
+        return Segment(self.output_dir, self.prefix, no, start, start + self.section,
+                       self.fourcc, self.fps, self.size)
+
+    def _preopen(self, no):
+        box = []
+        t = threading.Thread(target=lambda: box.append(self._open(no)), name="segment-open", daemon=True)
+        t.start()
+        self._next = (no, t, box)
+
+    def _take_next(self, no):
+        """no 番のセグメント（開いてあればそれ、無ければここで開く）"""
+        if self._next is not None:
+            n, t, box = self._next
+            self._next = None
+            t.join()
+            if n == no and box:
+                return box[0]
+            if box:
+                self._close_async(box[0])      # 枠を飛ばした（フレームの来なかった）セグメント
+        return self._open(no)
+
+    def _close_async(self, seg):
+        def close():
+            row = seg.close()
+            if row is not None:
+                self._append_index(row)
+        t = threading.Thread(target=close, name="segment-close", daemon=True)
+        t.start()
+        self._closers.append(t)
+
+    def _append_index(self, row):
+        path = os.path.join(self.output_dir, INDEX_FILE)
+        with self.index_lock:
+            new = not os.path.exists(path)
+            with open(path, "a", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                if new:
+                    w.writerow(INDEX_HEADER)
+                w.writerow(row)
+
+    def _run(self):
+        try:
+            while True:
+                cur = self.current
+                if self._next is None and time.time() >= cur.end - PREOPEN_SEC:
+                    self._preopen(cur.no + 1)
+                try:
+                    item = self.q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if item is END:
+                    break
+                frame, ts = item
+                no = int((ts - self.t_start) // self.section) + 1
+                if no > cur.no:
+                    # 境界: 開いておいた次のセグメントに差し替えて、今のものは裏で閉じる
+                    self.current = self._take_next(no)
+                    self._close_async(cur)
+                    print(f"新しい録画ファイルに切り替え: {self.current.path}")
+                self.current.write(frame, ts)
+                self.written += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            if self._next is not None:
+                _, t, box = self._next
+                t.join()
+                if box:
+                    self._close_async(box[0])
+                self._next = None
+            self._close_async(self.current)
+            for t in self._closers:
+                t.join()
+
+
+# ---- 索引の読み出し ----
+def read_index(output_dir):
+    """セグメントの一覧（開始時刻順）。索引に無い書き込み中のセグメントは .ts から補う"""
+    rows = []
+    path = os.path.join(output_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for r in csv.DictReader(f):
+                rows.append({"file": r["file"], "start": float(r["start"]), "end": float(r["end"]),
+                             "frames": int(r["frames"]), "fps": float(r["fps"])})
+    listed = {os.path.splitext(r["file"])[0] for r in rows}
+    for ts_path in glob.glob(os.path.join(output_dir, "*.ts")):
+        stem = os.path.splitext(os.path.basename(ts_path))[0]
+        if stem in listed:
+            continue
+        ts = np.fromfile(ts_path, np.float64)
+        if len(ts):
+            rows.append({"file": stem + ".mp4", "start": float(ts[0]), "end": float(ts[-1]),
+                         "frames": len(ts), "fps": None})
+    rows.sort(key=lambda r: r["start"])
+    return rows
+
+
+def find(output_dir, t0, t1):
+    """[t0, t1) に撮ったフレームの (ファイル, 開始フレーム, 終了フレーム(含まない), 最初の時刻, 最後の時刻) の並び"""
+    out = []
+    for r in read_index(output_dir):
+        if r["end"] < t0 or r["start"] >= t1:
+            continue
+        path = os.path.join(output_dir, r["file"])
+        ts = np.fromfile(os.path.splitext(path)[0] + ".ts", np.float64)
+        i0 = int(np.searchsorted(ts, t0, "left"))
+        i1 = int(np.searchsorted(ts, t1, "left"))
+        if i0 < i1:
+            out.append((path, i0, i1, float(ts[i0]), float(ts[i1-1])))
+    return out
+
+
+def open_at(path, frame):
+    """path を frame 番目から読む VideoCapture"""
+    cap = cv2.VideoCapture(path)
+    if frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+    return cap
+
+
+def parse_time(s, date=None):
+    """"2026-10-18 14:00" / "14:00" / "14:00:30"（日付省略時は date、無ければ今日）を UNIX 時刻に"""
+    try:
+        return datetime.datetime.fromisoformat(s).timestamp()
+    except ValueError:
+        t = datetime.time.fromisoformat(s)
+        d = datetime.date.fromisoformat(date) if date else datetime.date.today()
+        return datetime.datetime.combine(d, t).timestamp()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="録画セグメントの索引")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("list", help="セグメントの一覧")
+    ls.add_argument("dir")
+    fd = sub.add_parser("find", help="時刻範囲のファイルとフレーム位置")
+    fd.add_argument("dir")
+    fd.add_argument("start", help='"14:00" / "2026-10-18 14:00"')
+    fd.add_argument("end")
+    fd.add_argument("--date", default=None, help="時刻だけ指定したときの日付（YYYY-MM-DD、省略時は今日）")
+    args = ap.parse_args()
+
+    fmt = lambda t: datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+    if args.cmd == "list":
+        for r in read_index(args.dir):
+            print(f"{r['file']:40s} {fmt(r['start'])} - {fmt(r['end'])}  {r['frames']} frames")
+    else:
+        hits = find(args.dir, parse_time(args.start, args.date), parse_time(args.end, args.date))
+        if not hits:
+            print("該当するフレームはありません", file=sys.stderr); sys.exit(1)
+        for path, i0, i1, ts0, ts1 in hits:
+            print(f"{path}  frames {i0}-{i1}  ({fmt(ts0)} - {fmt(ts1)})")
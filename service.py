@@ -0,0 +1,297 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import cv2
+from gate_counter import DIRECTIONS
+
+# 常駐のカウントサービス。モデルとストリームを読み込んだまま multi_stream.run を回し、
+# ローカルの HTTP API で集計を返す。
+#   - カウントスレッドはフレーム毎に「スナップショット」（JSON を作り終えた bytes）を差し替えるだけで、
+#     API 側はその参照を読んで返す。読み手がいくら増えてもフレームループは待たない
+#   - JPEG は要求されたときに最新フレームから作り、同じフレームの間はキャッシュを返す
+#   - ライブ更新は SSE（/api/live。WebSocket の代わりに標準ライブラリだけで書ける Server-Sent Events）
+#
+#   GET  /api/streams                      ストリーム名の一覧
+#   GET  /api/counts?stream=cam1           合計 / 方向別 / クラス別 / 方向xクラス別（ゾーンがあればゾーン別も）
+#   GET  /api/events?stream=cam1&since=N   直近の通過イベント（seq > N）
+#   GET  /api/snapshot.jpg?stream=cam1     最新フレーム（ゲートと検出枠を描いた JPEG）
+#   GET  /api/live?stream=cam1             counts を更新のたびに送る SSE
+#   GET  /api/gate?stream=cam1
+#   POST /api/gate  {"stream": "cam1", "gate": [0.5, 0.6, 0.8, 0.8]}   実行中にゲートを変える
+#
+#   python service.py config.json --port 8080       # 設定は multi_stream.py と同じ JSON
+#   python service.py --source rtsp://... --port 8080
+
+HOST = "127.0.0.1"
+PORT = 8080
+PUBLISH_SEC = 0.2           # 通過が無いときのスナップショット更新間隔
+RECENT_EVENTS = 500         # ストリーム毎に保持する直近の通過イベント数
+JPEG_QUALITY = 80
+N_COCO = 80
+
+
+class StreamState:
+    """1ストリーム分の公開用スナップショット（カウントスレッドが書き、API スレッドが読む）"""
+
+    def __init__(self, stream, hub):
+        self.stream = stream
+        self.hub = hub
+        self.counts = np.zeros((len(DIRECTIONS), N_COCO), np.int64)    # [方向, クラス]
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.seq = 0
+        self.fps = 0.0
+        self.t_prev = None
+        self.t_publish = 0.0
+        self.frame = None; self.events = None; self.frame_no = 0
+        self.counts_json = self._build(time.time())
+        self.jpeg = (-1, b"")
+        self.jpeg_lock = threading.Lock()
+
+    def on_frame(self, item, events, now):
+        """カウントスレッドから。参照の差し替えと通過分の加算だけ"""
+        if self.t_prev is not None:
+            self.fps = 0.9*self.fps + 0.1/max(now - self.t_prev, 1e-6)
+        self.t_prev = now
+        self.frame, self.events = item.frame, events
+        self.frame_no += 1
+        crossed = events.crossed
+        if crossed.any():
+            for tid, cls, d, x, y in zip(events.ids[crossed].tolist(), events.cls[crossed].tolist(),
+                                         events.direction[crossed].tolist(), events.cx[crossed].tolist(),
+                                         events.cy[crossed].tolist()):
+                if 0 <= cls < N_COCO:
+                    self.counts[d, cls] += 1
+                self.seq += 1
+                self.recent.append({"seq": self.seq, "ts": round(now, 3), "id": tid, "cls": cls,
+                                    "direction": DIRECTIONS[d], "x": x, "y": y})
+        elif (events.zones is None or len(events.zones[0]) == 0) and now - self.t_publish < PUBLISH_SEC:
+            return
+        self.counts_json = self._build(now)
+        self.t_publish = now
+        self.hub.notify()
+
+    def _build(self, now):
+        c = self.counts
+        by_dir = {DIRECTIONS[d]: int(c[d].sum()) for d in range(1, len(DIRECTIONS))}
+        by_cls = {str(k): int(v) for k, v in enumerate(c.sum(0)) if v}
+        by_dir_cls = {DIRECTIONS[d]: {str(k): int(v) for k, v in enumerate(c[d]) if v} for d in range(1, len(DIRECTIONS))}
+        counter = self.stream.counter
+        snap = {"stream": self.stream.name, "ts": round(now, 3), "frames": self.stream.frames, "fps": round(self.fps, 2),
+                "total": counter.total if counter else 0, "gate": list(counter.gate) if counter else self.stream.gate_spec,
+                "by_direction": by_dir, "by_class": by_cls, "by_direction_class": by_dir_cls, "last_seq": self.seq}
+        if counter is not None and counter.zones is not None:
+            snap["zones"] = counter.zones.summary()
+        return json.dumps(snap).encode()
+
+    def snapshot_jpeg(self):
+        """最新フレームの JPEG（同じフレームならキャッシュを返す）"""
+        with self.jpeg_lock:
+            no, frame, events = self.frame_no, self.frame, self.events
+            if frame is None:
+                return None
+            if self.jpeg[0] != no:
+                img = frame.copy()
+                counter = self.stream.counter
+                if counter is not None:
+                    x1,y1,x2,y2 = counter.gate
+                    cv2.rectangle(img, (x1,y1), (x2,y2), (0,0,255), 2)
+                    if counter.zones is not None:
+                        counter.zone_map.draw(img, counter.zones)
+                if events is not None:
+                    for (bx1,by1,bx2,by2), tid in zip(events.xyxy.tolist(), events.ids.tolist()):
+                        cv2.rectangle(img, (int(bx1),int(by1)), (int(bx2),int(by2)), (0,255,0), 2)
+                        cv2.putText(img, str(tid), (int(bx1), max(15,int(by1)-6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 1)
+                ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                self.jpeg = (no, buf.tobytes() if ok else b"")
+            return self.jpeg[1]
+
+
+class Hub:
+    """スナップショット更新の通知（SSE の待ち合わせ用）"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self.cond:
+            self.version += 1
+            self.cond.notify_all()
+
+    def wait(self, version, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class Service:
+    def __init__(self, config):
+        self.config = config
+        self.hub = Hub()
+        self.states = {}            # 名前 → StreamState（on_start で作る）
+        self.order = []
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+
+    def on_start(self, streams):
+        for s in streams:
+            self.states[s.name] = StreamState(s, self.hub)
+            self.order.append(s.name)
+        self.ready.set()
+
+    def on_frame(self, stream, item, events):
+        self.states[stream.name].on_frame(item, events, time.time())
+
+    def state(self, name):
+        if name is None:
+            return self.states[self.order[0]] if self.order else None
+        return self.states.get(name)
+
+    def run_counter(self):
+        from multi_stream import run
+        try:
+            run(self.config, self.on_frame, self.on_start, self.stop_event)
+        finally:
+            self.ready.set()
+
+
+def make_handler(svc):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, code, body, ctype="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, code, msg):
+            self._send(code, json.dumps({"error": msg}, ensure_ascii=False).encode())
+
+        def _state(self, q):
+            st = svc.state(q.get("stream", [None])[0])
+            if st is None:
+                self._error(404, "stream not found")
+            return st
+
+        def do_GET(self):
+            url = urlparse(self.path); q = parse_qs(url.query)
+            if url.path == "/api/streams":
+                return self._send(200, json.dumps(svc.order).encode())
+            st = self._state(q)
+            if st is None:
+                return
+            if url.path == "/api/counts":
+                self._send(200, st.counts_json)
+            elif url.path == "/api/events":
+                try:
+                    since = int(q.get("since", ["0"])[0])
+                except ValueError:
+                    return self._error(400, "since は整数（前回受け取った seq）")
+                evs = [e for e in list(st.recent) if e["seq"] > since]
+                self._send(200, json.dumps(evs).encode())
+            elif url.path == "/api/snapshot.jpg":
+                jpg = st.snapshot_jpeg()
+                if jpg is None:
+                    return self._error(503, "no frame yet")
+                self._send(200, jpg, "image/jpeg")
+            elif url.path == "/api/gate":
+                counter = st.stream.counter
+                self._send(200, json.dumps({"gate": list(counter.gate) if counter else st.stream.gate_spec}).encode())
+            elif url.path == "/api/live":
+                self._live(st)
+            else:
+                self._error(404, "not found")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/api/gate":
+                return self._error(404, "not found")
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                gate = [float(v) for v in body["gate"]]
+                if len(gate) != 4 or gate[0] >= gate[2] or gate[1] >= gate[3]:
+                    raise ValueError("gate は [x1,y1,x2,y2]（x1<x2, y1<y2）")
+            except (ValueError, KeyError, TypeError) as e:
+                return self._error(400, str(e))
+            st = svc.state(body.get("stream"))
+            if st is None:
+                return self._error(404, "stream not found")
+            st.stream.set_gate(gate)
+            counter = st.stream.counter
+            self._send(200, json.dumps({"gate": list(counter.gate) if counter else st.stream.gate_spec}).encode())
+
+        def _live(self, st):
+            """SSE: スナップショットが更新されるたびに counts を送る"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            version = -1; last = None
+            try:
+                while not svc.stop_event.is_set():
+                    version = svc.hub.wait(version, 15.0)
+                    body = st.counts_json
+                    if body is last:
+                        self.wfile.write(b": keep-alive\n\n")
+                    else:
+                        self.wfile.write(b"data: " + body + b"\n\n")
+                        last = body
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
+
+
+def serve(config, host=HOST, port=PORT):
+    svc = Service(config)
+    t = threading.Thread(target=svc.run_counter, name="counter", daemon=True)
+    t.start()
+    svc.ready.wait()
+    if not svc.order:
+        print("[ERROR] ストリームを開始できませんでした", file=sys.stderr); sys.exit(1)
+    server = ThreadingHTTPServer((host, port), make_handler(svc))
+    server.daemon_threads = True
+    print(f"serving on http://{host}:{port}/api/counts")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        svc.stop_event.set()
+        server.server_close()
+        t.join(timeout=5.0)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="常駐カウントサービス（HTTP API）")
+    ap.add_argument("config", nargs="?", help="ストリーム設定のJSONファイル（multi_stream.py と同じ形式）")
+    ap.add_argument("--source", default=None, help="設定ファイルの代わりに1ソースだけ指定")
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=None)
+    args = ap.parse_args()
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+    elif args.source:
+        config = {"streams": [{"name": "cam", "source": args.source}]}
+    else:
+        ap.error("config か --source を指定してください")
+    http = config.get("http", {})
+    serve(config, args.host or http.get("host", HOST), args.port or http.get("port", PORT))
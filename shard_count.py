@@ -0,0 +1,138 @@
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import sys
+import time
+import csv
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+
+# 長時間の録画ファイルを時間区間に分割し、区間ごとに別プロセス（別モデル）でカウントして結合する。
+#
+# 区間の境界をまたぐ車両の重複排除:
+#   各ワーカーは担当区間 [start, end) の OVERLAP_SEC 手前から読み始め、そこは「助走」として
+#   追跡器とゲート状態（inside_prev / counted）だけを作る。通過イベントを出すのは担当区間内だけ。
+#   → 境界直前に通過した車は前の区間だけが数え（助走中に counted 済みになるので後の区間では数えない）、
+#     境界直前にゲートへ入って境界後に出た車は後の区間が助走で inside_prev を得て数える。
+#   OVERLAP_SEC は「ゲート内に留まる最長時間」と TTL より長くしておくこと。
+
+MODEL = "./models/yolo11n.pt"
+CLASSES = [2,5,7]           # COCO:人=0, 自転車=1, 車=2, バイク=3, バス=5, トラック=7
+IMG_SIZE = 960
+CONF = 0.25
+IOU = 0.45
+TTL_SEC = 2.0
+GATE = [0.5, 0.6, 0.8, 0.8] # フレームサイズに対する比率 x1,y1,x2,y2（main.py と同じ初期ゲート）
+OVERLAP_SEC = 10.0          # 区間の助走（重なり）秒数
+BATCH = 8                   # ワーカー内のバッチ推論フレーム数
+CSV_PATH = "gate_events.csv"
+
+
+def count_segment(path, seg_no, start, end, warm, params):
+    """[warm, end) のフレームを読み、[start, end) の通過イベントだけを返す（ワーカープロセスで実行）"""
+    # ワーカー毎のスレッド数を絞ってコア数に対してほぼ線形に伸びるようにする
+    import torch
+    torch.set_num_threads(params["threads"])
+    from ultralytics import YOLO
+    from batch_track import BatchTracker
+    from gate_counter import GateCounter, parse_dets
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.set(cv2.CAP_PROP_POS_FRAMES, warm)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))   # 実際に移動できたフレーム位置
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    g = params["gate"]
+    counter = GateCounter([int(g[0]*w), int(g[1]*h), int(g[2]*w), int(g[3]*h)], params["ttl"])
+    tracker = BatchTracker(YOLO(params["model"]))
+
+    events = []
+    frames = []
+    idx = pos
+    t0 = time.time()
+    while idx < end:
+        ok, frame = cap.read()
+        if ok:
+            frames.append(frame)
+        if frames and (not ok or len(frames) >= params["batch"] or idx + len(frames) >= end):
+            for results in tracker.track(frames, params["imgsz"], "cpu", params["conf"], params["iou"], params["classes"]):
+                ts = idx / fps                          # 動画先頭からの秒数
+                for (tid, cls, confb, xyxy, cx, cy, crossed, direction) in counter.update(parse_dets(results), ts):
+                    if crossed and idx >= start:
+                        events.append((ts, seg_no, tid, cls, cx, cy, direction))
+                idx += 1
+            frames = []
+        if not ok:
+            break
+    cap.release()
+    return seg_no, events, idx - pos, time.time() - t0
+
+
+def plan_segments(n_frames, fps, n_seg, overlap_sec):
+    """(区間番号, start, end, 助走開始) のリスト（フレーム数が分からない 0 のときは最後まで読む1区間）"""
+    if n_frames <= 0:
+        return [(0, 0, float("inf"), 0)]
+    seg_len = -(-n_frames // n_seg)
+    overlap = int(round(overlap_sec * fps))
+    return [(i, s, min(s+seg_len, n_frames), max(0, s-overlap))
+            for i, s in enumerate(range(0, n_frames, seg_len))]
+
+
+def run(path, workers, segments=None, overlap_sec=OVERLAP_SEC, csv_path=CSV_PATH):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"[ERROR] ソースを開けませんでした: {path}", file=sys.stderr); sys.exit(1)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    plan = plan_segments(n_frames, fps, segments or workers, overlap_sec)
+    if n_frames <= 0:
+        # CAP_PROP_FRAME_COUNT が 0 を返すコンテナ/ストリームは区間に分けられない
+        print(f"[WARN] フレーム数が分からないので分割せず1区間で処理します: {path}", file=sys.stderr)
+        workers = 1
+    params = dict(model=MODEL, classes=CLASSES, imgsz=IMG_SIZE, conf=CONF, iou=IOU, ttl=TTL_SEC,
+                  gate=GATE, batch=BATCH, threads=max(1, (os.cpu_count() or 1) // workers))
+    print(f"{n_frames} frames @ {fps:.1f}fps → {len(plan)} 区間 / {workers} プロセス (助走 {overlap_sec:g}s)")
+
+    t0 = time.time()
+    results = []
+    # torch をフォークで複製しないよう spawn で起動
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+        futs = [ex.submit(count_segment, path, no, s, e, wm, params) for (no, s, e, wm) in plan]
+        for fut in futs:
+            seg_no, events, n, sec = fut.result()
+            print(f"  区間{seg_no}: {len(events)} 台  ({n} frames, {n/max(sec,1e-6):.1f}fps)")
+            results.append((seg_no, events))
+            if n_frames <= 0:
+                n_frames = n
+    elapsed = time.time() - t0
+
+    # 結合: 区間内IDは区間番号で一意化し、時刻順に並べる
+    events = sorted((ev for _, evs in results for ev in evs), key=lambda ev: ev[0])
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        csvw = csv.writer(f)
+        csvw.writerow(["ts","id","cls","x","y","crossed","direction"])
+        for (ts, seg_no, tid, cls, cx, cy, direction) in events:
+            csvw.writerow([f"{ts:.3f}", seg_no*1_000_000 + tid, cls, cx, cy, 1, direction])
+
+    by_cls = {}
+    for ev in events:
+        by_cls[ev[3]] = by_cls.get(ev[3], 0) + 1
+    print(f"TOTAL: {len(events)}  クラス別: {dict(sorted(by_cls.items()))}")
+    print(f"elapsed:{elapsed:.1f}s  {n_frames/max(elapsed,1e-6):.1f}fps (動画時間の {n_frames/fps/max(elapsed,1e-6):.1f} 倍速)")
+    return events
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="長時間録画を時間分割して並列カウントし、結果を結合する")
+    ap.add_argument("source", help="動画ファイル")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    ap.add_argument("--segments", type=int, default=None, help="区間数（既定: ワーカー数）")
+    ap.add_argument("--overlap", type=float, default=OVERLAP_SEC, help="区間の助走（重なり）秒数")
+    ap.add_argument("--csv", default=CSV_PATH, help="結合した通過イベントCSV")
+    ap.add_argument("--model", default=MODEL)
+    args = ap.parse_args()
+    MODEL = args.model
+    run(args.source, args.workers, args.segments, args.overlap, args.csv)
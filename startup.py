@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+
+# 起動を速くするための部品（main.py / test.py 共通）
+#   - ultralytics/torch の import とモデル読み込みは Background で別スレッドに回し、
+#     その間にメインスレッドでキャプチャを開いて先頭フレームを読む
+#   - カウント開始前に IMG_SIZE で1回空推論して（グラフ/メモリの初期化を済ませて）から始める
+#   - プロセス起動から「最初にカウントしたフレーム」までの時間を段階別に表示し、予算超過を警告する
+
+STARTUP_BUDGET_SEC = 15.0   # 再起動（ウォッチドッグ）からカウント開始までの目標秒数
+_IMPORT_TIME = time.time()
+
+
+def process_start_time():
+    """このプロセスの起動時刻（Linux は /proc から。インタプリタの起動分も含める）"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return _IMPORT_TIME
+
+
+class Background:
+    """fn を別スレッドで実行し、result() で結果を受け取る（例外は result() で投げ直す）"""
+
+    def __init__(self, fn, name="loader"):
+        self._result = None; self._error = None
+        self._thread = threading.Thread(target=self._run, args=(fn,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, fn):
+        try:
+            self._result = fn()
+        except BaseException as e:
+            self._error = e
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class StartupTimer:
+    """起動の各段階の時刻を記録して内訳を表示する"""
+
+    def __init__(self, budget=STARTUP_BUDGET_SEC):
+        self.t0 = process_start_time()
+        self.budget = budget
+        self.marks = []             # (名前, 起動からの秒数)
+
+    def mark(self, name):
+        self.marks.append((name, time.time() - self.t0))
+
+    @property
+    def elapsed(self):
+        return self.marks[-1][1] if self.marks else 0.0
+
+    def report(self):
+        """内訳を表示し、予算内なら True を返す"""
+        parts = "  ".join(f"{name}:{t:.2f}s" for name, t in self.marks)
+        print(f"startup: {parts}")
+        if self.budget and self.elapsed > self.budget:
+            print(f"[WARN] 起動からカウント開始まで {self.elapsed:.1f}s（予算 {self.budget:.1f}s）", file=sys.stderr)
+            return False
+        return True
+
+
+def warmup(model, frame, imgsz, device, track=False, tracker="bytetrack.yaml"):
+    """先頭フレームと同じサイズの黒画像で1回推論して初期化を済ませる
+
+    track=True なら model.track の追跡器の登録まで済ませ、状態はリセットしておく
+    （黒画像なので検出もIDも出ない）。
+    """
+    blank = np.zeros_like(frame)
+    if track:
+        model.track(source=blank, imgsz=imgsz, device=device, tracker=tracker, persist=True, verbose=False)
+        for t in getattr(model.predictor, "trackers", None) or []:
+            t.reset()
+    else:
+        model.predict(source=blank, imgsz=imgsz, device=device, verbose=False)
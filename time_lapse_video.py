@@ -7,18 +7,77 @@ from PyQt6.QtGui import QImage, QPixmap
 import numpy as np
 import cv2
 from PIL import Image, ImageDraw, ImageFont
+from segments import SegmentWriter
 
 
 # フォントのパス（システムに応じて変更してください）
 FONT_PATH = f"Fonts/msgothic.ttc"
+FONT_SIZE = 32
+STAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+STAMP_ORG = (10, 10)        # 日時を描く位置（左上）
 
 
-def capture_time_lapse(output_dir, fps=10, section_time=60, camera_pixel=[1280, 720]):
+class GlyphAtlas:
+    """日時の文字（0-9 - : 空白）を起動時に1回だけ描いておき、文字列を濃淡マスクとして組み立てる
+
+    フォントが無ければ OpenCV のフォントで代用する。
+    組み立てた文字列は1つだけキャッシュする（日時は1秒に1回しか変わらない）。
+    """
+
+    def __init__(self, chars="0123456789-: ", font_path=FONT_PATH, size=FONT_SIZE):
+        self.glyphs = {}
+        try:
+            font = ImageFont.truetype(font_path, size)
+            asc, desc = font.getmetrics()
+            height = asc + desc
+            for ch in chars:
+                w = max(1, int(round(font.getlength(ch))))
+                img = Image.new("L", (w, height), 0)
+                ImageDraw.Draw(img).text((0, 0), ch, font=font, fill=255)
+                self.glyphs[ch] = np.array(img)
+        except OSError:
+            print(f"[WARN] フォントが読めないので OpenCV のフォントで描きます: {font_path}")
+            scale = size / 30
+            (_, th), base = cv2.getTextSize("0", cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+            height = th + base + 4
+            for ch in chars:
+                (w, _), _ = cv2.getTextSize(ch, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+                img = np.zeros((height, max(1, w)), np.uint8)
+                cv2.putText(img, ch, (0, th + 2), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, 2, cv2.LINE_AA)
+                self.glyphs[ch] = img
+        self.height = height
+        self._text = None
+        self._strip = None
+
+    def render(self, text):
+        """text の濃淡マスク (h, w, 3)。同じ文字列ならキャッシュを返す"""
+        if text != self._text:
+            strip = np.concatenate([self.glyphs[ch] for ch in text], axis=1)
+            self._strip = cv2.merge([strip, strip, strip])
+            self._text = text
+        return self._strip
+
+    def draw(self, frame, text, org=STAMP_ORG):
+        """frame の org の位置に白で text を描く（描くのは文字の範囲だけ）"""
+        strip = self.render(text)
+        x, y = org
+        h = min(strip.shape[0], frame.shape[0] - y)
+        w = min(strip.shape[1], frame.shape[1] - x)
+        if h <= 0 or w <= 0:
+            return
+        roi = frame[y:y+h, x:x+w]
+        # 白い文字なので max で重ねれば濃淡（アンチエイリアス）もそのまま残る
+        cv2.max(roi, strip[:h, :w], dst=roi)
+
+
+def capture_time_lapse(output_dir, fps=10, section_time=60, camera_pixel=[1280, 720], source=0, show=True):
     # Webカメラを開く
-    cap = cv2.VideoCapture(0)
+    cap = cv2.VideoCapture(source)
     # カメラの解像度を設定
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, camera_pixel[0])
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, camera_pixel[1])
+    # 読むのは1/fps 秒おきなので、ドライバのバッファに古いフレームをためない
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
     # 設定が反映されたか確認
     actual_width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
@@ -29,61 +88,61 @@ def capture_time_lapse(output_dir, fps=10, section_time=60, camera_pixel=[1280,
         print("カメラを開けません")
         return
     os.makedirs(output_dir, exist_ok=True)
-    
-    file_no = 1
-    section_start_time = time.time()
+
+    atlas = GlyphAtlas()
+    size = (int(cap.get(3)), int(cap.get(4)))
 
     interval = 1.0 / fps  # キャプチャ間隔（秒）
-    last_capture_time = time.time()
-
-    # 録画ファイルの設定
-    output_file = f"video_{file_no}.mp4"
-    outputpath = os.path.join(output_dir, output_file)
-    fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v') # MJPEGコーデック
-    video = cv2.VideoWriter(outputpath, fourcc, fps, (int(cap.get(3)), int(cap.get(4))))
-    print(f"画像サイズ: {int(cap.get(3))}x{int(cap.get(4))}, FPS: {fps}")
-
-    # 映像を取得する
-    while True:
-        now = time.time()
-        # 一定時間経過したら新しいファイルに切り替え
-        if now - section_start_time >= section_time*60:
-            video.release()  # 現在の録画ファイルを閉じる
-            file_no += 1
-            section_start_time = now
-            output_file = f"video_{file_no}.mp4"
-            outputpath = os.path.join(output_dir, output_file)
-            video = cv2.VideoWriter(outputpath, fourcc, fps, (int(cap.get(3)), int(cap.get(4))))
-            print(f"新しい録画ファイルに切り替え: {outputpath}")
-        else:
-            # 一定間隔でフレームをキャプチャ
-            if now - last_capture_time >= interval:
-                time_stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 現在の日時を取得
-                ret, frame = cap.read()  # フレームを読み込む
-                if not ret:
-                    break
-                
-                # OpenCVの画像をPillow形式に変換
-                frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                # Pillowで日時を描画
-                draw = ImageDraw.Draw(frame_pil)
-                font = ImageFont.truetype(FONT_PATH, 32)  # フォントサイズを指定
-                draw.text((10, 10), time_stamp, font=font, fill=(255, 255, 255))  # 白色で描画
-                # Pillowの画像をOpenCV形式に戻す
-                frame = cv2.cvtColor(np.array(frame_pil), cv2.COLOR_RGB2BGR)
-
-                video.write(frame)  # フレームを録画ファイルに書き込む
-                last_capture_time = now
-
-            else:
+
+    # 録画ファイル: section_time 分毎に video_<番号>_<開始日時>.mp4 に分けて書き出す。
+    # エンコードとファイルの切り替えは書き出しスレッド側（segments.py）。時刻 → ファイル/フレームの索引は segments.csv
+    t_start = time.time()
+    video = SegmentWriter(output_dir, fps, size, section_time*60, t_start, fourcc="mp4v")
+    print(f"画像サイズ: {size[0]}x{size[1]}, FPS: {fps}")
+
+    # キャプチャ時刻は開始時刻からの「枠」で決める（処理時間で間隔がずれていかない）。
+    # 次の枠まではスリープ（表示中は waitKey で待つのでウィンドウも応答する）
+    next_due = t_start
+    n_frames = 0
+    try:
+        while True:
+            now = time.time()
+            wait = next_due - now
+            if wait > 0:
+                if show:
+                    key = cv2.waitKey(max(1, int(wait * 1000))) & 0xFF
+                    if key == ord('q'):  # 'q'キーで終了
+                        break
+                else:
+                    time.sleep(wait)
                 continue
-        if cv2.waitKey(1) & 0xFF == ord('q'):  # 'q'キーで終了
-            break
-        cv2.imshow('Recording...', frame)  # 映像を表示する
+            # 処理が遅れて枠を飛ばしたときは、まとめて撮らずに次の枠へ
+            next_due += interval * max(1, int((now - next_due) / interval) + 1)
 
-    cap.release()  # カメラを解放
-    cv2.destroyAllWindows()  # ウィンドウを閉じる
-    print(f"録画が完了しました: {outputpath}")
+            ts = time.time()
+            time_stamp = datetime.datetime.fromtimestamp(ts).strftime(STAMP_FORMAT) # 現在の日時を取得
+            ret, frame = cap.read()  # フレームを読み込む
+            if not ret:
+                break
+            if video.error is not None:
+                print(f"[ERROR] 録画ファイルを書き出せません（撮影を止めます）: {video.error}")
+                break
+            atlas.draw(frame, time_stamp)   # 日時の範囲だけ書き換える
+            video.write(frame, ts)  # 書き出しキューに入れる（エンコードとファイル切り替えは別スレッド）
+            n_frames += 1
+            if show:
+                cv2.imshow('Recording...', frame)  # 映像を表示する
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()  # カメラを解放
+        if show:
+            cv2.destroyAllWindows()  # ウィンドウを閉じる
+        video.close()   # 書き出しエラーがあればここで投げる
+    elapsed = time.time() - t_start
+    print(f"録画が完了しました: {video.path}  ({n_frames} フレーム / {elapsed:.1f}s, 実効 {n_frames/max(elapsed,1e-6):.2f} fps)")
+    if video.dropped:
+        print(f"[WARN] 書き出しが追いつかず {video.dropped} フレームを落としました")
 
 def main():
     output_dir = "time_lapse_videos"
@@ -94,4 +153,4 @@ def main():
     capture_time_lapse(output_dir, fps, section_time, camera_pixel)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,154 @@
+from collections import deque
+import numpy as np
+
+# ID毎の状態（最終検出時刻 / ゲート内フラグ / 前回中心 / カウント済み）を固定長の配列で持つ表。
+#   - 生きているIDは最大 TRACK_CAPACITY 件（あふれたら最も古いものから追い出す）
+#   - TTL 破棄は「フレーム毎に見えたIDの束」を時刻順の deque に積み、期限切れの束だけを見る
+#     （毎フレーム全IDを走査しない。1回の目撃は1回だけ調べられる）
+#   - カウント済みIDは ID番号のリングビットマップ（COUNTED_WINDOW 件分）で覚える。
+#     ByteTrack のIDは単調増加なので、窓より古いIDが再登場したら「カウント済み」とみなす
+#     （取りこぼしの側に倒して二重カウントはしない）。生きているIDは表の counted を優先する。
+
+TRACK_CAPACITY = 4096
+COUNTED_WINDOW = 1 << 20
+
+
+class CountedWindow:
+    """直近 COUNTED_WINDOW 個のID番号についてカウント済みかを覚えるリングビットマップ
+
+    dtype に整数型を渡すとID毎にビットの組を持つ（zones.ZoneCounter のゾーン x 方向）。
+    """
+
+    def __init__(self, size=COUNTED_WINDOW, dtype=bool):
+        self.size = size
+        self.bits = np.zeros(size, dtype)
+        self.base = 1               # これより小さいIDは窓の外（カウント済み扱い）
+
+    def _advance(self, max_id):
+        """max_id が窓に入るよう base を進め、追い出した分のビットを消す"""
+        new_base = max_id - self.size + 1
+        if new_base <= self.base:
+            return
+        n = new_base - self.base
+        if n >= self.size:
+            self.bits[:] = 0
+        else:
+            i0 = self.base % self.size; i1 = i0 + n
+            self.bits[i0:min(i1, self.size)] = 0
+            if i1 > self.size:
+                self.bits[:i1-self.size] = 0
+        self.base = new_base
+
+    def contains(self, ids):
+        ids = np.asarray(ids, np.int64)
+        if len(ids) == 0:
+            return np.zeros(0, bool)
+        self._advance(int(ids.max()))
+        return (ids < self.base) | self.bits[ids % self.size]
+
+    def add(self, ids):
+        ids = np.asarray(ids, np.int64)
+        if len(ids):
+            self._advance(int(ids.max()))
+            self.bits[ids % self.size] = True
+
+    def get(self, ids):
+        """ids のビットの組（窓より古いIDはすべて立っている扱い）"""
+        ids = np.asarray(ids, np.int64)
+        if len(ids) == 0:
+            return np.zeros(0, self.bits.dtype)
+        self._advance(int(ids.max()))
+        out = self.bits[ids % self.size]
+        out[ids < self.base] = ~self.bits.dtype.type(0)
+        return out
+
+    def set_bits(self, ids, bits):
+        """ids のビットの組に bits を足す（OR。同じIDが複数あってもよい）"""
+        ids = np.asarray(ids, np.int64)
+        if len(ids):
+            self._advance(int(ids.max()))
+            np.bitwise_or.at(self.bits, ids % self.size, bits)
+
+
+class TrackTable:
+    """ID毎の状態を固定容量の配列で保持し、TTL 破棄を期限切れ分だけで行う"""
+
+    def __init__(self, ttl_sec, capacity=TRACK_CAPACITY, counted_window=COUNTED_WINDOW):
+        self.ttl_sec = ttl_sec
+        self.capacity = capacity
+        self.tid = np.full(capacity, -1, np.int64)
+        self.last_seen = np.zeros(capacity, np.float64)
+        self.inside = np.zeros(capacity, bool)
+        self.has_prev = np.zeros(capacity, bool)
+        self.pcx = np.zeros(capacity, np.int64)
+        self.pcy = np.zeros(capacity, np.int64)
+        self.counted = np.zeros(capacity, bool)
+        self.index = {}                         # tid → slot（件数は capacity 以下）
+        self.free = list(range(capacity-1, -1, -1))
+        self.history = deque()                  # (時刻, ids, slots) を時刻順に
+        self.window = CountedWindow(counted_window)
+
+    def __len__(self):
+        return len(self.index)
+
+    def slots_for(self, ids):
+        """ids のスロット番号（新しいIDには空きスロットを割り当てて初期化する）"""
+        get = self.index.get
+        slots = np.fromiter((get(t, -1) for t in ids.tolist()), np.int64, len(ids))
+        new = np.flatnonzero(slots < 0)
+        if len(new):
+            new_ids = ids[new]
+            for i, t in zip(new.tolist(), new_ids.tolist()):
+                if t in self.index:         # 同じフレームに同じIDが2つあった場合
+                    slots[i] = self.index[t]
+                    continue
+                if not self.free:
+                    self._evict_oldest(keep=slots[slots >= 0])
+                s = self.free.pop()
+                self.index[t] = s
+                slots[i] = s
+            ns = slots[new]
+            self.tid[ns] = new_ids
+            self.inside[ns] = False
+            self.has_prev[ns] = False
+            # 追い出し後に再登場したIDはビットマップからカウント済みを引き継ぐ
+            self.counted[ns] = self.window.contains(new_ids)
+        return slots
+
+    def mark_counted(self, slots):
+        self.counted[slots] = True
+        self.window.add(self.tid[slots])
+
+    def touch(self, ids, slots, now, inside, cx, cy):
+        """このフレームで見えたIDの状態を書き戻す"""
+        self.last_seen[slots] = now
+        self.inside[slots] = inside
+        self.pcx[slots] = cx; self.pcy[slots] = cy
+        self.has_prev[slots] = True
+        if len(slots):
+            self.history.append((now, ids, slots))
+
+    def expire(self, now):
+        """TTL を過ぎたIDを破棄する（期限切れのフレーム分だけ調べる）"""
+        while self.history and now - self.history[0][0] > self.ttl_sec:
+            t, ids, slots = self.history.popleft()
+            # その後に再び見えたもの / 既に別IDに使い回されたスロットは除く
+            stale = (self.tid[slots] == ids) & (self.last_seen[slots] == t)
+            self._release(slots[stale])
+
+    def any_inside(self):
+        return bool(self.inside[self.tid >= 0].any())
+
+    def _release(self, slots):
+        for s, t in zip(slots.tolist(), self.tid[slots].tolist()):
+            if self.index.pop(t, None) is not None:
+                self.free.append(s)
+        self.tid[slots] = -1
+        self.inside[slots] = False
+
+    def _evict_oldest(self, keep):
+        """容量いっぱいのときは最終検出が最も古いIDを追い出す（このフレームで見えた keep は除く）"""
+        live = self.tid >= 0
+        live[keep] = False
+        live = np.flatnonzero(live)
+        self._release(live[[int(np.argmin(self.last_seen[live]))]])
@@ -1,4 +1,6 @@
 import sys
+import time
+import threading
 
 from PyQt6 import QtGui
 from PyQt6.QtWidgets import QWidget, QApplication, QLabel, QVBoxLayout,QHBoxLayout, QMainWindow, QComboBox, QPushButton, QSizePolicy
@@ -10,89 +12,135 @@ from PyQt6.QtCore import pyqtSignal, pyqtSlot, QThread
 
 import cv2
 import numpy as np
+from segments import SegmentWriter
+from cameras import CameraWatcher, label
+
+RECORD_DIR = "recordings"       # 録画の保存先（索引 segments.csv も同じ場所）
+RECORD_SECTION_SEC = 3600       # 録画ファイルを分ける間隔（秒）
+RECORD_FOURCC = "mp4v"
+STATUS_MS = 500                 # 状態表示（FPS/録画時間）の更新間隔
+
+
+class VideoThread(QThread):
+    """カメラの読み込みスレッド
+
+    cap.read() はカメラのフレームレートで戻るので、読み込みの速さはタイマーではなくカメラで決まる。
+    プレビューは最新の1枚だけを保持し、GUI がまだ取っていなければ frame_ready で知らせる
+    （GUI が遅れても通知はたまらず、古いフレームは捨てられる）。
+    録画中は全フレームを SegmentWriter のキューに入れ、エンコードは書き出しスレッドで行う。
+    """
+    frame_ready = pyqtSignal()                  # 新しいフレームがある（中身は take_frame で取る）
+    recording_changed = pyqtSignal(bool, str)   # 録画中か, ファイル
+    error = pyqtSignal(str)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self._run_flag = True
+        self._lock = threading.Lock()
+        self._latest = None
+        self._pending = False       # 通知済みで GUI がまだ取っていない
+        self._record_req = None     # 保存先（録画開始） / False（停止）。読み込みスレッドで処理する
+        self.writer = None
+        self.fps = 0.0
+        self.record_start = None
+
+    # QThreadのrunメソッドを定義
+    def run(self):
+        cap = cv2.VideoCapture(self.index)
+        if not cap.isOpened():
+            self.error.emit(f"カメラ {self.index} を開けません")
+            return
+        cam_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        t_prev = time.time()
+        try:
+            while self._run_flag:
+                ret, frame = cap.read() # 1フレーム取得
+                if not ret:
+                    self.error.emit("フレームを読み取れません")
+                    break
+                now = time.time()
+                self.fps = 0.9*self.fps + 0.1/max(now - t_prev, 1e-6)
+                t_prev = now
+                self._handle_record_request(frame, cam_fps)
+                if self.writer is not None:
+                    if self.writer.error is not None:
+                        self.error.emit(f"録画を書き出せません: {self.writer.error}")
+                        self._stop_writer(wait=False)
+                    else:
+                        self.writer.write(frame, now)
+                # プレビュー: 最新の1枚だけ（コピーしない。frame はこの後書き換えない）
+                with self._lock:
+                    self._latest = frame
+                    notify = not self._pending
+                    self._pending = True
+                if notify:
+                    self.frame_ready.emit()
+        finally:
+            self._stop_writer(wait=True)
+            # videoCaptureのリリース処理
+            cap.release()
+
+    def take_frame(self):
+        """最新のフレーム（GUI スレッドから）"""
+        with self._lock:
+            frame = self._latest
+            self._pending = False
+        return frame
+
+    def start_recording(self, out_dir=RECORD_DIR):
+        self._record_req = out_dir
+
+    def stop_recording(self):
+        self._record_req = False
+
+    @property
+    def dropped(self):
+        w = self.writer
+        return w.dropped if w is not None else 0
+
+    # スレッドが終了するまでwaitをかける
+    def stop(self):
+        self._run_flag = False
+        self.wait()
+
+    def _handle_record_request(self, frame, fps):
+        req = self._record_req
+        if req is None:
+            return
+        self._record_req = None
+        if req and self.writer is None:
+            h, w = frame.shape[:2]
+            self.writer = SegmentWriter(req, fps, (w, h), RECORD_SECTION_SEC, prefix="rec", fourcc=RECORD_FOURCC)
+            self.record_start = time.time()
+            self.recording_changed.emit(True, self.writer.path)
+        elif not req and self.writer is not None:
+            self._stop_writer(wait=False)
+
+    def _stop_writer(self, wait):
+        """録画を止める。書き出し待ちの分を書き切ってから閉じる（wait=False なら別スレッドで）"""
+        w = self.writer
+        if w is None:
+            return
+        self.writer = None
+        self.record_start = None
+        def close():
+            try:
+                w.close()
+            except Exception as e:
+                print(f"[ERROR] 録画の書き出しに失敗しました: {e}")
+            if w.dropped:
+                print(f"[WARN] 書き出しが追いつかず {w.dropped} フレームを落としました")
+            self.recording_changed.emit(False, w.path)
+        if wait:
+            close()
+        else:
+            threading.Thread(target=close, name="record-close", daemon=True).start()
 
-# class VideoThread(QThread):
-#     # シグナル設定
-#     change_pixmap_signal = pyqtSignal(np.ndarray)
-
-#     def __init__(self):
-#         super().__init__()
-#         self._run_flag = True
-
-#     # QThreadのrunメソッドを定義
-#     def run(self):
-#         cap = cv2.VideoCapture(0)
-#         while self._run_flag:
-#             ret, cv_img = cap.read() # 1フレーム取得
-#             # 新たなフレームを取得できたら
-#             # シグナル発信(cv_imgオブジェクトを発信)            
-#             if ret:
-#                 self.change_pixmap_signal.emit(cv_img)
-
-#         # videoCaptureのリリース処理
-#         cap.release()
-   
-#     # スレッドが終了するまでwaitをかける
-#     def stop(self):
-#         self._run_flag = False
-#         self.wait()
-
-
-# class App(QWidget):
-
-#     def __init__(self):
-#         super().__init__()
-
-#         self.image_label = QLabel(self)
-        
-#         # vboxにQLabelをセット
-#         vbox = QVBoxLayout()
-#         vbox.addWidget(self.image_label)
-
-#         # vboxをレイアウトとして配置
-#         self.setLayout(vbox)
-
-#         # ビデオキャプチャ用のスレッドオブジェクトを生成
-#         self.thread = VideoThread()
-#         # ビデオスレッド内のchange_pixmap_signalオブジェクトのシグナルに対するslot
-#         self.thread.change_pixmap_signal.connect(self.update_image)
-
-#         self.thread.start() # スレッドを起動
-
-#     def get_available_cameras(self):
-#             """利用可能なカメラを検出"""
-#             cameras = []
-#             for i in range(10):  # 最大10台までチェック
-#                 cap = cv2.VideoCapture(i)
-#                 if cap.isOpened():
-#                     cameras.append(f"カメラ {i}")
-#                     cap.release()
-#             return cameras
-    
-
-
-
-#     # 終了時にスレッドがシングルになるようにする
-#     def closeEvent(self,event):
-#         self.thread.stop()
-#         event.accept()
-
-
-#     @pyqtSlot(np.ndarray)
-#     def update_image(self, cv_img):
-#         #img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-#         # QT側でチャネル順BGRを指定
-#         qimg = QtGui.QImage(cv_img.tobytes(),cv_img.shape[1],cv_img.shape[0],cv_img.strides[0],QtGui.QImage.Format.Format_BGR888)
-#         qpix = QPixmap.fromImage(qimg)
-#         self.image_label.setPixmap(qpix)
-
-# if __name__ == "__main__":
-#    app = QApplication([])
-#    window = App()
-#    window.show()
-#    app.exec()
 
 class CameraApp(QMainWindow):
+    cameras_changed = pyqtSignal(list)      # 見張りスレッドからのカメラ一覧
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("アプリ")
@@ -137,64 +185,121 @@ class CameraApp(QMainWindow):
         self.v_layout.addWidget(self.record_stop_button)
         self.record_stop_button.setEnabled(False)  # 停止ボタンは初期状態で無効
 
-        # カメラリストを取得
-        self.available_cameras = self.get_available_cameras()
-        self.camera_selector.addItems(self.available_cameras)
-
-        # OpenCV関連
-        self.capture = None
+        # 状態表示（FPS / 録画時間 / 落としたフレーム数）
+        self.status_label = QLabel("")
+        self.v_layout.addWidget(self.status_label)
+
+        # カメラリスト: まず OS の候補とキャッシュから（開かないのですぐ出る）。
+        # 開いて確かめるのと抜き差しの見張りは裏のスレッドで、変わったら cameras_changed で入れ替える
+        self.thread = None
+        self.cameras = []
+        self.watcher = CameraWatcher(self.cameras_changed.emit,
+                                     busy=lambda: [self.thread.index] if self.thread is not None else [])
+        self.set_cameras(self.watcher.cameras())
+        self.cameras_changed.connect(self.set_cameras)
+        self.watcher.start()
+
+        # カメラの読み込みは VideoThread。タイマーは状態表示の更新だけ
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
+        self.timer.timeout.connect(self.update_status)
 
         self.recording = False  # 録画状態フラグ
-        self.video_writer = None  # 動画ライターオブジェクト
 
         # イベント接続
         self.connect_camera_button.clicked.connect(self.start_camera)
         self.record_start_button.clicked.connect(self.record_video)
         self.record_stop_button.clicked.connect(self.stop_recording)
 
-    def get_available_cameras(self):
-        """利用可能なカメラを検出"""
-        cameras = []
-        for i in range(10):  # 最大10台までチェック
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                cameras.append(f"カメラ {i}")
-                cap.release()
-        return cameras
+    @pyqtSlot(list)
+    def set_cameras(self, cameras):
+        """コンボボックスを入れ替える（選んでいたカメラは選んだまま）"""
+        i = self.camera_selector.currentIndex()
+        selected = self.cameras[i]["key"] if 0 <= i < len(self.cameras) else None
+        self.cameras = cameras
+        self.camera_selector.blockSignals(True)
+        self.camera_selector.clear()
+        self.camera_selector.addItems([label(c) for c in cameras])
+        keys = [c["key"] for c in cameras]
+        if selected in keys:
+            self.camera_selector.setCurrentIndex(keys.index(selected))
+        self.camera_selector.blockSignals(False)
 
     def start_camera(self):
         """選択したカメラを開始"""
-        camera_index = self.camera_selector.currentIndex()
-        if self.capture:
-            self.capture.release()
-        self.capture = cv2.VideoCapture(camera_index)
-        self.timer.start(30)  # 30msごとにフレーム更新
-
-    def update_frame(self):
-        """カメラフレームを更新"""
-        ret, frame = self.capture.read()
-        if ret:
-            # OpenCVのBGR画像をRGBに変換
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            height, width, channel = frame.shape
-            step = channel * width
-            q_image = QImage(frame.data, width, height, step, QImage.Format.Format_RGB888)
-            self.video_label.setPixmap(QPixmap.fromImage(q_image))
+        i = self.camera_selector.currentIndex()
+        if not 0 <= i < len(self.cameras):
+            self.status_label.setText("カメラが見つかりません")
+            return
+        if self.watcher.probing(self.cameras[i]["key"]):
+            self.status_label.setText("このカメラは確認中です。しばらくしてから接続してください")
+            return
+        camera_index = self.cameras[i]["index"]
+        self.stop_camera()
+        self.thread = VideoThread(camera_index)
+        # 別スレッドからのシグナルはキュー経由で GUI スレッドの slot に届く
+        self.thread.frame_ready.connect(self.update_image)
+        self.thread.recording_changed.connect(self.on_recording_changed)
+        self.thread.error.connect(self.status_label.setText)
+        self.thread.start() # スレッドを起動
+        self.timer.start(STATUS_MS)
+        self.record_start_button.setEnabled(True)
+
+    def stop_camera(self):
+        if self.thread is not None:
+            self.thread.stop()      # 録画中なら書き切って閉じる
+            self.thread = None
+        self.timer.stop()
+        self.recording = False
+        self.record_start_button.setEnabled(False)
+        self.record_stop_button.setEnabled(False)
+
+    @pyqtSlot()
+    def update_image(self):
+        """最新フレームを表示（溜まった古いフレームは読み込みスレッド側で捨てている）"""
+        frame = self.thread.take_frame() if self.thread is not None else None
+        if frame is None:
+            return
+        height, width = frame.shape[:2]
+        # QT側でチャネル順BGRを指定（変換もコピーもしない。QPixmap に移すときに1回だけ変換される）
+        q_image = QImage(frame.data, width, height, frame.strides[0], QImage.Format.Format_BGR888)
+        self.video_label.setPixmap(QPixmap.fromImage(q_image))
+
+    def update_status(self):
+        t = self.thread
+        if t is None:
+            return
+        text = f"{t.fps:5.1f} fps"
+        if t.record_start is not None:
+            sec = int(time.time() - t.record_start)
+            text += f"   REC {sec//3600:02d}:{sec//60%60:02d}:{sec%60:02d}"
+            if t.dropped:
+                text += f"   dropped {t.dropped}"
+        self.status_label.setText(text)
 
     def record_video(self):
-        
-        print("recording...")
-    
+        if self.thread is None or self.recording:
+            return
+        self.thread.start_recording(RECORD_DIR)
+        self.recording = True
+        self.record_start_button.setEnabled(False)
+        self.record_stop_button.setEnabled(True)
+
     def stop_recording(self):
-        print("stopped.")
+        if self.thread is None or not self.recording:
+            return
+        self.thread.stop_recording()
+        self.recording = False
+        self.record_stop_button.setEnabled(False)
+        self.record_start_button.setEnabled(True)
+
+    @pyqtSlot(bool, str)
+    def on_recording_changed(self, recording, path):
+        print(("recording: " if recording else "saved: ") + path)
 
     def closeEvent(self, event):
         """アプリ終了時にリソースを解放"""
-        if self.capture:
-            self.capture.release()
-        self.timer.stop()
+        self.watcher.stop(wait=False)   # 確かめ中のカメラを待たない
+        self.stop_camera()
         super().closeEvent(event)
 
 if __name__ == "__main__":
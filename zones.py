@@ -0,0 +1,276 @@
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from gate_counter import N_CLASSES
+from track_table import CountedWindow
+
+# 1カメラに複数のゾーン（多角形 / 向き付きの線）を置き、ゾーン別・方向別・クラス別に数える。
+#   - 多角形: 画素毎に「どのゾーンに入っているか」のビットを持つ表を最初に1回だけ塗っておき、
+#             検出の中心点はその表を1回引くだけで判定する（ゾーン数によらず1検出 O(1)）。
+#             前フレームのビットとの差で in（入った）/ out（出た）を出す
+#   - 線    : 前回中心 → 今回中心 の線分と交わったら通過。線の向き A→B の右側から左側へ抜けたら
+#             directions[0]、左側から右側なら directions[1]（画面上で見た左右）
+#   - 同じIDは ゾーン x 方向 ごとに1回だけ数える。ID毎の状態は GateCounter の TrackTable のスロットに合わせて持ち、
+#     数えたビットはID番号のリング（track_table.CountedWindow）にも残す。TTL で破棄された後に同じIDが
+#     見つかり直しても、新しいスロットにはそこから引き継ぐので二重に数えない
+#
+# 設定ファイル(JSON)の例（座標は 0〜1 ならフレームサイズに対する比率、それ以外はピクセル）:
+# {"zones": [
+#   {"name": "north", "type": "polygon", "points": [[0.30,0.05],[0.70,0.05],[0.65,0.35],[0.35,0.35]]},
+#   {"name": "stop",  "type": "line",    "points": [[0.20,0.60],[0.80,0.60]], "directions": ["up", "down"]}
+# ]}
+#   python zones.py check zones.json ./videos/test.mp4 --out zones.png   # 配置の確認
+#   python zones.py bench --zones 8 --boxes 100                          # 表引きと pointPolygonTest の比較
+
+MAX_ZONES = 32              # ビット表の幅（多角形と線の合計）
+POLYGON_DIRECTIONS = ("in", "out")
+LINE_DIRECTIONS = ("left", "right")
+COLORS = ((255,160,0), (0,200,255), (255,0,200), (0,255,120), (200,120,255), (255,255,0), (120,200,0), (0,120,255))
+
+
+def resolve_points(points, w, h):
+    """比率指定(0〜1)ならピクセルに直す"""
+    pts = np.asarray(points, np.float64).reshape(-1, 2)
+    if ((0.0 <= pts) & (pts <= 1.0)).all():
+        pts = pts * (w, h)
+    return np.round(pts).astype(np.int32)
+
+
+def load_zones(spec):
+    """JSONファイルのパス / {"zones": [...]} / ゾーンのリスト のどれかからゾーン定義のリストを返す"""
+    if isinstance(spec, str):
+        with open(spec, encoding="utf-8") as f:
+            spec = json.load(f)
+    zones = spec.get("zones", []) if isinstance(spec, dict) else list(spec)
+    for i, z in enumerate(zones):
+        kind = z.get("type", "polygon")
+        n = len(z.get("points", []))
+        if kind not in ("polygon", "line"):
+            raise ValueError(f"zone {i}: type は polygon / line: {kind}")
+        if (kind == "polygon" and n < 3) or (kind == "line" and n != 2):
+            raise ValueError(f"zone {i}: points の数が不正です（polygon は3点以上、line は2点）")
+        d = z.get("directions")
+        if d is not None and (isinstance(d, str) or len(d) != 2):
+            raise ValueError(f"zone {i}: directions は2つの名前のリストです"
+                             f"（polygon は入る/出る、line は左へ/右へ）: {d}")
+    if len(zones) > MAX_ZONES:
+        raise ValueError(f"ゾーンは {MAX_ZONES} 個まで: {len(zones)}")
+    return zones
+
+
+class ZoneMap:
+    """フレームサイズに合わせたゾーンの形（画素毎のビット表と線分）。作ったら書き換えない"""
+
+    def __init__(self, zones, w, h):
+        self.w, self.h = w, h
+        self.names = [z.get("name", f"zone{i}") for i, z in enumerate(zones)]
+        self.kinds = [z.get("type", "polygon") for z in zones]
+        self.points = [resolve_points(z["points"], w, h) for z in zones]
+        self.directions = [tuple(z.get("directions") or (LINE_DIRECTIONS if k == "line" else POLYGON_DIRECTIONS))
+                           for z, k in zip(zones, self.kinds)]
+
+        # 多角形: bit i = ゾーン i に入っている（重なったゾーンは両方のビットが立つ）
+        dtype = np.uint8 if len(zones) <= 8 else np.uint16 if len(zones) <= 16 else np.uint32
+        self.lookup = np.zeros((h, w), dtype)
+        scratch = np.zeros((h, w), np.uint8)
+        for i, (k, pts) in enumerate(zip(self.kinds, self.points)):
+            if k != "polygon":
+                continue
+            scratch[:] = 0
+            cv2.fillPoly(scratch, [pts], 1)
+            self.lookup[scratch > 0] |= dtype(1 << i)
+
+        # 線: (L,) のゾーン番号と端点
+        self.line_zone = np.array([i for i, k in enumerate(self.kinds) if k == "line"], np.int64)
+        seg = np.array([self.points[i] for i in self.line_zone], np.float64).reshape(-1, 2, 2)
+        self.la, self.lb = seg[:, 0], seg[:, 1]
+
+    def __len__(self):
+        return len(self.names)
+
+    def counter(self, capacity):
+        """ID状態の表（TrackTable）と同じ容量のカウンタを作る"""
+        return ZoneCounter(self, capacity)
+
+    def bits_at(self, cx, cy):
+        """中心点の入っている多角形のビット（画面外は端に寄せる）"""
+        return self.lookup[np.clip(cy, 0, self.h-1), np.clip(cx, 0, self.w-1)].astype(np.int64)
+
+    def crossings(self, pcx, pcy, cx, cy):
+        """前回中心→今回中心 の線分が交わる線を返す: (検出番号, ゾーン番号, 方向 0/1)"""
+        empty = np.zeros(0, np.int64)
+        if len(self.line_zone) == 0 or len(cx) == 0:
+            return empty, empty, empty
+        moved = np.flatnonzero((pcx != cx) | (pcy != cy))
+        if len(moved) == 0:
+            return empty, empty, empty
+        p = np.stack([pcx[moved], pcy[moved]], 1).astype(np.float64)[:, None]     # (N,1,2)
+        c = np.stack([cx[moved], cy[moved]], 1).astype(np.float64)[:, None]
+        a, b = self.la[None], self.lb[None]                                       # (1,L,2)
+        def cross(o, u, v):
+            return (u[..., 0]-o[..., 0])*(v[..., 1]-o[..., 1]) - (u[..., 1]-o[..., 1])*(v[..., 0]-o[..., 0])
+        # 線 A→B に対して前回/今回がどちら側か（0 は左側に含める）と、移動の線分に対して A/B がどちら側か
+        right_p = cross(a, b, p) > 0
+        right_c = cross(a, b, c) > 0
+        hit = (right_p != right_c) & (cross(p, c, a) * cross(p, c, b) <= 0)
+        n, l = np.nonzero(hit)
+        return moved[n], self.line_zone[l], np.where(right_p[n, l], 0, 1).astype(np.int64)
+
+    def draw(self, img, counter=None, s=1.0):
+        """ゾーンの形と（counter があれば）方向別の合計を描く（s: 描き先の縮尺）"""
+        totals = counter.totals() if counter is not None else None
+        for i, (name, k, pts) in enumerate(zip(self.names, self.kinds, self.points)):
+            color = COLORS[i % len(COLORS)]
+            if s != 1.0:
+                pts = np.round(pts * s).astype(np.int32)
+            if k == "polygon":
+                cv2.polylines(img, [pts], True, color, 2)
+            else:
+                cv2.arrowedLine(img, tuple(pts[0].tolist()), tuple(pts[1].tolist()), color, 2, tipLength=0.03)
+            label = name
+            if totals is not None:
+                label += " " + " ".join(f"{d}:{n}" for d, n in zip(self.directions[i], totals[i]))
+            org = (int(pts[:, 0].min()), max(15, int(pts[:, 1].min()) - 6))
+            cv2.putText(img, label, org, cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0,0,0), 3, cv2.LINE_AA)
+            cv2.putText(img, label, org, cv2.FONT_HERSHEY_SIMPLEX, 0.55, color, 1, cv2.LINE_AA)
+
+
+class ZoneCounter:
+    """ゾーン別・方向別・クラス別のカウントとID毎のゾーン状態（GateCounter のロックの中で呼ばれる）"""
+
+    def __init__(self, zmap, capacity):
+        self.map = zmap
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.bits = np.zeros(self.capacity, np.int64)         # スロット毎: 前フレームで入っていた多角形
+        self.counted = np.zeros(self.capacity, np.uint64)     # スロット毎: bit 2*zone+dir = 数えた
+        self.window = CountedWindow(dtype=np.uint64)          # ID番号毎: 同じビット（スロットを離れても残す）
+        self.counts = np.zeros((len(self.map), 2, N_CLASSES), np.int64)   # [ゾーン, 方向, クラス]
+
+    def update(self, ids, slots, new, cls, pcx, pcy, cx, cy):
+        """1フレーム分を判定して (検出番号, ゾーン番号, 方向) の配列を返す（今回数えた分だけ）
+
+        new は新しく割り当てたスロット（前回中心も前回のゾーンも無いので判定しない）
+        """
+        zmap = self.map
+        cur = zmap.bits_at(cx, cy)
+        prev = np.where(new, cur, self.bits[slots])
+        self.bits[slots] = cur
+        # 新しいスロットは ID番号のリングから（TTL で破棄された後に見つかり直したIDは数えた分を引き継ぐ）
+        self.counted[slots[new]] = self.window.get(ids[new])
+
+        det = []; zone = []; dirs = []
+        # 多角形: ビットが変わった検出だけ展開する（たいていのフレームは0件）
+        changed = np.flatnonzero(cur != prev)
+        for n in changed.tolist():
+            c, p = int(cur[n]), int(prev[n])
+            for d, bits in ((0, c & ~p), (1, p & ~c)):
+                while bits:
+                    z = (bits & -bits).bit_length() - 1
+                    bits &= bits - 1
+                    det.append(n); zone.append(z); dirs.append(d)
+        # 線: 前回中心がある検出だけ
+        old = np.flatnonzero(~new)
+        ln, lz, ld = zmap.crossings(pcx[old], pcy[old], cx[old], cy[old])
+        det = np.concatenate([np.asarray(det, np.int64), old[ln]])
+        zone = np.concatenate([np.asarray(zone, np.int64), lz])
+        dirs = np.concatenate([np.asarray(dirs, np.int64), ld])
+        if len(det) == 0:
+            return det, zone, dirs
+
+        # 同じID x ゾーン x 方向 は1回だけ
+        bit = np.left_shift(np.uint64(1), (2*zone + dirs).astype(np.uint64))
+        first = (self.counted[slots[det]] & bit) == 0
+        det, zone, dirs, bit = det[first], zone[first], dirs[first], bit[first]
+        np.bitwise_or.at(self.counted, slots[det], bit)
+        self.window.set_bits(ids[det], bit)
+        c = cls[det]
+        ok = (c >= 0) & (c < N_CLASSES)
+        np.add.at(self.counts, (zone[ok], dirs[ok], c[ok]), 1)
+        return det, zone, dirs
+
+    def totals(self):
+        """(ゾーン数, 2) の方向別合計"""
+        return self.counts.sum(2).tolist()
+
+    def summary(self):
+        """{ゾーン名: {方向名: {"total": n, "by_class": {クラス: n}}}}"""
+        out = {}
+        for i, name in enumerate(self.map.names):
+            out[name] = {d: {"total": int(self.counts[i, k].sum()),
+                             "by_class": {str(c): int(v) for c, v in enumerate(self.counts[i, k]) if v}}
+                         for k, d in enumerate(self.map.directions[i])}
+        return out
+
+
+def bench(n_zones, n_boxes, frames=2000, w=1920, h=1080, seed=0):
+    """中心点の判定: ビット表を1回引く vs ゾーン毎に cv2.pointPolygonTest（1フレームあたり ms）"""
+    rng = np.random.default_rng(seed)
+    zones = []
+    for i in range(n_zones):
+        cx, cy, r = rng.uniform(0.2, 0.8), rng.uniform(0.2, 0.8), rng.uniform(0.05, 0.2)
+        ang = np.sort(rng.uniform(0, 2*np.pi, 6))
+        zones.append({"name": f"z{i}", "points": np.stack([cx + r*np.cos(ang), cy + r*np.sin(ang)], 1).clip(0, 1).tolist()})
+    t0 = time.perf_counter()
+    zmap = ZoneMap(zones, w, h)
+    t_build = time.perf_counter() - t0
+    pts = rng.integers(0, (w, h), (frames, n_boxes, 2))
+
+    t0 = time.perf_counter()
+    for p in pts:
+        zmap.bits_at(p[:, 0], p[:, 1])
+    t_lookup = (time.perf_counter() - t0) / frames
+
+    contours = [pts_.reshape(-1, 1, 2) for pts_ in zmap.points]
+    n = min(frames, 200)
+    t0 = time.perf_counter()
+    for p in pts[:n]:
+        for x, y in p.tolist():
+            for cnt in contours:
+                cv2.pointPolygonTest(cnt, (x, y), False)
+    t_poly = (time.perf_counter() - t0) / n
+    return {"zones": n_zones, "boxes": n_boxes, "build_ms": round(t_build*1e3, 2),
+            "lookup_ms": round(t_lookup*1e3, 4), "point_polygon_ms": round(t_poly*1e3, 4),
+            "lookup_mb": round(zmap.lookup.nbytes / 2**20, 1)}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="ゾーン設定の確認とベンチマーク")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ck = sub.add_parser("check", help="ゾーンを先頭フレームに描いて保存")
+    ck.add_argument("zones", help="ゾーン設定のJSONファイル")
+    ck.add_argument("source", help="動画 / 画像 / カメラ番号")
+    ck.add_argument("--out", default="zones.png")
+    bn = sub.add_parser("bench", help="ゾーン数・検出数を変えて判定時間を比べる")
+    bn.add_argument("--zones", type=int, nargs="+", default=[1, 4, 8, 16])
+    bn.add_argument("--boxes", type=int, nargs="+", default=[10, 100])
+    args = ap.parse_args()
+
+    if args.cmd == "check":
+        cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+        ok, frame = cap.read()
+        cap.release()
+        if not ok:
+            raise SystemExit(f"[ERROR] フレームが読めませんでした: {args.source}")
+        h, w = frame.shape[:2]
+        zmap = ZoneMap(load_zones(args.zones), w, h)
+        # 多角形の塗り分け（表がどう塗られたか）を半透明で重ねる
+        tint = np.zeros_like(frame)
+        for i in range(len(zmap)):
+            tint[((zmap.lookup >> i) & 1) > 0] = COLORS[i % len(COLORS)]
+        frame = cv2.addWeighted(frame, 1.0, tint, 0.35, 0)
+        zmap.draw(frame)
+        cv2.imwrite(args.out, frame)
+        for name, k, d in zip(zmap.names, zmap.kinds, zmap.directions):
+            print(f"{name:12s} {k:8s} directions={'/'.join(d)}")
+        print(f"saved: {args.out}")
+    else:
+        print(f"{'zones':>5s} {'boxes':>5s} {'build ms':>9s} {'lookup ms':>10s} {'pointPolygonTest ms':>20s}")
+        for nz in args.zones:
+            for nb in args.boxes:
+                r = bench(nz, nb)
+                print(f"{nz:5d} {nb:5d} {r['build_ms']:9.2f} {r['lookup_ms']:10.4f} {r['point_polygon_ms']:20.4f}")